@@ -0,0 +1,119 @@
+from datetime import datetime, date, timedelta
+import pandas as pd
+
+from schema import epoch
+from db import reader
+
+# Consultas agregadas sin Streamlit. Igual que report_pdf, reciben un db_loader(query, params=())
+# que devuelve un DataFrame: en la app es load_df (cacheado), fuera de ella sqlite_loader().
+
+PERIODS = ["Todo", "Hoy", "Semana", "Mes", "Personalizado"]
+
+def sqlite_loader(path=None):
+    def load(query, params=()):
+        return pd.read_sql(query, reader(path), params=params)
+    return load
+
+def period_range(kind, today=None, custom=None):
+    """(inicio, fin) semiabierto para un periodo; (None, None) = todo el historial."""
+    today = today or date.today()
+    if kind == "Hoy":
+        start, end = today, today + timedelta(days=1)
+    elif kind == "Semana":
+        start = today - timedelta(days=today.weekday()); end = start + timedelta(days=7)
+    elif kind == "Mes":
+        start = today.replace(day=1); end = (start + timedelta(days=32)).replace(day=1)
+    elif kind == "Personalizado" and custom:
+        start, end = custom[0], custom[-1] + timedelta(days=1)
+    else:
+        return None, None
+    return datetime(start.year, start.month, start.day), datetime(end.year, end.month, end.day)
+
+def _range(col, start, end):
+    cond, params = [], []
+    if start is not None: cond.append(f"{col} >= ?"); params.append(epoch(start))
+    if end is not None: cond.append(f"{col} < ?"); params.append(epoch(end))
+    return (" WHERE " + " AND ".join(cond)) if cond else "", params
+
+def kpis(db_loader, start=None, end=None, archive=None):
+    """Ventas, costo de ventas (costo unitario actual), margen y merma valorizada en el rango.
+    archive: archivo Parquet de la base (archive.py) para leer de ahí los meses cerrados."""
+    if archive is not None: return archive.kpis(db_loader, start, end)
+    w_sales, p_sales = _range("sold_at_epoch", start, end)
+    w_items, p_items = _range("s.sold_at_epoch", start, end)
+    w_waste, p_waste = _range("ts_epoch", start, end)
+    # Sin rango no hace falta unir con sales (mismo resultado que antes: todos los sale_items)
+    items_from = "sale_items si JOIN products p ON p.id=si.product_id" + (" JOIN sales s ON s.id=si.sale_id" if p_items else "")
+    df = db_loader(f"""SELECT
+        (SELECT COALESCE(SUM(total), 0) FROM sales{w_sales}) AS sales,
+        (SELECT COALESCE(SUM(si.qty*p.unit_cost), 0) FROM {items_from}{w_items}) AS cogs,
+        (SELECT COALESCE(SUM(qty*unit_cost_est), 0) FROM waste{w_waste}) AS waste""",
+        tuple(p_sales + p_items + p_waste))
+    r = df.iloc[0]
+    sales, cogs, waste = float(r['sales']), float(r['cogs']), float(r['waste'])
+    return {"sales": sales, "cogs": cogs, "margin": sales - cogs, "waste": waste}
+
+# Lecturas de los rollups daily_totals y daily_product_sales: el costo depende de días × SKUs, no
+# del número de ventas
+
+def daily_sales(db_loader, start_day=None, archive=None):
+    """[day, total, cost]: total = SUM(sales.total) del día (como el KPI "Ventas"), cost = costo de las líneas."""
+    if archive is not None: return archive.daily_sales(db_loader, start_day)
+    where, params = ("WHERE day >= ?", (str(start_day),)) if start_day else ("", ())
+    return db_loader(f"""SELECT t.day, t.total, COALESCE(c.cost, 0) AS cost FROM daily_totals t
+        LEFT JOIN (SELECT day, SUM(cost) AS cost FROM daily_product_sales {where} GROUP BY day) c ON c.day=t.day
+        WHERE t.sales <> 0{" AND t.day >= ?" if start_day else ""} ORDER BY t.day""", params * 2)
+
+def weekly_monthly(db_loader, archive=None):
+    """(semanal, mensual) con columnas [periodo, total]."""
+    return weekly_monthly_from(daily_sales(db_loader, archive=archive))
+
+def weekly_monthly_from(d):
+    """weekly_monthly a partir de un daily_sales ya cargado (p.ej. la suma de varios locales)."""
+    if d.empty: return d, d
+    day = pd.to_datetime(d['day'])
+    weekly = d.groupby(day.dt.to_period('W').rename('week'))['total'].sum().reset_index()
+    monthly = d.groupby(day.dt.to_period('M').rename('month'))['total'].sum().reset_index()
+    return weekly, monthly
+
+def demand_stats(db_loader, days=28, today=None):
+    """Media y desviación diaria por producto (sobre los días con venta) en los últimos `days` días."""
+    start = (today or date.today()) - timedelta(days=days)
+    g = db_loader("SELECT product_id, day, qty FROM daily_product_sales WHERE day >= ? AND qty > 0", (start.isoformat(),))
+    if g.empty: return pd.DataFrame(columns=["product_id","mean_daily","std_daily"])
+    stats = g.groupby('product_id')['qty'].agg(['mean','std']).reset_index().rename(columns={'mean':'mean_daily','std':'std_daily'})
+    stats['std_daily'] = stats['std_daily'].fillna(0.0)
+    return stats
+
+# Reposiciones (ROP) y liquidaciones: misma lógica que el panel del Dashboard, sin widgets
+
+REPO_COLS = ["sku","name","category","stock","mean_daily","std_daily","ROP","sug_repo","necesita_repo"]
+LIQ_COLS = ["sku","name","lot_code","qty_current","days_left","proj_demand_until_exp","exceso","sugerencia"]
+
+def replenishment(db_loader, stats, lead=3, cover=7, z=1.28):
+    """Productos bajo su punto de reorden, con la reposición sugerida para `cover` días."""
+    df = db_loader("""SELECT p.id, p.sku, p.name, p.category, COALESCE(s.stock, 0) AS stock FROM products p
+        LEFT JOIN (SELECT product_id, SUM(qty_current) AS stock FROM lots WHERE status='vigente' AND qty_current>0 GROUP BY product_id) s ON s.product_id=p.id""")
+    df = df.merge(stats, left_on='id', right_on='product_id', how='left')
+    df['mean_daily']=df['mean_daily'].fillna(0.0); df['std_daily']=df['std_daily'].fillna(0.0)
+    df['ROP'] = df['mean_daily']*lead + z*df['std_daily']
+    df['sug_repo'] = (df['mean_daily']*cover + z*df['std_daily'] - df['stock']).clip(lower=0).round(0)
+    df['necesita_repo'] = df['stock'] < df['ROP']
+    return df.loc[df['necesita_repo'], REPO_COLS].sort_values("sug_repo", ascending=False)
+
+def liquidation(db_loader, stats, now=None, days=7):
+    """Lotes que vencen en ≤`days` días con más stock que la demanda proyectada hasta el vencimiento."""
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    # days_left = floor(expiration-now) <= days  <=>  expiration < now + days + 1
+    lots = db_loader("""SELECT l.product_id, p.sku, p.name, l.lot_code, l.qty_current, l.expiration FROM lots l
+        JOIN products p ON p.id=l.product_id WHERE l.status='vigente' AND l.qty_current>0 AND l.expiration_epoch < ?""",
+                     (epoch(now + timedelta(days=days + 1)),))
+    if lots.empty: return pd.DataFrame(columns=LIQ_COLS)
+    lots['days_left'] = (pd.to_datetime(lots['expiration']) - pd.Timestamp(now)).dt.days
+    soon = lots.merge(stats[['product_id','mean_daily']], on='product_id', how='left')
+    soon['mean_daily'] = soon['mean_daily'].fillna(0.0)
+    soon['proj_demand_until_exp'] = (soon['mean_daily']*soon['days_left'].clip(lower=0)).round(1)
+    soon['exceso'] = (soon['qty_current']-soon['proj_demand_until_exp']).round(0)
+    liq = soon[soon['exceso']>0].copy()
+    liq['sugerencia'] = "Aplicar promo/liquidación inmediata"
+    return liq[LIQ_COLS].sort_values("exceso", ascending=False)
@@ -1,16 +1,32 @@
-import sqlite3, os, json
+import sqlite3, os, json, tracemalloc
 import pandas as pd
 import numpy as np
 import streamlit as st
+from concurrent.futures import Future
 from datetime import datetime, timedelta, date
-import matplotlib.pyplot as plt
-from apscheduler.schedulers.background import BackgroundScheduler
 from pathlib import Path
 
-from report_pdf import build_weekly_monthly_pdf, build_executive_pdf
-from emailer import send_email
-
-DB = "pascucci.db"
+# Reportes PDF (reportlab, matplotlib), correo y scheduler se importan al usarse: la mayoría de las
+# sesiones no genera PDFs y el arranque no los paga (`python bench.py imports` vigila el presupuesto)
+from schema import epoch
+from db import reader, transaction, use, resolve
+from analytics import PERIODS, period_range, kpis, weekly_monthly, replenishment, liquidation
+import rollup
+import margins
+import fefo
+import importer
+import exporter
+from qcache import QueryCache
+import snapshots
+import backups
+import audit
+import paging
+import forecast
+import stores
+import lifecycle
+import archive
+import profiler
+import outbox
 APP_NAME = "Pascucci Smart Inventory"
 
 PRIMARY = "#E21A22"; BLACK="#111111"; CARBON="#1F2937"; LIGHT="#E5E7EB"; WHITE="#FFFFFF"
@@ -18,186 +34,268 @@ SUCCESS="#2E7D32"; WARN="#F59E0B"; CRIT="#DC2626"
 
 st.set_page_config(page_title=APP_NAME, layout="wide")
 
-def conn():
-    return sqlite3.connect(DB, check_same_thread=False)
-
-@st.cache_data(ttl=300)
-def load_df(query):
-    with conn() as c:
-        return pd.read_sql(query, c)
+@st.cache_resource
+def _query_cache(path):
+    return QueryCache(path=path)
+
+def load_df(query, params=(), cache=None):
+    # Cacheado hasta que se escriba alguna tabla de la consulta (qcache.py), sin TTL; un caché por local
+    cache = cache or _query_cache(resolve())
+    with profiler.query(query, params, cache.path) as q:
+        q.cached = True
+        def load():
+            q.cached = False
+            return pd.read_sql(query, reader(cache.path), params=params)
+        df = cache.get(query, params, load); q.rows = len(df)
+    return df
+
+def _fetch_df(cur):
+    try:
+        rows = cur.fetchall()
+        cols = [d[0] for d in cur.description] if cur.description else []
+        return pd.DataFrame(rows, columns=cols)
+    except:
+        return pd.DataFrame()
 
 def run_sql(query, params=(), commit=False):
-    with conn() as c:
-        cur = c.cursor()
-        cur.execute(query, params)
-        if commit: c.commit()
-        try:
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description] if cur.description else []
-            return pd.DataFrame(rows, columns=cols)
-        except:
-            return pd.DataFrame()
+    with profiler.query(query, params) as q:
+        if not commit:
+            df = _fetch_df(reader().execute(query, params))
+        else:
+            with transaction() as c:
+                df = _fetch_df(c.execute(query, params))
+        q.rows = len(df)
+    return df
 
 def title_bar():
     st.markdown(f"<h2 style='color:{PRIMARY};margin-bottom:0'>{APP_NAME}</h2>", unsafe_allow_html=True)
     st.caption("PC & Tablet • CLP • FEFO • IA: ROP/Liquidaciones • Reportes y correo programado • Auditoría y Backups")
 
 def log_audit(entity, entity_id, action, diff_json):
+    # En cola: se escribe por lotes en segundo plano (audit.py)
     try:
-        run_sql("INSERT INTO audit(entity, entity_id, action, user, diff_json) VALUES(?,?,?,?,?)",
-                (entity, int(entity_id) if entity_id else None, action, "local", json.dumps(diff_json, ensure_ascii=False)), commit=True)
+        audit.log(entity, entity_id, action, diff_json)
     except Exception as e:
         print("Audit log error:", e)
 
-# Scheduler (email weekly/monthly + daily backup)
-_scheduler = None
+@st.cache_resource
+def _report_service(path):
+    # PDFs generados fuera del hilo de la página y cacheados por versión de datos (reports.py)
+    # El caché se fija aquí: los hilos de trabajo no tienen contexto de Streamlit ni local elegido
+    from reports import ReportService
+    qc = _query_cache(path)
+    return ReportService(lambda query, params=(): load_df(query, params, qc), path)
+
+@st.cache_resource
+def _chain():
+    # Vista "Todas": consultas a todos los locales en un pool de procesos (stores.py)
+    return stores.Chain(STORES)
+
+# Scheduler (email weekly/monthly + daily backup + fotos ROP/liquidación)
+def _queue_report_email(path, subject, body, to_emails=None, done=None):
+    # Genera el PDF y lo deja en la bandeja de salida (outbox.py); el envío va aparte, con reintentos.
+    # done (Future): resultado para la página (id del correo o el error), que no ve los del scheduler
+    try:
+        to_emails = to_emails or outbox.recipients(outbox.load_config())
+        pdf_path = _report_service(path).get("semanal_mensual")
+        row_id = outbox.enqueue(path, to_emails, subject, body, [pdf_path])
+    except Exception as e:
+        if done is None: raise
+        done.set_exception(e); return
+    if done is not None: done.set_result(row_id)
+    _job_send_outbox([path])
+
 def _job_send_report_email():
-    cfg_path = Path("email_config.json")
-    if not cfg_path.exists(): return
     try:
-        cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
-        if not cfg.get("scheduler_enabled", False): return
-        pdf_path = build_weekly_monthly_pdf(load_df, out_path="resumen_pascucci.pdf")
-        send_email(cfg["smtp_host"], int(cfg["smtp_port"]), cfg["username"], cfg["password"],
-                   cfg.get("to_emails", []),
-                   subject="[Pascucci Smart Inventory] Reporte programado",
-                   body="Adjunto reporte programado.",
-                   attachments=[pdf_path])
+        cfg = outbox.load_config()
+        if not cfg or not cfg.get("scheduler_enabled", False): return
+        _queue_report_email(next(iter(STORES.values())), "[Pascucci Smart Inventory] Reporte programado", "Adjunto reporte programado.")
     except Exception as e:
         print("Scheduler email error:", e)
 
+def _job_send_outbox(paths=None):
+    # Correos pendientes y reintentos vencidos, por local (una sesión SMTP por lote)
+    for path in paths or STORES.values():
+        try:
+            r = outbox.send_due(path)
+            if r["pendiente"] or r["fallido"]: print(f"Correo ({path}): {r['enviado']} enviados, {r['pendiente']} reprogramados, {r['fallido']} fallidos")
+        except Exception as e:
+            print(f"Outbox job error ({path}):", e)
+
 def _job_backup_daily():
-    try:
-        os.makedirs("backups", exist_ok=True)
-        ts = datetime.now().strftime("%Y%m%d_%H%M")
-        import shutil
-        shutil.copyfile(DB, f"backups/pascucci_{ts}.db")
-    except Exception as e:
-        print("Backup job error:", e)
+    for name, path in STORES.items():
+        try:
+            b = backups.backup(path, stores.backup_dir(path))
+            print(f"Backup {name} {b['file']}: {b['bytes']/2**20:.1f} MB en {b['seconds']:.1f}s, integridad {b['integrity']}")
+        except Exception as e:
+            print(f"Backup job error ({name}):", e)
 
-def _ensure_scheduler():
-    global _scheduler
-    if _scheduler is not None: return _scheduler
-    _scheduler = BackgroundScheduler(daemon=True)
-    _scheduler.add_job(_job_send_report_email, "cron", day_of_week="mon", hour=8, minute=0)
-    _scheduler.add_job(_job_send_report_email, "cron", day=1, hour=8, minute=0)
-    _scheduler.add_job(_job_backup_daily, "cron", hour=2, minute=0)
-    _scheduler.start()
-    return _scheduler
+def _job_refresh_snapshots(force=False, paths=None):
+    for path in paths or STORES.values():
+        try:
+            snapshots.refresh(path) if force else snapshots.refresh_if_stale(path)
+        except Exception as e:
+            print(f"Snapshot job error ({path}):", e)
 
+def _job_lot_sweep():
+    # Lotes agotados -> vendido, vencidos -> vencido (y a merma si está activado), por local
+    for name, path in STORES.items():
+        try:
+            r = lifecycle.sweep(path)
+            if r["vendidos"] or r["vencidos"]: print(f"Lotes {name}: {r['vendidos']} agotados, {r['vencidos']} vencidos, {r['merma']} u. a merma")
+        except Exception as e:
+            print(f"Lot sweep error ({name}):", e)
+
+def _job_archive_sync():
+    # Meses cerrados -> Parquet, en los locales con el motor Parquet activo
+    for name, path in STORES.items():
+        try:
+            if archive.enabled(path):
+                w = archive.sync(path)
+                if w: print(f"Archivo {name}: " + ", ".join(f"{t} {len(m)} meses" for t, m in w.items()))
+        except Exception as e:
+            print(f"Archive sync error ({name}):", e)
+
+@st.cache_resource
+def _ensure_scheduler():
+    # Un scheduler por proceso (cache_resource sobrevive a los reruns de Streamlit)
+    from apscheduler.schedulers.background import BackgroundScheduler
+    sched = BackgroundScheduler(daemon=True)
+    sched.add_job(_job_send_report_email, "cron", day_of_week="mon", hour=8, minute=0)
+    sched.add_job(_job_send_report_email, "cron", day=1, hour=8, minute=0)
+    sched.add_job(_job_backup_daily, "cron", hour=2, minute=0)
+    sched.add_job(_job_lot_sweep, "cron", hour=0, minute=5, next_run_time=datetime.now())
+    sched.add_job(_job_archive_sync, "cron", hour=1, minute=0)
+    sched.add_job(_job_refresh_snapshots, "interval", minutes=15, next_run_time=datetime.now())
+    sched.add_job(_job_send_outbox, "interval", seconds=30, next_run_time=datetime.now())
+    sched.start()
+    return sched
+
+def _refresh_snapshots_soon():
+    # Tras escrituras grandes o cambio de parámetros: en el hilo del scheduler, sin bloquear la página
+    _ensure_scheduler().add_job(_job_refresh_snapshots, kwargs={"force": True, "paths": [resolve()]})
+
+STORES = stores.load()
 title_bar()
-section = st.sidebar.radio("Módulos", ["Dashboard","Productos","Compras/Lotes","Ventas","Mermas","Promociones","Proveedores","Importar/Exportar","Ajustes & Reportes","Auditoría"])
+# Con varios locales (stores.json) cada uno trabaja sobre su base; "Todas" muestra la cadena consolidada
+store = st.sidebar.selectbox("Local", list(STORES) + [stores.ALL]) if len(STORES) > 1 else next(iter(STORES))
+use(STORES.get(store))
+# "Rendimiento" sólo aparece con ?perf=1 en la URL
+section = st.sidebar.radio("Módulos", ["Dashboard","Productos","Compras/Lotes","Ventas","Mermas","Promociones","Proveedores","Importar/Exportar","Ajustes & Reportes","Auditoría"]
+                           + ["Rendimiento"] * ("perf" in st.query_params))
 
 # Helpers
 def get_products(): return load_df("SELECT * FROM products")
-def get_sales(): return load_df("SELECT * FROM sales")
-def get_sale_items(): return load_df("SELECT * FROM sale_items")
-def get_waste(): return load_df("SELECT * FROM waste")
 
+def filter_bar(key, products=None, **choices):
+    """Filtros de una tabla paginada: rango de fechas, producto (nombre -> id) y listas de opciones."""
+    cols = st.columns(2 + bool(products) + len(choices))
+    rng = cols[0].date_input("Fechas", value=(), key=f"{key}_fechas")
+    f = {"start": rng[0] if rng else None, "end": rng[1] + timedelta(days=1) if len(rng) == 2 else None}
+    if products:
+        name = cols[1].selectbox("Producto", ["Todos"] + list(products), key=f"{key}_producto")
+        f["product_id"] = None if name == "Todos" else int(products[name])
+    for col, (name, (label, options)) in zip(cols[1 + bool(products):], choices.items()):
+        v = col.selectbox(label, ["Todos"] + options, key=f"{key}_{name}")
+        f[name] = None if v == "Todos" else v
+    return f
+
+def paged_table(view, filters, key, size=paging.PAGE_SIZE):
+    """Tabla paginada en la base (paging.py): sólo viaja la página visible. Devuelve su DataFrame."""
+    state = st.session_state.setdefault(f"{key}_pages", {"filters": None, "cursors": [None]})
+    sig = json.dumps([resolve(), filters], default=str, sort_keys=True)
+    if state["filters"] != sig: state.update(filters=sig, cursors=[None])  # filtros nuevos: a la 1ª página
+    df, nxt = paging.page(load_df, view, filters, state["cursors"][-1], size)
+    total, i = paging.count(load_df, view, filters), len(state["cursors"])
+    st.dataframe(df, hide_index=True)
+    c1, c2, c3 = st.columns([1, 1, 4])
+    if c1.button("◀ Anterior", key=f"{key}_prev", disabled=i == 1):
+        state["cursors"].pop(); st.rerun()
+    if c2.button("Siguiente ▶", key=f"{key}_next", disabled=nxt is None):
+        state["cursors"].append(nxt); st.rerun()
+    c3.caption(f"Página {i} de {max(1, -(-total // size)):,} · {total:,} filas")
+    return df
+
+@profiler.timed
 def kpi_cards():
-    sales = get_sales(); si = get_sale_items(); prods = get_products()
-    total_sales = sales['total'].sum() if not sales.empty else 0.0
-    if not si.empty and not prods.empty:
-        m = si.merge(prods[['id','unit_cost']], left_on='product_id', right_on='id', how='left')
-        cogs = (m['qty']*m['unit_cost']).sum()
-    else:
-        cogs = 0.0
-    margin = total_sales - cogs
-    waste = get_waste(); wcost = (waste['qty']*waste['unit_cost_est']).sum() if not waste.empty else 0.0
+    period = st.radio("Periodo KPIs", PERIODS, horizontal=True)
+    custom = st.date_input("Rango", value=(date.today()-timedelta(days=6), date.today())) if period == "Personalizado" else None
+    start, end = period_range(period, custom=custom)
+    k = kpis(load_df, start, end, archive.active())
     c1,c2,c3 = st.columns(3)
-    c1.metric("Ventas (CLP)", f"{int(total_sales):,}".replace(",","."))
-    c2.metric("Margen estimado (CLP)", f"{int(margin):,}".replace(",","."))
-    c3.metric("Merma (CLP)", f"{int(wcost):,}".replace(",","."))
-
-def _demand_stats_last_28d():
-    sales = get_sales(); si = get_sale_items()
-    if sales.empty or si.empty:
-        return pd.DataFrame(columns=["product_id","mean_daily","std_daily"])
-    sales['sold_at'] = pd.to_datetime(sales['sold_at'])
-    cutoff = pd.Timestamp.now() - pd.Timedelta(days=28)
-    s28 = sales[sales['sold_at']>=cutoff]
-    if s28.empty: return pd.DataFrame(columns=["product_id","mean_daily","std_daily"])
-    m = si.merge(s28[['id','sold_at']], left_on='sale_id', right_on='id', how='inner')
-    m['day'] = pd.to_datetime(m['sold_at']).dt.date
-    g = m.groupby(['product_id','day'])['qty'].sum().reset_index()
-    stats = g.groupby('product_id')['qty'].agg(['mean','std']).reset_index().rename(columns={'mean':'mean_daily','std':'std_daily'})
-    stats['std_daily'] = stats['std_daily'].fillna(0.0)
-    return stats
-
-def _current_stock_by_product():
-    lots = load_df("SELECT product_id, qty_current, status FROM lots")
-    if lots.empty: return pd.DataFrame(columns=["product_id","stock"])
-    lots = lots[lots['status']=='vigente']
-    return lots.groupby('product_id')['qty_current'].sum().reset_index().rename(columns={'qty_current':'stock'})
+    c1.metric("Ventas (CLP)", f"{int(k['sales']):,}".replace(",","."))
+    c2.metric("Margen estimado (CLP)", f"{int(k['margin']):,}".replace(",","."))
+    c3.metric("Merma (CLP)", f"{int(k['waste']):,}".replace(",","."))
+
+def _now_min():
+    # Redondeado al minuto: los parámetros forman parte de la clave de caché de load_df
+    return datetime.now().replace(second=0, microsecond=0)
+
+@st.fragment(run_every=0.5)
+def _report_progress(kind):
+    # Sólo este bloque se re-ejecuta mientras el reporte se genera; al terminar, rerun completo
+    job = st.session_state[f"report_{kind}"]
+    if job.done(): st.rerun()
+    st.progress(job.progress, text=job.stage)
+
+def _report_status(kind, label, download_label):
+    job = st.session_state.get(f"report_{kind}")
+    if job is None: return
+    if not job.done(): return _report_progress(kind)
+    try:
+        pdf_path = job.result()
+        with open(pdf_path, "rb") as f: data = f.read()
+    except Exception as e:
+        st.error(f"Error al generar {label}: {e}"); return
+    st.success(f"{label} generado" + (" (sin cambios en los datos: reutilizado)" if job.cached else ""))
+    st.download_button(download_label, data=data, file_name=os.path.basename(pdf_path), key=f"dl_{kind}")
 
+def _demand_forecast():
+    return forecast.demand_stats()
+
+@profiler.timed
 def panel_repos_liq():
     st.markdown("### Reposiciones sugeridas (ROP) y productos a liquidar")
-    prods = get_products(); stock = _current_stock_by_product(); stats = _demand_stats_last_28d()
-    if prods.empty:
+    if get_products().empty:
         st.info("No hay productos aún."); return
-    df = prods.merge(stock, left_on='id', right_on='product_id', how='left').merge(stats, left_on='id', right_on='product_id', how='left')
-    df['stock']=df['stock'].fillna(0); df['mean_daily']=df['mean_daily'].fillna(0.0); df['std_daily']=df['std_daily'].fillna(0.0)
-    lead = st.number_input("Lead time (días)", 0, 30, 3); cover = st.number_input("Cobertura objetivo (días)", 1, 60, 7); z = st.number_input("Nivel servicio z", 0.0, 3.0, 1.28, 0.1)
-    df['ROP'] = df['mean_daily']*lead + z*df['std_daily']
-    df['sug_repo'] = (df['mean_daily']*cover + z*df['std_daily'] - df['stock']).clip(lower=0).round(0)
-    df['necesita_repo'] = df['stock'] < df['ROP']
-    cols = ["sku","name","category","stock","mean_daily","std_daily","ROP","sug_repo","necesita_repo"]
-    repo_tbl = df[df['necesita_repo']].copy()
-    if not repo_tbl.empty:
-        st.write("**Reposiciones sugeridas** (últimas 4 semanas)")
-        repo_view = repo_tbl[cols].sort_values("sug_repo", ascending=False)
+    d_lead, d_cover, d_z = snapshots.default_params(load_df)
+    lead = st.number_input("Lead time (días)", 0, 30, d_lead); cover = st.number_input("Cobertura objetivo (días)", 1, 60, d_cover); z = st.number_input("Nivel servicio z", 0.0, 3.0, d_z, 0.1)
+    snap = snapshots.load(load_df) if (lead, cover, z) == (d_lead, d_cover, d_z) else None
+    if snap is not None and snap[3] != {"lead": d_lead, "cover": d_cover, "z": d_z}:
+        snap = None   # foto con parámetros anteriores (recién cambiados o el recálculo falló)
+    if snap is not None:
+        repo_view, liq_view, computed_at, _ = snap
+        st.caption(f"Calculado {computed_at:%d-%m-%Y %H:%M} con los parámetros por defecto (se actualiza en segundo plano).")
+    else:
+        stats = _demand_forecast()
+        repo_view, liq_view = replenishment(load_df, stats, lead, cover, z), liquidation(load_df, stats, _now_min())
+        st.caption("Calculado en vivo con los parámetros ingresados." if (lead, cover, z) != (d_lead, d_cover, d_z) else "Calculado en vivo (la foto en segundo plano aún no está lista o es de otros parámetros).")
+        if (lead, cover, z) != (d_lead, d_cover, d_z) and st.button("Guardar como parámetros por defecto"):
+            run_sql("INSERT OR REPLACE INTO settings(key, value) VALUES(?,?),(?,?),(?,?)",
+                    ("repo_lead_days", str(int(lead)), "repo_cover_days", str(int(cover)), "repo_service_z", str(float(z))), commit=True)
+            log_audit('settings', None, 'update', {'repo_lead_days': int(lead), 'repo_cover_days': int(cover), 'repo_service_z': float(z)})
+            _refresh_snapshots_soon(); st.success("Parámetros guardados; la foto se recalcula en segundo plano.")
+    if not repo_view.empty:
+        st.write(f"**Reposiciones sugeridas** (pronóstico de los próximos {forecast.HORIZON} días)")
         st.dataframe(repo_view); st.download_button("Exportar Reposiciones", repo_view.to_csv(index=False).encode("utf-8"), "reposiciones_sugeridas.csv")
     else:
         st.success("No hay reposiciones urgentes según ROP.")
-    lots = load_df("SELECT product_id, lot_code, qty_current, expiration, status FROM lots WHERE status='vigente'")
-    if not lots.empty:
-        lots['expiration'] = pd.to_datetime(lots['expiration']); lots['days_left'] = (lots['expiration']-pd.Timestamp.now()).dt.days
-        soon = lots[lots['days_left']<=7].copy()
-        if not soon.empty:
-            soon = soon.merge(prods[['id','sku','name']], left_on='product_id', right_on='id', how='left').merge(stats[['product_id','mean_daily']], left_on='product_id', right_on='product_id', how='left')
-            soon['mean_daily']=soon['mean_daily'].fillna(0.0); soon['proj_demand_until_exp']=(soon['mean_daily']*soon['days_left'].clip(lower=0)).round(1)
-            soon['exceso']=(soon['qty_current']-soon['proj_demand_until_exp']).round(0)
-            liq = soon[soon['exceso']>0].copy()
-            if not liq.empty:
-                liq['sugerencia']="Aplicar promo/liquidación inmediata"
-                st.write("**Productos a liquidar por vencimiento (≤7 días)**")
-                liq_view = liq[["sku","name","lot_code","qty_current","days_left","proj_demand_until_exp","exceso","sugerencia"]].sort_values("exceso", ascending=False)
-                st.dataframe(liq_view); st.download_button("Exportar Liquidaciones", liq_view.to_csv(index=False).encode("utf-8"), "liquidaciones_vencimiento.csv")
-            else:
-                st.success("No hay lotes con exceso previo al vencimiento.")
-        else:
-            st.success("No hay lotes con vencimiento en ≤7 días.")
+    if not liq_view.empty:
+        st.write("**Productos a liquidar por vencimiento (≤7 días)**")
+        st.dataframe(liq_view); st.download_button("Exportar Liquidaciones", liq_view.to_csv(index=False).encode("utf-8"), "liquidaciones_vencimiento.csv")
     else:
-        st.info("No hay lotes registrados.")
+        st.success("No hay lotes con exceso de stock antes de vencer (≤7 días).")
 
 
+@profiler.timed
 def panel_skus_bajo_margen():
     st.markdown("### SKUs bajo margen (precio vs costo y reglas)")
     prods = get_products()
     if prods.empty:
         st.info("No hay productos para evaluar.")
         return
-    rows = []
-    for _, r in prods.iterrows():
-        req = _resolve_margin_for_product(r)
-        if r['unit_cost'] is None or r['unit_cost'] <= 0:
-            continue
-        margen_real = (r['sale_price'] - r['unit_cost']) / r['unit_cost']
-        if margen_real < req:
-            precio_min = r['unit_cost'] * (1.0 + req)
-            rows.append({
-                "sku": r['sku'],
-                "name": r['name'],
-                "category": r['category'],
-                "costo": int(r['unit_cost']),
-                "precio_actual": int(r['sale_price']),
-                "margen_actual_%": round(margen_real*100,1),
-                "margen_requerido_%": int(req*100),
-                "precio_sugerido_min": int(round(precio_min))
-            })
-    if rows:
-        import pandas as pd
-        df = pd.DataFrame(rows).sort_values("margen_actual_%")
+    df = margins.low_margin_table(prods, _margin_rules())
+    if not df.empty:
         st.dataframe(df)
         st.download_button("Exportar SKUs bajo margen", data=df.to_csv(index=False).encode("utf-8"), file_name="skus_bajo_margen.csv")
         st.caption("Sugerencia: actualiza precio de venta desde **Productos** o diseña una promoción controlando margen.")
@@ -205,19 +303,20 @@ def panel_skus_bajo_margen():
         st.success("Todos los SKUs cumplen el margen requerido.")
 
 
-def weekly_monthly_reports():
+@profiler.timed
+def weekly_monthly_reports(w=None, m=None):
     st.subheader("Análisis semanal y mensual")
-    sales = get_sales()
-    if sales.empty:
+    if w is None: w, m = weekly_monthly(load_df, archive.active())
+    if w.empty:
         st.info("No hay ventas para analizar."); return
-    sales['sold_at'] = pd.to_datetime(sales['sold_at'])
-    w = sales.groupby([sales['sold_at'].dt.to_period('W')])['total'].sum().reset_index()
-    m = sales.groupby([sales['sold_at'].dt.to_period('M')])['total'].sum().reset_index()
-    fig1 = plt.figure(); plt.plot(range(len(w)), w['total']); plt.title("Ventas semanales"); plt.xlabel("Semana"); plt.ylabel("CLP"); st.pyplot(fig1)
-    fig2 = plt.figure(); plt.plot(range(len(m)), m['total']); plt.title("Ventas mensuales"); plt.xlabel("Mes"); plt.ylabel("CLP"); st.pyplot(fig2)
+    # Gráficos nativos (Vega-Lite en el navegador): sin matplotlib en la página
+    st.write("Ventas semanales"); st.line_chart(w.assign(semana=w['week'].astype(str)), x="semana", y="total", x_label="Semana", y_label="CLP", color=PRIMARY)
+    st.write("Ventas mensuales"); st.line_chart(m.assign(mes=m['month'].astype(str)), x="mes", y="total", x_label="Mes", y_label="CLP", color=PRIMARY)
 
+@profiler.timed
 def expiry_alerts(days=7):
-    df = load_df("SELECT l.id, p.name as producto, l.lot_code, l.qty_current, l.expiration FROM lots l JOIN products p ON l.product_id=p.id WHERE l.status='vigente'")
+    df = load_df("SELECT l.id, p.name as producto, l.lot_code, l.qty_current, l.expiration FROM lots l JOIN products p ON l.product_id=p.id WHERE l.status='vigente' AND l.qty_current>0 AND l.expiration_epoch <= ?",
+                 (epoch(_now_min() + timedelta(days=days)),))
     if df.empty: return
     df['expiration'] = pd.to_datetime(df['expiration'])
     soon = df[(df['expiration'] - pd.Timestamp.now()) <= pd.Timedelta(days=days)]
@@ -271,8 +370,11 @@ def crud_productos():
                 st.success('Producto actualizado.'); log_audit('products', edit_id, 'update', {'fields':'all'})
     del_id = st.text_input("ID a eliminar (producto)")
     if st.button("Eliminar producto") and del_id:
-        run_sql("DELETE FROM products WHERE id=?", (del_id,), commit=True)
-        st.success("Producto eliminado (si existía)."); log_audit('products', del_id, 'delete', {})
+        try:
+            run_sql("DELETE FROM products WHERE id=?", (del_id,), commit=True)
+            st.success("Producto eliminado (si existía)."); log_audit('products', del_id, 'delete', {})
+        except sqlite3.IntegrityError:
+            st.error("No se puede eliminar el producto: tiene registros asociados.")
 
 def compras_lotes():
     st.subheader("Compras y Lotes")
@@ -290,12 +392,15 @@ def compras_lotes():
         lot_code = st.text_input("Código lote", f"LOT-{datetime.now().strftime('%Y%m%d%H%M%S')}")
         ok = st.form_submit_button("Registrar lote")
         if ok:
-            run_sql("""                INSERT INTO lots(product_id, lot_code, received_at, expiration, qty_initial, qty_current, unit_cost, supplier_id, doc_ref, status)
+            with transaction() as c:
+                cur = c.execute("""                INSERT INTO lots(product_id, lot_code, received_at, expiration, qty_initial, qty_current, unit_cost, supplier_id, doc_ref, status)
                 VALUES(?,?,?,?,?,?,?,?,?,?)
-            """, (prod_map[name], lot_code, received_at.isoformat(), expiration.isoformat(), qty, qty, unit_cost, supplier_id, None, 'vigente'), commit=True)
-            st.success("Lote ingresado."); log_audit('lots', None, 'create', {'lot_code': lot_code, 'product': name})
-    lots = load_df("SELECT l.id, p.name as producto, l.lot_code, l.qty_initial, l.qty_current, l.unit_cost, l.received_at, l.expiration, l.status FROM lots l JOIN products p ON p.id=l.product_id ORDER BY datetime(l.received_at) DESC")
-    st.dataframe(lots)
+                """, (prod_map[name], lot_code, received_at.isoformat(), expiration.isoformat(), qty, qty, unit_cost, supplier_id, None, 'vigente'))
+                audit.write(c, 'lots', cur.lastrowid, 'create', {'lot_code': lot_code, 'product': name})
+            fefo.invalidate(product_ids=[prod_map[name]])
+            st.success("Lote ingresado.")
+    f = filter_bar("lots", prod_map, status=("Estado", ["vigente", "vendido", "vencido", "descartado"]))
+    paged_table("lots", f, "lots")
     st.markdown('---'); st.write('**Editar lote**')
     lot_id = st.number_input('ID lote a editar', 0, 1_000_000, 0)
     if lot_id:
@@ -310,18 +415,26 @@ def compras_lotes():
             with c3:
                 n_doc = st.text_input('Doc ref', row.loc[0,'doc_ref'] or '')
             if st.button('Guardar lote'):
-                run_sql('UPDATE lots SET qty_current=?, status=?, unit_cost=?, doc_ref=? WHERE id=?', (int(n_qty), n_status, float(n_unit_cost), n_doc, int(lot_id)), commit=True)
-                st.success('Lote actualizado.'); log_audit('lots', lot_id, 'update', {})
+                with transaction() as c:
+                    c.execute('UPDATE lots SET qty_current=?, status=?, unit_cost=?, doc_ref=? WHERE id=?', (int(n_qty), n_status, float(n_unit_cost), n_doc, int(lot_id)))
+                    audit.write(c, 'lots', lot_id, 'update', {})
+                fefo.invalidate(product_ids=[int(row.loc[0,'product_id'])])
+                st.success('Lote actualizado.')
     del_lot = st.number_input('ID lote a eliminar', 0, 1_000_000, 0, key='del_lot')
     if st.button('Eliminar lote') and del_lot:
-        run_sql('DELETE FROM lots WHERE id=?', (int(del_lot),), commit=True)
-        st.success('Lote eliminado (si existía).'); log_audit('lots', del_lot, 'delete', {})
+        try:
+            with transaction() as c:
+                c.execute('DELETE FROM lots WHERE id=?', (int(del_lot),)); audit.write(c, 'lots', del_lot, 'delete', {})
+            fefo.invalidate()
+            st.success('Lote eliminado (si existía).')
+        except sqlite3.IntegrityError:
+            st.error("No se puede eliminar el lote: tiene registros asociados.")
 
 def ventas():
     st.subheader("Ventas")
     prods = get_products()
     if prods.empty: st.info("Primero agrega productos."); return
-    prod_map = dict(zip(prods['name'], prods[['id','sale_price']].values))
+    prod_map = dict(zip(prods['name'], prods[['id','sale_price','unit_cost']].values))
     with st.form("venta_rapida"):
         name = st.selectbox("Producto", list(prod_map.keys()))
         qty = st.number_input("Cantidad", 1, 1_000_000, 1)
@@ -329,26 +442,14 @@ def ventas():
         payment = st.selectbox("Medio de pago", ["efectivo","tarjeta","mixto"])
         ok = st.form_submit_button("Registrar venta")
         if ok:
-            pid, price = prod_map[name]
-            with conn() as c:
-                cur = c.cursor()
-                lots = cur.execute("""                    SELECT id, qty_current FROM lots WHERE product_id=? AND status='vigente' ORDER BY datetime(expiration) ASC
-                """, (int(pid),)).fetchall()
-                remain = qty
-                for lot_id, qty_cur in lots:
-                    if remain<=0: break
-                    take = min(remain, qty_cur)
-                    cur.execute("UPDATE lots SET qty_current=qty_current-? WHERE id=?", (take, lot_id))
-                    remain -= take
-                total = qty * price
-                cur.execute("INSERT INTO sales(sold_at, channel, payment_method, receipt_no, total) VALUES(?,?,?,?,?)",
-                            (sold_at.isoformat(),"local",payment,None,total))
-                sale_id = cur.lastrowid
-                cur.execute("INSERT INTO sale_items(sale_id, product_id, lot_id, qty, unit_price, promo_id) VALUES(?,?,?,?,?,NULL)",
-                            (sale_id, int(pid), None, int(qty), float(price)))
-                c.commit()
-            st.success("Venta registrada."); log_audit('sales', None, 'create', {'product': name, 'qty': int(qty)})
-    sales = load_df("SELECT * FROM sales ORDER BY datetime(sold_at) DESC LIMIT 200"); st.dataframe(sales)
+            pid, price, ucost = prod_map[name]
+            with transaction() as c:
+                sale_id, _ = fefo.record_sale(c.cursor(), sold_at, [(int(pid), int(qty), float(price), float(ucost))], payment_method=payment)
+                audit.write(c, 'sales', sale_id, 'create', {'product': name, 'qty': int(qty)})
+            archive.invalidate(when=sold_at); forecast.invalidate(since=sold_at.date())
+            st.success("Venta registrada.")
+    f = filter_bar("sales", {n: v[0] for n, v in prod_map.items()}, payment_method=("Medio de pago", ["efectivo", "tarjeta", "mixto"]))
+    paged_table("sales", f, "sales")
     st.markdown('---'); st.write('**Editar venta**')
     sale_id = st.number_input('ID venta a editar', 0, 1_000_000, 0)
     if sale_id:
@@ -356,12 +457,21 @@ def ventas():
         if not row.empty:
             pm = st.selectbox('Medio de pago', ['efectivo','tarjeta','mixto'], index=['efectivo','tarjeta','mixto'].index(row.loc[0,'payment_method'] if row.loc[0,'payment_method'] in ['efectivo','tarjeta','mixto'] else 'mixto'))
             if st.button('Guardar venta'):
-                run_sql('UPDATE sales SET payment_method=? WHERE id=?', (pm, int(sale_id)), commit=True)
-                st.success('Venta actualizada.'); log_audit('sales', sale_id, 'update', {'payment_method': pm})
+                with transaction() as c:
+                    c.execute('UPDATE sales SET payment_method=? WHERE id=?', (pm, int(sale_id)))
+                    audit.write(c, 'sales', sale_id, 'update', {'payment_method': pm})
+                archive.invalidate(when=row.loc[0, 'sold_at'])
+                st.success('Venta actualizada.')
     del_sale = st.number_input('ID venta a eliminar', 0, 1_000_000, 0, key='del_sale')
     if st.button('Eliminar venta') and del_sale:
-        run_sql('DELETE FROM sales WHERE id=?', (int(del_sale),), commit=True)
-        st.success('Venta eliminada (si existía).'); log_audit('sales', del_sale, 'delete', {})
+        with transaction() as c:
+            sold = c.execute('SELECT sold_at FROM sales WHERE id=?', (int(del_sale),)).fetchone()
+            rollup.remove_sale(c, int(del_sale))
+            c.execute('DELETE FROM sale_items WHERE sale_id=?', (int(del_sale),))
+            c.execute('DELETE FROM sales WHERE id=?', (int(del_sale),))
+            audit.write(c, 'sales', del_sale, 'delete', {})
+        if sold: forecast.invalidate(since=sold[0]); archive.invalidate(when=sold[0])
+        st.success('Venta eliminada (si existía).')
 
 def mermas():
     st.subheader("Mermas")
@@ -377,12 +487,15 @@ def mermas():
         ok = st.form_submit_button("Registrar merma")
         if ok:
             pid, ucost = prod_map[name]
-            run_sql("""                INSERT INTO waste(ts, product_id, lot_id, qty, unit_cost_est, reason, shift, evidence_path, approved_by)
+            with transaction() as c:
+                cur = c.execute("""                INSERT INTO waste(ts, product_id, lot_id, qty, unit_cost_est, reason, shift, evidence_path, approved_by)
                 VALUES(?,?,?,?,?,?,?,?,?)
-            """, (ts.isoformat(), int(pid), None, int(qty), float(ucost), reason, shift, None, "sistema"), commit=True)
-            st.success("Merma registrado."); log_audit('waste', None, 'create', {'product': name, 'qty': int(qty), 'reason': reason})
-    w = load_df("SELECT w.id, p.name as producto, w.qty, w.unit_cost_est, w.reason, w.ts FROM waste w JOIN products p ON p.id=w.product_id ORDER BY datetime(w.ts) DESC")
-    st.dataframe(w)
+                """, (ts.isoformat(), int(pid), None, int(qty), float(ucost), reason, shift, None, "sistema"))
+                audit.write(c, 'waste', cur.lastrowid, 'create', {'product': name, 'qty': int(qty), 'reason': reason})
+            archive.invalidate(when=ts)
+            st.success("Merma registrado.")
+    f = filter_bar("waste", {n: v[0] for n, v in prod_map.items()}, reason=("Motivo", ["caducidad", "daño", "preparación"]))
+    paged_table("waste", f, "waste")
     st.markdown('---'); st.write('**Editar merma**')
     wid = st.number_input('ID merma a editar', 0, 1_000_000, 0)
     if wid:
@@ -391,37 +504,21 @@ def mermas():
             qty_n = st.number_input('Cantidad', 1, 1_000_000, int(row.loc[0,'qty']))
             reason_n = st.selectbox('Motivo', ['caducidad','daño','preparación'], index=['caducidad','daño','preparación'].index(row.loc[0,'reason'] if row.loc[0,'reason'] in ['caducidad','daño','preparación'] else 'caducidad'))
             if st.button('Guardar merma'):
-                run_sql('UPDATE waste SET qty=?, reason=? WHERE id=?', (int(qty_n), reason_n, int(wid)), commit=True)
-                st.success('Merma actualizada.'); log_audit('waste', wid, 'update', {})
+                with transaction() as c:
+                    c.execute('UPDATE waste SET qty=?, reason=? WHERE id=?', (int(qty_n), reason_n, int(wid)))
+                    audit.write(c, 'waste', wid, 'update', {})
+                archive.invalidate(when=row.loc[0, 'ts'])
+                st.success('Merma actualizada.')
     del_w = st.number_input('ID merma a eliminar', 0, 1_000_000, 0, key='del_w')
     if st.button('Eliminar merma') and del_w:
-        run_sql('DELETE FROM waste WHERE id=?', (int(del_w),), commit=True)
-        st.success('Merma eliminada (si existía).'); log_audit('waste', del_w, 'delete', {})
-
-def _resolve_margin_for_product(prod_row):
-    """Precedencia: producto > categoría > global (settings.margin_min_percent, default 0.22)"""
-    settings = load_df("SELECT key, value FROM settings")
-    m_global = 0.22
-    if not settings.empty and 'margin_min_percent' in set(settings['key']):
-        try:
-            m_global = float(settings[settings['key']=='margin_min_percent']['value'].iloc[0])
-        except:
-            pass
-    cat_margin = None
-    try:
-        mr = load_df("SELECT margin_min_percent FROM margin_rules WHERE scope='category' AND ref=?", (prod_row['category'],))
-        if not mr.empty:
-            cat_margin = float(mr['margin_min_percent'].iloc[0])
-    except Exception:
-        pass
-    prod_margin = None
-    try:
-        mrp = load_df("SELECT margin_min_percent FROM margin_rules WHERE scope='product' AND ref=?", (str(prod_row['id']),))
-        if not mrp.empty:
-            prod_margin = float(mrp['margin_min_percent'].iloc[0])
-    except Exception:
-        pass
-    return prod_margin if prod_margin is not None else (cat_margin if cat_margin is not None else m_global)
+        with transaction() as c:
+            ts = c.execute('SELECT ts FROM waste WHERE id=?', (int(del_w),)).fetchone()
+            c.execute('DELETE FROM waste WHERE id=?', (int(del_w),)); audit.write(c, 'waste', del_w, 'delete', {})
+        if ts: archive.invalidate(when=ts[0])
+        st.success('Merma eliminada (si existía).')
+
+def _margin_rules():
+    return margins.load_rules(load_df)
 
 def promos():
     st.subheader("Promociones")
@@ -433,18 +530,10 @@ def promos():
         ends = st.datetime_input("Fin", value=datetime.now()+timedelta(days=7))
         ok = st.form_submit_button("Guardar promoción")
         if ok:
-            settings = load_df("SELECT key, value FROM settings"); mmin=0.22
-            if not settings.empty and 'margin_min_percent' in set(settings['key']):
-                try: mmin=float(settings[settings['key']=='margin_min_percent']['value'].iloc[0])
-                except: pass
+            rules = _margin_rules(); mmin = rules.global_min
             if typ == '%':
-                prods = get_products(); low=[]
-                for _,r in prods.iterrows():
-                    pe = r['sale_price']*(1-value/100.0)
-                    if r['unit_cost']<=0: continue
-                    margen = (pe - r['unit_cost'])/r['unit_cost']
-                    req = _resolve_margin_for_product(r)
-                    if margen < req: low.append(f"{r['name']} (req {int(req*100)}%)")
+                ev = margins.evaluate(get_products(), rules, discount_pct=value)
+                low = [f"{n} (req {int(r*100)}%)" for n, r in ev.loc[ev['below'], ['name','req']].itertuples(index=False)]
                 if low:
                     st.error(f"La promo podría violar margen mínimo ({int(mmin*100)}%) en: {', '.join(low[:5])}...")
                 else:
@@ -453,7 +542,7 @@ def promos():
             else:
                 run_sql("INSERT INTO promos(name,type,value,starts_at,ends_at,notes) VALUES(?,?,?,?,?,?)", (name, typ, value, starts.isoformat(), ends.isoformat(), None), commit=True)
                 st.success("Promoción creada."); log_audit('promos', None, 'create', {'name': name, 'type': typ, 'value': value})
-    p = load_df("SELECT * FROM promos ORDER BY datetime(starts_at) DESC"); st.dataframe(p)
+    p = load_df("SELECT * FROM promos ORDER BY starts_at_epoch DESC"); st.dataframe(p)
     st.markdown('---'); st.write('**Editar promoción**')
     pid = st.number_input('ID promo a editar', 0, 1_000_000, 0)
     if pid:
@@ -495,27 +584,71 @@ def proveedores():
                 st.success('Proveedor actualizado.'); log_audit('suppliers', sid, 'update', {})
     del_s = st.number_input('ID proveedor a eliminar', 0, 1_000_000, 0, key='del_s')
     if st.button('Eliminar proveedor') and del_s:
-        run_sql('DELETE FROM suppliers WHERE id=?', (int(del_s),), commit=True)
-        st.success('Proveedor eliminado (si existía).'); log_audit('suppliers', del_s, 'delete', {})
+        try:
+            run_sql('DELETE FROM suppliers WHERE id=?', (int(del_s),), commit=True)
+            st.success('Proveedor eliminado (si existía).'); log_audit('suppliers', del_s, 'delete', {})
+        except sqlite3.IntegrityError:
+            st.error("No se puede eliminar el proveedor: tiene registros asociados.")
 
 def import_export():
     st.subheader("Importar / Exportar CSV")
     tab1, tab2 = st.tabs(["Importar", "Exportar"])
     with tab1:
         kind = st.selectbox("Tabla a importar", ["products","lots","sales","sale_items","waste","promos","suppliers"])
+        upsert = kind == "products" and st.checkbox("Actualizar productos existentes por SKU", value=True)
         file = st.file_uploader("CSV", type=["csv"])
-        if file is not None:
-            df = pd.read_csv(file)
-            with conn() as c: df.to_sql(kind, c, if_exists="append", index=False)
-            st.success(f"{len(df)} filas importadas a {kind}.")
+        if file is not None and st.button("Importar"):
+            bar = st.progress(0.0, text="Importando...")
+            try:
+                res = importer.import_csv(file, kind, upsert=upsert,
+                                          progress=lambda f, r: bar.progress(min(f, 1.0), text=f"{r['read']:,} filas leídas"))
+            except (ValueError, sqlite3.Error) as e:
+                st.error(f"Importación cancelada, no se guardó ninguna fila: {e}")
+            else:
+                st.success(f"{res['inserted']:,} filas insertadas" + (f", {res['updated']:,} actualizadas" if upsert else "") + f" en {kind}.")
+                log_audit(kind, None, 'import', {k: res[k] for k in ("read", "inserted", "updated", "rejected")})
+                if res['inserted'] or res['updated']: _refresh_snapshots_soon()
+                if res['rejected']:
+                    st.warning(f"{res['rejected']:,} filas rechazadas" + (f" (se muestran las primeras {len(res['rejects']):,})" if res['rejected'] > len(res['rejects']) else ""))
+                    rej = pd.DataFrame([(ln, why, ",".join(raw)) for ln, why, raw in res['rejects']], columns=["línea", "motivo", "fila"])
+                    st.dataframe(rej, use_container_width=True)
+                    st.download_button("Descargar rechazos", rej.to_csv(index=False).encode("utf-8"), file_name=f"{kind}_rechazos.csv")
     with tab2:
-        kind = st.selectbox("Tabla a exportar", ["products","lots","sales","sale_items","waste","promos","suppliers","audit"])
-        if st.button("Exportar CSV"):
-            df = load_df(f"SELECT * FROM {kind}")
-            st.download_button("Descargar CSV", df.to_csv(index=False).encode("utf-8"), file_name=f"{kind}.csv")
+        kind = st.selectbox("Tabla a exportar", exporter.EXPORTABLE)
+        fmt = st.radio("Formato", list(exporter.formats()), format_func=exporter.FORMATS.get, horizontal=True)
+        start = end = None
+        if kind in exporter.DATE_COLUMN and st.checkbox("Filtrar por fecha"):
+            rng = st.date_input("Rango", (date.today() - timedelta(days=30), date.today()))
+            if isinstance(rng, (list, tuple)) and len(rng) == 2:
+                start, end = period_range("Personalizado", custom=rng)
+        if st.button("Exportar"):
+            bar = st.progress(0.0, text="Exportando...")
+            # Sin st.cache_data: se escribe por bloques a exports/ y sólo se sirve el archivo comprimido
+            out, n = exporter.export_file(kind, fmt, start, end,
+                                          progress=lambda k, total: bar.progress(min(k / total, 1.0) if total else 1.0, text=f"{k:,} filas"))
+            bar.progress(1.0, text=f"{n:,} filas")
+            st.success(f"{n:,} filas exportadas a {out}")
+            with open(out, "rb") as f:
+                st.download_button("Descargar", f, file_name=out.name)
+
+@st.fragment(run_every=10)
+def _outbox_status():
+    done = st.session_state.get("email_report")
+    if done is not None and not done.done():
+        st.info("Generando el PDF para el correo...")
+    elif done is not None and done.exception():
+        st.error(f"No se pudo encolar el correo: {done.exception()}")
+    elif done is not None:
+        st.success(f"Correo #{done.result()} en cola: se envía en segundo plano.")
+    c = outbox.counts()
+    if not any(c.values()): return
+    with st.expander(f"Bandeja de salida: {c['pendiente'] + c['enviando']} por enviar, {c['enviado']} enviados, {c['fallido']} fallidos"):
+        st.dataframe(outbox.recent(limit=20), use_container_width=True, hide_index=True)
+        if c["fallido"] and st.button("Reintentar fallidos"):
+            n = outbox.retry(); _ensure_scheduler().add_job(_job_send_outbox, args=[[resolve()]])
+            st.success(f"{n} correos de vuelta a la cola.")
 
 def ajustes_reportes():
-    _ensure_scheduler()
     st.subheader("Ajustes & Reportes")
     st.caption("Configura correo, genera/envía reportes y gestiona respaldos.")
     cfg_path = Path("email_config.json")
@@ -530,47 +663,40 @@ def ajustes_reportes():
         scheduler_enabled = st.checkbox("Activar envío programado (lun 08:00 y día 1 08:00)", value=bool(cfg.get("scheduler_enabled", False)))
         saved = st.form_submit_button("Guardar configuración")
         if saved:
-            new_cfg = {"smtp_host": smtp_host, "smtp_port": int(smtp_port), "username": username, "password": password, "to_emails": [e.strip() for e in to_emails.split(",") if e.strip()], "scheduler_enabled": bool(scheduler_enabled)}
-            cfg_path.write_text(json.dumps(new_cfg, indent=2), encoding="utf-8")
-            st.success("Configuración guardada (puedes cambiarla cuando quieras).")
+            new_cfg = {"smtp_host": smtp_host, "smtp_port": int(smtp_port), "username": username.strip(), "password": password, "to_emails": [e.strip() for e in to_emails.split(",") if e.strip()], "scheduler_enabled": bool(scheduler_enabled)}
+            bad = outbox.invalid_addresses(new_cfg["to_emails"] + [u for u in [new_cfg["username"]] if u])
+            if bad:
+                st.error(f"Direcciones inválidas (sólo ASCII, sin nombre): {', '.join(bad)}")
+            else:
+                cfg_path.write_text(json.dumps(new_cfg, indent=2), encoding="utf-8")
+                st.success("Configuración guardada (puedes cambiarla cuando quieras).")
     st.divider(); st.write("**Reportes**")
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Generar PDF semanal/mensual"):
-            pdf_path = build_weekly_monthly_pdf(load_df, out_path="resumen_pascucci.pdf")
-            st.success(f"PDF generado: {pdf_path}")
-            with open(pdf_path, "rb") as f: st.download_button("Descargar PDF", data=f.read(), file_name="resumen_pascucci.pdf")
+            st.session_state["report_semanal_mensual"] = _report_service(resolve()).submit("semanal_mensual")
+        _report_status("semanal_mensual", "PDF", "Descargar PDF")
         if st.button("Generar PDF Ejecutivo (branding + acciones)"):
-            pdf2 = build_executive_pdf(load_df, out_path="resumen_ejecutivo.pdf")
-            st.success(f"PDF ejecutivo generado: {pdf2}")
-            with open(pdf2, "rb") as f: st.download_button("Descargar PDF Ejecutivo", data=f.read(), file_name="resumen_ejecutivo.pdf")
+            st.session_state["report_ejecutivo"] = _report_service(resolve()).submit("ejecutivo")
+        _report_status("ejecutivo", "PDF ejecutivo", "Descargar PDF Ejecutivo")
     with col2:
         if st.button("Enviar PDF por correo (usar configuración guardada)"):
-            if cfg_path.exists():
-                cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
-                pdf_path = build_weekly_monthly_pdf(load_df, out_path="resumen_pascucci.pdf")
-                try:
-                    send_email(cfg["smtp_host"], int(cfg["smtp_port"]), cfg["username"], cfg["password"], cfg.get("to_emails", []),
-                               subject="[Pascucci Smart Inventory] Resumen automático",
-                               body="Se adjunta el resumen automático semanal/mensual.",
-                               attachments=[pdf_path])
-                    st.success("Correo enviado.")
-                except Exception as e:
-                    st.error(f"Error al enviar correo: {e}")
+            try:
+                to_list = outbox.recipients(outbox.load_config(cfg_path))
+            except ValueError as e:
+                st.error(f"{e}.")
             else:
-                st.error("Primero guarda la configuración de correo.")
+                # En el hilo del scheduler: genera el PDF, lo encola y lo envía (con reintentos)
+                st.session_state["email_report"] = done = Future()
+                _ensure_scheduler().add_job(_queue_report_email, args=[resolve(), "[Pascucci Smart Inventory] Resumen automático",
+                                                                       "Se adjunta el resumen automático semanal/mensual.", to_list, done])
+        _outbox_status()
 
     st.divider(); st.write("**Parámetros del sistema**")
     st.caption("Define margen mínimo permitido a nivel global, por categoría o por producto (precedencia: producto > categoría > global).")
     tabs = st.tabs(["Global","Por categoría","Por producto"])  # Tabs Márgenes
-    # Lee el margen actual desde settings; por defecto 0.22 (22%)
-    s = load_df("SELECT key, value FROM settings")
-    cur_m = 0.22
-    if not s.empty and 'margin_min_percent' in set(s['key']):
-        try:
-            cur_m = float(s[s['key']=='margin_min_percent']['value'].iloc[0])
-        except:
-            pass
+    # Margen global desde settings (por defecto 0.22 = 22%) y reglas por categoría/producto
+    rules = _margin_rules(); cur_m = rules.global_min
     colm1, colm2 = st.columns([2,1])
     with colm1:
         m_input = st.number_input("Margen mínimo permitido (%)", min_value=0.0, max_value=95.0, value=float(int(cur_m*100))/1.0, step=1.0, help="Protege que las promociones no dejen el margen por debajo de este umbral.")
@@ -588,8 +714,7 @@ def ajustes_reportes():
             st.info("No hay categorías definidas (agrega productos primero).")
         else:
             for cat in cats['category'].tolist():
-                cur = load_df("SELECT margin_min_percent FROM margin_rules WHERE scope='category' AND ref=?", (cat,))
-                curv = float(cur['margin_min_percent'].iloc[0]) if not cur.empty else cur_m
+                curv = rules.by_category.get(cat, cur_m)
                 c1,c2,c3 = st.columns([2,1,1])
                 with c1:
                     st.write(f"Categoría: **{cat}**")
@@ -609,8 +734,7 @@ def ajustes_reportes():
             names = prods['name'].tolist()
             sel = st.selectbox("Producto", names)
             row = prods[prods['name']==sel].iloc[0]
-            curp = load_df("SELECT margin_min_percent FROM margin_rules WHERE scope='product' AND ref=?", (str(row['id']),))
-            curv = float(curp['margin_min_percent'].iloc[0]) if not curp.empty else cur_m
+            curv = rules.by_product.get(str(row['id']), cur_m)
             c1,c2,c3 = st.columns([2,1,1])
             with c1:
                 st.write(f"Producto: **{row['name']}** (SKU {row['sku']})")
@@ -623,40 +747,140 @@ def ajustes_reportes():
             if st.button("Eliminar override del producto"):
                 run_sql("DELETE FROM margin_rules WHERE scope='product' AND ref=?", (str(row['id']),), commit=True)
                 st.success("Override eliminado (aplicará categoría o global).")
+    st.divider(); st.write("**Lotes vencidos**")
+    st.caption("Cada día a las 00:05 los lotes agotados pasan a *vendido* y los vencidos a *vencido*.")
+    to_waste = lifecycle.waste_enabled()
+    new_waste = st.checkbox("Registrar el saldo de los lotes vencidos como merma (caducidad)", value=to_waste)
+    if new_waste != to_waste:
+        run_sql("INSERT OR REPLACE INTO settings(key, value) VALUES(?,?)", (lifecycle.WASTE_SETTING, "1" if new_waste else "0"), commit=True)
+        log_audit('settings', None, 'update', {lifecycle.WASTE_SETTING: new_waste})
+    if st.button("Revisar lotes ahora"):
+        r = lifecycle.sweep()
+        st.success(f"{r['vendidos']:,} lotes agotados y {r['vencidos']:,} vencidos cerrados" + (f"; {r['merma']:,} unidades a merma." if r['merma'] else "."))
+    st.divider(); st.write("**Motor de analítica**")
+    engines = {"sqlite": "SQLite", "parquet": "Parquet para los meses cerrados + SQLite para el mes en curso"}
+    if not archive.available():
+        del engines["parquet"]; st.caption("El motor Parquet requiere `pyarrow` (`pip install -r requirements.txt`).")
+    engine = "parquet" if archive.enabled() else "sqlite"
+    new_engine = st.selectbox("KPIs y análisis semanal/mensual", list(engines), index=list(engines).index(engine), format_func=engines.get)
+    if new_engine != engine:
+        run_sql("INSERT OR REPLACE INTO settings(key, value) VALUES(?,?)", (archive.ENGINE_SETTING, new_engine), commit=True)
+        log_audit('settings', None, 'update', {archive.ENGINE_SETTING: new_engine})
+    arch = archive.get(resolve())
+    if new_engine == "parquet" and (st.button("Archivar ahora") or (new_engine != engine and not arch.months("sales"))):
+        _ensure_scheduler().add_job(archive.sync, args=[resolve()]); st.info("Archivando los meses cerrados en segundo plano...")
+    months = sorted(arch.months("sales"))
+    st.caption((f"{len(months)} meses archivados ({months[0]} a {months[-1]}) en `{arch.root.as_posix()}`. " if months else "Sin meses archivados. ")
+               + "Cada día a la 01:00 se archivan los meses cerrados; un mes con ventas o mermas editadas se vuelve a leer de SQLite hasta el siguiente archivado. "
+               + f"Verificar: `python archive.py verify --db {resolve()}`.")
     st.divider(); st.write("**Respaldos**")
-    if st.button("Respaldar ahora (.db)"):
-        import shutil
-        ts = datetime.now().strftime("%Y%m%d_%H%M")
-        os.makedirs("backups", exist_ok=True)
-        dst = f"backups/pascucci_{ts}.db"
-        shutil.copyfile(DB, dst)
-        st.success(f"Respaldo creado: {dst}")
-        with open(dst, "rb") as f: st.download_button("Descargar respaldo", data=f.read(), file_name=f"pascucci_{ts}.db")
+    bdir = stores.backup_dir(resolve())
+    if st.button("Respaldar ahora"):
+        with st.spinner("Respaldando (copia en caliente + verificación)..."):
+            e = backups.backup(out_dir=bdir)
+        st.success(f"Respaldo creado: {e['file']} ({e['bytes']/2**20:.1f} MB, {e['seconds']:.1f}s, integridad {e['integrity']})")
+        with open(bdir / e["file"], "rb") as f: st.download_button("Descargar respaldo", data=f.read(), file_name=e["file"])
+    hist = backups.history(bdir)
+    if hist:
+        h = pd.DataFrame(hist)
+        h["MB base"] = (h["db_bytes"] / 2**20).round(1); h["MB respaldo"] = (h["bytes"] / 2**20).round(1)
+        st.dataframe(h[["ts", "file", "MB base", "MB respaldo", "seconds", "integrity"]], hide_index=True)
+    st.caption(f"Retención: últimos {backups.KEEP['daily']} días, {backups.KEEP['weekly']} semanas y {backups.KEEP['monthly']} meses. "
+               f"Restaurar (con la app detenida): `python backups.py restore {bdir.as_posix()}/<archivo> --db {resolve()}`.")
+
+    st.divider(); st.write("**Caché de consultas**")
+    s = _query_cache(resolve()).stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Aciertos", f"{s['hits']:,}"); c2.metric("Fallos", f"{s['misses']:,}")
+    c3.metric("Tasa de acierto", f"{s['hit_rate']:.0%}"); c4.metric("Memoria", f"{s['mb']:.1f} / {s['max_mb']:.0f} MB")
+    st.caption(f"{s['entries']} consultas en caché, {s['evictions']} desalojadas. Se invalidan solas al escribir en sus tablas.")
+    if st.button("Vaciar caché"):
+        _query_cache(resolve()).clear(); st.success("Caché vaciada.")
 
 def audit_view():
     st.subheader("Auditoría")
-    df = load_df("SELECT id, ts, user, entity, entity_id, action, diff_json FROM audit ORDER BY datetime(ts) DESC LIMIT 1000")
-    if df.empty: st.info("Sin registros de auditoría."); return
-    st.dataframe(df); st.download_button("Exportar auditoría CSV", df.to_csv(index=False).encode("utf-8"), "auditoria.csv")
-
-# Render
-if section == "Dashboard":
-    kpi_cards(); panel_skus_bajo_margen(); expiry_alerts(7); panel_repos_liq(); weekly_monthly_reports()
-elif section == "Productos":
-    crud_productos()
-elif section == "Compras/Lotes":
-    compras_lotes()
-elif section == "Ventas":
-    ventas()
-elif section == "Mermas":
-    mermas()
-elif section == "Promociones":
-    promos()
-elif section == "Proveedores":
-    proveedores()
-elif section == "Importar/Exportar":
-    import_export()
-elif section == "Ajustes & Reportes":
-    ajustes_reportes()
-elif section == "Auditoría":
-    audit_view()
+    audit.flush()  # eventos aún en cola
+    f = filter_bar("audit", entity=("Entidad", ["products", "lots", "sales", "sale_items", "waste", "promos", "suppliers", "settings"]),
+                   action=("Acción", ["create", "update", "delete", "import"]))
+    df = paged_table("audit", f, "audit")
+    st.download_button("Exportar página CSV", df.to_csv(index=False).encode("utf-8"), "auditoria.csv")
+    st.caption("La auditoría completa (o por rango de fechas) se exporta en **Importar/Exportar**.")
+
+@profiler.timed
+def dashboard_todas():
+    # Cadena completa: cada consulta corre en todos los locales en paralelo y se suman los parciales
+    chain = _chain()
+    st.markdown(f"### Todos los locales ({len(STORES)})")
+    period = st.radio("Periodo KPIs", PERIODS, horizontal=True)
+    custom = st.date_input("Rango", value=(date.today()-timedelta(days=6), date.today())) if period == "Personalizado" else None
+    k, by_store = chain.kpis(*period_range(period, custom=custom))
+    c1,c2,c3 = st.columns(3)
+    c1.metric("Ventas (CLP)", f"{int(k['sales']):,}".replace(",","."))
+    c2.metric("Margen estimado (CLP)", f"{int(k['margin']):,}".replace(",","."))
+    c3.metric("Merma (CLP)", f"{int(k['waste']):,}".replace(",","."))
+    st.dataframe(by_store.rename(columns={"local": "Local", "sales": "Ventas", "cogs": "Costo", "margin": "Margen", "waste": "Merma"}), hide_index=True)
+    st.markdown("### Reposiciones sugeridas (ROP) en la cadena")
+    repo, by_sku, computed_at = chain.replenishment()
+    if repo.empty:
+        st.success("No hay reposiciones urgentes según ROP en ningún local.")
+    else:
+        if computed_at: st.caption(f"Fotos de cada local con sus parámetros por defecto; la más antigua es de {computed_at:%d-%m-%Y %H:%M}.")
+        st.write("**Por SKU** (suma de los locales)")
+        st.dataframe(by_sku, hide_index=True); st.download_button("Exportar Reposiciones (cadena)", by_sku.to_csv(index=False).encode("utf-8"), "reposiciones_cadena.csv")
+        st.write("**Por local**")
+        st.dataframe(repo, hide_index=True); st.download_button("Exportar Reposiciones por local", repo.to_csv(index=False).encode("utf-8"), "reposiciones_por_local.csv")
+    weekly_monthly_reports(*chain.weekly_monthly())
+
+def rendimiento():
+    st.subheader("Rendimiento")
+    st.caption(f"Desde que arrancó este proceso (todas las sesiones), últimas {profiler.SAMPLES} muestras por panel o consulta.")
+    c1, c2, c3 = st.columns(3)
+    profiler.SLOW_MS = c1.number_input("Consulta lenta desde (ms)", 10, 60_000, profiler.SLOW_MS, 50)
+    mem = c2.checkbox("Medir pico de memoria (tracemalloc, más lento)", value=tracemalloc.is_tracing())
+    if mem != tracemalloc.is_tracing(): tracemalloc.start() if mem else tracemalloc.stop()
+    if c3.button("Reiniciar estadísticas"): profiler.reset()
+    fmt = {"p50_ms": "{:.1f}", "p95_ms": "{:.1f}", "max_ms": "{:.1f}", "ultimo_ms": "{:.1f}", "acierto_cache": "{:.0%}", "pico_mb": "{:.1f}"}
+    st.write("**Paneles y secciones**")
+    st.dataframe(profiler.stats("panel").drop(columns=["tipo", "filas"]).style.format(fmt, na_rep=""), hide_index=True)
+    st.write("**Consultas** (por forma del SQL)")
+    st.dataframe(profiler.stats("sql").drop(columns=["tipo", "consultas"]).style.format(fmt, na_rep=""), hide_index=True)
+    with st.expander("Últimas consultas"):
+        st.dataframe(profiler.recent(), hide_index=True)
+    st.write(f"**Consultas lentas** (`{profiler.SLOW_LOG}`, rotativo)")
+    slow = profiler.slow_entries(20)
+    if not slow: st.info("Sin consultas lentas registradas.")
+    for e in slow:
+        with st.expander(f"{e['ts']} · {e['ms']:,.0f} ms · {e['rows'] or 0:,} filas · {e['sql'][:90]}"):
+            st.code(e["sql"], language="sql"); st.code("\n".join(e["plan"]), language="text")
+            if e["params"]: st.caption(f"Parámetros: {e['params']}")
+
+# Render (cada sección queda medida en Rendimiento)
+with profiler.span(f"sección: {section}"):
+    if section == "Rendimiento":
+        rendimiento()
+    elif store == stores.ALL:
+        if section == "Dashboard": dashboard_todas()
+        else: st.info("Elige un local en la barra lateral para ver o editar este módulo.")
+    elif section == "Dashboard":
+        kpi_cards(); panel_skus_bajo_margen(); expiry_alerts(7); panel_repos_liq(); weekly_monthly_reports()
+    elif section == "Productos":
+        crud_productos()
+    elif section == "Compras/Lotes":
+        compras_lotes()
+    elif section == "Ventas":
+        ventas()
+    elif section == "Mermas":
+        mermas()
+    elif section == "Promociones":
+        promos()
+    elif section == "Proveedores":
+        proveedores()
+    elif section == "Importar/Exportar":
+        import_export()
+    elif section == "Ajustes & Reportes":
+        ajustes_reportes()
+    elif section == "Auditoría":
+        audit_view()
+
+# Al final: el primer render no espera la importación ni los primeros trabajos del scheduler
+_ensure_scheduler()
@@ -0,0 +1,319 @@
+import json, os, shutil, threading, time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+import db
+from schema import epoch
+
+# Archivo histórico en Parquet: los meses cerrados de sales, sale_items, waste y del rollup
+# daily_product_sales se escriben (job nocturno) en archive/<base>/<tabla>/<AAAA-MM>.parquet, con
+# un manifest.json de los meses archivados. Con el motor "parquet" los KPIs y las ventas diarias
+# leen de Parquet sólo las columnas y meses del rango, y de SQLite sólo lo no archivado (el mes en
+# curso o un mes invalidado por una escritura); el resultado es el mismo que con sólo SQLite.
+
+ROOT = Path("archive")
+MANIFEST = "manifest.json"
+ENGINE_SETTING = "analytics_engine"   # 'sqlite' (por defecto) o 'parquet'
+BATCH = 50_000
+_I, _F, _S = "int64", "float64", "string"
+
+# tabla -> (FROM, columna del mes, [(expresión, nombre, tipo)]); sale_items lleva la fecha de su venta
+TABLES = {
+    "sales": ("sales t", "t.sold_at_epoch", [("t.id", "id", _I), ("t.sold_at", "sold_at", _S), ("t.sold_at_epoch", "sold_at_epoch", _I),
+              ("t.total", "total", _F), ("t.payment_method", "payment_method", _S), ("t.channel", "channel", _S), ("t.receipt_no", "receipt_no", _S)]),
+    "sale_items": ("sale_items t JOIN sales s ON s.id=t.sale_id", "s.sold_at_epoch",
+                   [("t.id", "id", _I), ("t.sale_id", "sale_id", _I), ("t.product_id", "product_id", _I), ("t.lot_id", "lot_id", _I),
+                    ("t.qty", "qty", _I), ("t.unit_price", "unit_price", _F), ("t.unit_cost", "unit_cost", _F), ("s.sold_at_epoch", "sold_at_epoch", _I)]),
+    "waste": ("waste t", "t.ts_epoch", [("t.id", "id", _I), ("t.ts", "ts", _S), ("t.ts_epoch", "ts_epoch", _I), ("t.product_id", "product_id", _I),
+              ("t.lot_id", "lot_id", _I), ("t.qty", "qty", _I), ("t.unit_cost_est", "unit_cost_est", _F), ("t.reason", "reason", _S), ("t.shift", "shift", _S)]),
+    "daily_product_sales": ("daily_product_sales t", "t.day", [("t.day", "day", _S), ("t.product_id", "product_id", _I),
+                            ("t.qty", "qty", _I), ("t.revenue", "revenue", _F), ("t.cost", "cost", _F)]),
+}
+
+def root_for(path=None):
+    return ROOT / Path(db.resolve(path)).stem
+
+def _month(value):
+    value = datetime.fromisoformat(str(value)) if not isinstance(value, (date, datetime)) else value
+    return f"{value.year:04d}-{value.month:02d}"
+
+def _bounds(month):
+    start = datetime.strptime(month, "%Y-%m")
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def _key(table, dt):
+    # Valor de la columna del mes en un borde: epoch o día ISO (rollup)
+    return dt.date().isoformat() if table == "daily_product_sales" else epoch(dt)
+
+class Archive:
+    def __init__(self, path=None, root=None):
+        self.path = db.resolve(path)
+        self.root = Path(root) if root else root_for(self.path)
+        self._manifest, self._mtime = None, -1
+        self._aggs = {}   # (tabla, mes, escrito, agregado) -> parcial de un mes completo
+        self._lock = threading.Lock()
+        self._write = threading.Lock()   # cambios al manifest (sync e invalidate)
+        self._gen = 0                    # invalidaciones: un mes escrito mientras tanto se descarta
+
+    # Manifest: {"tables": {tabla: {mes: {"file", "rows", "written_at"}}}}
+
+    def manifest(self):
+        f = self.root / MANIFEST
+        mtime = f.stat().st_mtime_ns if f.exists() else None
+        with self._lock:
+            if mtime != self._mtime:
+                self._manifest = json.loads(f.read_text(encoding="utf-8")) if mtime else {"tables": {}}
+                self._mtime = mtime
+            return self._manifest
+
+    def _save(self, manifest):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / (MANIFEST + ".tmp")
+        tmp.write_text(json.dumps(manifest, indent=1), encoding="utf-8")
+        os.replace(tmp, self.root / MANIFEST)
+
+    def months(self, table):
+        return self.manifest()["tables"].get(table, {})
+
+    def _write_month(self, c, table, month):
+        import pyarrow as pa, pyarrow.parquet as pq
+        frm, col, cols = TABLES[table]
+        start, end = _bounds(month)
+        schema = pa.schema([(name, getattr(pa, t)()) for _, name, t in cols])
+        cur = c.execute(f"SELECT {', '.join(e for e, _, _ in cols)} FROM {frm} WHERE {col} >= ? AND {col} < ?",
+                        (_key(table, start), _key(table, end)))
+        out = self.root / table / f"{month}.parquet"; out.parent.mkdir(parents=True, exist_ok=True)
+        tmp, n = out.with_suffix(".tmp"), 0
+        with pq.ParquetWriter(tmp, schema, compression="zstd") as w:
+            while rows := cur.fetchmany(BATCH):
+                w.write_table(pa.Table.from_arrays([pa.array(v, type=f.type) for v, f in zip(zip(*rows), schema)], schema=schema))
+                n += len(rows)
+        os.replace(tmp, out)
+        return {"file": f"{table}/{month}.parquet", "rows": n, "written_at": datetime.now().isoformat()}
+
+    def sync(self, now=None):
+        """Archiva los meses cerrados (anteriores al mes de `now`) que aún no están. Cada tabla se lee
+        en una transacción (foto consistente). Devuelve {tabla: [meses escritos]}."""
+        open_month = _month(now or datetime.now())
+        c = db.connect(self.path, readonly=True)
+        written = {}
+        try:
+            for table, (frm, col, _) in TABLES.items():
+                lo = c.execute(f"SELECT MIN({col}) FROM {'sales s' if table == 'sale_items' else frm}").fetchone()[0]
+                if lo is None: continue
+                first = _month(lo if table == "daily_product_sales" else datetime(1970, 1, 1) + timedelta(seconds=lo))
+                have = set(self.months(table))
+                m, todo = first, []
+                while m < open_month:
+                    if m not in have: todo.append(m)
+                    m = _month(_bounds(m)[1])
+                for month in todo:
+                    gen = self._gen
+                    c.execute("BEGIN")
+                    try:
+                        entry = self._write_month(c, table, month)
+                    finally:
+                        c.execute("COMMIT")
+                    with self._write:
+                        if gen != self._gen: continue   # hubo escrituras durante la foto: queda para el próximo sync
+                        manifest = json.loads(json.dumps(self.manifest()))
+                        manifest["tables"].setdefault(table, {})[month] = entry
+                        self._save(manifest)
+                    written.setdefault(table, []).append(month)
+        finally:
+            c.close()
+        return written
+
+    def invalidate(self, when=None):
+        """Saca del archivo el mes de `when` (o todo): tras escribir en un mes cerrado. Ese mes se lee
+        de SQLite hasta que el job nocturno lo vuelva a archivar."""
+        month = _month(when) if when is not None else None
+        with self._write:
+            self._gen += 1
+            manifest = self.manifest()
+            if not any(month in m if month else m for m in manifest["tables"].values()): return
+            self._save({"tables": {t: {k: v for k, v in m.items() if month is not None and k != month}
+                                   for t, m in manifest["tables"].items()}})
+            if month is None:
+                for t in TABLES: shutil.rmtree(self.root / t, ignore_errors=True)
+            else:
+                for t in TABLES: (self.root / t / f"{month}.parquet").unlink(missing_ok=True)
+
+    # Lectura: meses archivados que tocan el rango + el resto desde SQLite
+
+    def _split(self, table, start, end):
+        """(meses archivados en [start, end) con su filtro si el mes queda a medias, [(condición, params)]
+        de los tramos sin archivar). Un tramo por condición: con OR SQLite deja de usar el índice."""
+        col = TABLES[table][1].split(".")[-1]
+        months = self.months(table)
+        lo, hi = (_key(table, start) if start else None), (_key(table, end) if end else None)
+        parts, covered = [], []
+        for month in sorted(months):
+            a, b = (_key(table, x) for x in _bounds(month))
+            if (hi is not None and a >= hi) or (lo is not None and b <= lo): continue
+            full = (lo is None or lo <= a) and (hi is None or b <= hi)
+            parts.append((month, months[month], None if full else (max(a, lo) if lo is not None else a, min(b, hi) if hi is not None else b)))
+            if covered and covered[-1][1] == a: covered[-1][1] = b
+            else: covered.append([a, b])
+        # Complemento de lo archivado dentro de [lo, hi) (los NULL sólo sin rango, como en analytics)
+        gaps, cur = [], lo
+        for a, b in covered:
+            if cur is None or a > cur: gaps.append((cur, a))
+            cur = b
+        if hi is None or cur is None or cur < hi: gaps.append((cur, hi))
+        conds = []
+        for a, b in gaps:
+            if a is not None and b is not None and a >= b: continue
+            c = [f"{{p}}{col} >= ?"] * (a is not None) + [f"{{p}}{col} < ?"] * (b is not None)
+            conds.append((" AND ".join(c) or "1", [x for x in (a, b) if x is not None]))
+        if start is None and end is None: conds.append((f"{{p}}{col} IS NULL", []))
+        return parts, conds
+
+    def _agg(self, table, month, entry, rng, kind, columns, fn):
+        import pyarrow.parquet as pq
+        key = (table, month, entry["written_at"], kind)
+        if rng is None:
+            with self._lock:
+                if key in self._aggs: return self._aggs[key]
+        if not entry["rows"]: res = fn(None)
+        else:
+            col = TABLES[table][1].split(".")[-1]
+            filters = [(col, ">=", rng[0]), (col, "<", rng[1])] if rng else None
+            res = fn(pq.read_table(self.root / entry["file"], columns=columns, filters=filters))
+        if rng is None:
+            with self._lock: self._aggs[key] = res
+        return res
+
+    def kpis(self, db_loader, start=None, end=None):
+        """Igual que analytics.kpis."""
+        import pyarrow.compute as pc
+        total = lambda name: (lambda t: 0.0 if t is None or not len(t) else float(pc.sum(t[name]).as_py() or 0))
+        s_parts, s_conds = self._split("sales", start, end)
+        i_parts, i_conds = self._split("sale_items", start, end)
+        w_parts, w_conds = self._split("waste", start, end)
+        sales = sum(self._agg("sales", m, e, r, "total", ["total"], total("total")) for m, e, r in s_parts)
+        waste = sum(self._agg("waste", m, e, r, "value", ["qty", "unit_cost_est"],
+                              lambda t: 0.0 if t is None or not len(t) else float(pc.sum(pc.multiply(pc.cast(t["qty"], "float64"), t["unit_cost_est"])).as_py() or 0))
+                    for m, e, r in w_parts)
+        qty = [self._agg("sale_items", m, e, r, "qty_by_product", ["product_id", "qty"],
+                         lambda t: pd.Series(dtype="int64") if t is None or not len(t) else
+                         t.group_by("product_id").aggregate([("qty", "sum")]).to_pandas().set_index("product_id")["qty_sum"])
+               for m, e, r in i_parts]
+        cogs = 0.0
+        if any(len(q) for q in qty):
+            q = pd.concat([x for x in qty if len(x)]).groupby(level=0).sum()
+            cost = db_loader("SELECT id, unit_cost FROM products").set_index("id")["unit_cost"]
+            j = q.to_frame("qty").join(cost, how="inner")
+            cogs = float((j["qty"] * j["unit_cost"]).sum())
+        # Lo no archivado, desde SQLite. CROSS JOIN fija el orden: ventas del tramo por el índice de fecha
+        # y luego sus ítems (sin estadísticas el planificador recorre todo sale_items)
+        sql, params = zip(*(_sum(*a) for a in (
+            ("total", "sales", s_conds, ""),
+            ("si.qty*p.unit_cost", "sales s CROSS JOIN sale_items si ON si.sale_id=s.id JOIN products p ON p.id=si.product_id", i_conds, "s."),
+            ("qty*unit_cost_est", "waste", w_conds, ""))))
+        rest = db_loader(f"SELECT {sql[0]} AS sales, {sql[1]} AS cogs, {sql[2]} AS waste", tuple(sum(params, []))).iloc[0]
+        sales += float(rest["sales"]); cogs += float(rest["cogs"]); waste += float(rest["waste"])
+        return {"sales": sales, "cogs": cogs, "margin": sales - cogs, "waste": waste}
+
+    def daily_sales(self, db_loader, start_day=None):
+        """Igual que analytics.daily_sales: [day, total, cost] por día."""
+        start = datetime.combine(start_day, datetime.min.time()) if start_day else None
+        parts, conds = self._split("daily_product_sales", start, None)
+        frames = [self._agg("daily_product_sales", m, e, r, "by_day", ["day", "revenue", "cost"],
+                            lambda t: None if t is None or not len(t) else
+                            t.group_by("day").aggregate([("revenue", "sum"), ("cost", "sum")]).to_pandas()
+                            .rename(columns={"revenue_sum": "total", "cost_sum": "cost"})[["day", "total", "cost"]])
+                  for m, e, r in parts]
+        frames += [db_loader(f"SELECT day, SUM(revenue) AS total, SUM(cost) AS cost FROM daily_product_sales WHERE {c.format(p='')} GROUP BY day", tuple(p))
+                   for c, p in conds] or [pd.DataFrame(columns=["day", "total", "cost"])]
+        frames = [f for f in frames if f is not None and len(f)] or frames[-1:]
+        cost = pd.concat(frames, ignore_index=True)[["day", "cost"]]
+        # El total del día es SUM(sales.total) (daily_totals, una fila por día: se lee de SQLite)
+        where, params = (" AND day >= ?", (str(start_day),)) if start_day else ("", ())
+        totals = db_loader(f"SELECT day, total FROM daily_totals WHERE sales <> 0{where}", params)
+        out = totals.merge(cost, on="day", how="left")
+        out["cost"] = out["cost"].fillna(0.0)
+        return out[["day", "total", "cost"]].sort_values("day", ignore_index=True)
+
+def _sum(expr, frm, conds, prefix):
+    # SUM(expr) sobre la unión de los tramos: una subconsulta por tramo
+    parts = [f"(SELECT COALESCE(SUM({expr}), 0) FROM {frm} WHERE {c.format(p=prefix)})" for c, _ in conds]
+    return " + ".join(parts) or "0", [x for _, p in conds for x in p]
+
+_archives = {}
+_lock = threading.Lock()
+
+def get(path=None):
+    """Archive único por base y proceso (comparte la caché de agregados por mes)."""
+    path = db.resolve(path)
+    with _lock:
+        if path not in _archives: _archives[path] = Archive(path)
+        return _archives[path]
+
+@lru_cache(maxsize=1)
+def available():
+    # pyarrow (lectura/escritura Parquet); sin él el motor Parquet no se ofrece y se lee de SQLite
+    try:
+        import pyarrow, pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+def enabled(path=None):
+    row = db.reader(path).execute("SELECT value FROM settings WHERE key=?", (ENGINE_SETTING,)).fetchone()
+    return bool(row) and row[0] == "parquet" and available()
+
+def active(path=None):
+    """El Archive de la base si el motor elegido es Parquet; None para leer sólo de SQLite."""
+    return get(path) if enabled(path) else None
+
+def sync(path=None, now=None):
+    return get(path).sync(now)
+
+def invalidate(path=None, when=None):
+    # Llamar tras escribir ventas/mermas con fecha de un mes que puede estar archivado (o todo, sin when)
+    if when is not None and (pd.isna(when) or when == ""): return   # sin fecha: nunca se archiva
+    get(path).invalidate(when)
+
+def _same(x, y):
+    # Las sumas en otro orden pueden diferir en el último decimal del flotante
+    return abs(x - y) <= 1e-9 * max(abs(x), abs(y), 1)
+
+def verify(path=None, months=0, today=None):
+    """Compara el motor Parquet con SQLite: KPIs de todo el historial, del año, del mes en curso, de
+    un rango que corta meses a la mitad y de los últimos `months` meses archivados, y las ventas
+    diarias. Devuelve la lista de diferencias (vacía si dan lo mismo)."""
+    from analytics import sqlite_loader, kpis, daily_sales
+    load, a, today = sqlite_loader(path), get(path), today or date.today()
+    first = datetime(today.year, today.month, 1)
+    checks = [(None, None), (datetime(today.year, 1, 1), None), (first, None),
+              (first - timedelta(days=75), first - timedelta(days=20))]
+    checks += [_bounds(m) for m in sorted(a.months("sales"))[len(a.months("sales")) - months:]] if months else []
+    diffs = []
+    for start, end in checks:
+        x, y = kpis(load, start, end), a.kpis(load, start, end)
+        if not all(_same(x[k], y[k]) for k in x): diffs.append(("kpis", start, end, x, y))
+    x, y = daily_sales(load), a.daily_sales(load)
+    if list(x["day"]) != list(y["day"]) or not all(map(_same, x["total"].tolist() + x["cost"].tolist(), y["total"].tolist() + y["cost"].tolist())):
+        diffs.append(("daily_sales", None, None, len(x), len(y)))
+    return diffs
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Archivo Parquet de meses cerrados: sincronizar, verificar, invalidar")
+    ap.add_argument("cmd", choices=["sync", "verify", "invalidate"]); ap.add_argument("--db", default=db.DB)
+    ap.add_argument("--now", type=datetime.fromisoformat, help="sync: fecha de referencia (el mes abierto)")
+    ap.add_argument("--months", type=int, default=0, help="verify: verificar además los últimos N meses por separado")
+    args = ap.parse_args()
+    if args.cmd == "sync":
+        t = time.perf_counter(); w = sync(args.db, args.now)
+        print(", ".join(f"{t}: {len(m)} meses" for t, m in w.items()) or "Nada que archivar", f"({time.perf_counter() - t:.1f}s)")
+    elif args.cmd == "invalidate":
+        invalidate(args.db); print("Archivo vaciado; se reconstruye en el próximo sync")
+    else:
+        t = time.perf_counter(); diffs = verify(args.db, args.months)
+        for d in diffs: print("DIFERENCIA", *d)
+        print("Mismos resultados que SQLite" if not diffs else f"{len(diffs)} diferencias", f"({time.perf_counter() - t:.1f}s)")
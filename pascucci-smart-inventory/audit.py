@@ -0,0 +1,135 @@
+import atexit, json, queue, threading, time
+from datetime import datetime
+
+import db
+
+# Registro de auditoría. Dos formas de escribir:
+#  - write(cur, ...): dentro de la transacción del llamador (venta, lote, merma): un solo commit.
+#  - log(...): a una cola en memoria que un hilo vacía por lotes, en una transacción cada BATCH
+#    eventos o FLUSH_MS ms. Si la cola se llena se escribe en el momento (sin perder eventos);
+#    un lote que no se pudo escribir (base bloqueada, disco) queda pendiente y se reintenta primero
+#    en la pasada siguiente; al salir del proceso se vacía.
+
+BATCH = 200
+FLUSH_MS = 250
+MAX_QUEUE = 10_000
+USER = "local"
+INSERT = "INSERT INTO audit(ts, user, entity, entity_id, action, diff_json) VALUES(?,?,?,?,?,?)"
+
+def _entity_id(v):
+    # Ids numéricos como int (numpy.int64 no se puede pasar a sqlite3); uno de texto, tal cual
+    if v is None or v == "": return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return str(v)
+
+def row(entity, entity_id, action, diff, user=USER):
+    # ts del momento del evento (UTC, como el DEFAULT CURRENT_TIMESTAMP), no del flush
+    return (datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), user, entity,
+            _entity_id(entity_id), action, json.dumps(diff, ensure_ascii=False))
+
+def write(cur, entity, entity_id, action, diff, user=USER):
+    """Escribe el evento con el cursor/conexión de una transacción abierta (no hace commit)."""
+    cur.execute(INSERT, row(entity, entity_id, action, diff, user))
+
+class AuditWriter:
+    def __init__(self, path=None, batch=BATCH, flush_ms=FLUSH_MS, max_queue=MAX_QUEUE):
+        self.path, self.batch, self.interval = path, batch, flush_ms / 1000
+        self._q = queue.Queue(max_queue)
+        self._stop = threading.Event()
+        self._failed, self._failed_lock = [], threading.Lock()   # lote que no se pudo escribir
+        self.written = self.batches = self.sync_writes = 0
+        self._thread = threading.Thread(target=self._loop, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def log(self, entity, entity_id, action, diff, user=USER):
+        r = row(entity, entity_id, action, diff, user)
+        if self._stop.is_set():
+            return self._write([r])
+        try:
+            self._q.put_nowait(r)
+        except queue.Full:
+            # Cola llena (base ocupada o lenta): se escribe en el hilo del llamador
+            self.sync_writes += 1
+            self._write([r])
+
+    def _write(self, rows):
+        with db.transaction(self.path) as c:
+            c.executemany(INSERT, rows)
+        self.written += len(rows); self.batches += 1
+
+    def _drain(self, first=None):
+        rows = [] if first is None else [first]
+        while len(rows) < self.batch:
+            try: rows.append(self._q.get_nowait())
+            except queue.Empty: break
+        return rows
+
+    def _write_pending(self, rows):
+        # Lo que falló antes va primero (orden de los eventos); si vuelve a fallar, queda pendiente
+        with self._failed_lock:
+            rows, self._failed = self._failed + rows, []
+        if not rows: return
+        try:
+            self._write(rows)
+        except Exception:
+            with self._failed_lock:
+                self._failed = rows + self._failed
+            raise
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                first = self._q.get(timeout=self.interval)
+            except queue.Empty:
+                if not self._failed: continue
+                first = None
+            # Se espera hasta FLUSH_MS para juntar el lote, salvo que ya esté completo
+            end = time.monotonic() + self.interval
+            while self._q.qsize() < self.batch - 1 and time.monotonic() < end and not self._stop.wait(0.01):
+                pass
+            try:
+                self._write_pending(self._drain(first))
+            except Exception as e:
+                print("Audit log error (se reintenta):", e)
+                self._stop.wait(self.interval)
+
+    def flush(self):
+        """Escribe lo pendiente en el hilo del llamador (p.ej. antes de mostrar la auditoría)."""
+        self._write_pending([])
+        while rows := self._drain():
+            self._write_pending(rows)
+
+    def close(self):
+        self._stop.set(); self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        return {"pending": self._q.qsize() + len(self._failed), "written": self.written, "batches": self.batches, "sync_writes": self.sync_writes}
+
+_writers = {}
+_lock = threading.Lock()
+
+def writer(path=None):
+    """AuditWriter único por base y proceso (se cierra solo al salir)."""
+    path = db.resolve(path)
+    with _lock:
+        if path not in _writers:
+            _writers[path] = AuditWriter(path)
+        return _writers[path]
+
+def log(entity, entity_id, action, diff, user=USER, path=None):
+    writer(path).log(entity, entity_id, action, diff, user)
+
+def flush(path=None):
+    path = db.resolve(path)
+    if path in _writers: _writers[path].flush()
+
+@atexit.register
+def close_all():
+    with _lock:
+        ws = list(_writers.values()); _writers.clear()
+    for w in ws:
+        try: w.close()
+        except Exception as e: print("Audit log error:", e)
@@ -0,0 +1,172 @@
+import gzip, json, re, shutil, sqlite3, time
+from datetime import datetime
+from pathlib import Path
+
+import archive
+import db
+from schema import migrate
+
+# Respaldos en caliente con la API de backup de SQLite, por pasos de PAGES páginas con una pausa
+# entre pasos para no acaparar disco ni CPU. La copia se hace dentro de una transacción de
+# lectura: con WAL los escritores siguen trabajando y la foto no se reinicia aunque haya commits
+# durante el respaldo. Cada respaldo se verifica (integrity_check), se comprime (zstd si está
+# `zstandard`, si no gzip), se registra en backup_log.jsonl y se aplica la retención.
+
+BACKUP_DIR = Path("backups")
+LOG = "backup_log.jsonl"
+PAGES = 1024                 # páginas por paso (~4 MB con páginas de 4 KB)
+PAUSE = 0.005                # segundos entre pasos
+KEEP = {"daily": 7, "weekly": 4, "monthly": 12}
+LEVEL = {"gz": 1, "zst": 3}  # niveles rápidos: en gzip 6 duplica el tiempo para ~8% menos
+_NAME = re.compile(r"^pascucci_(\d{8}_\d{6})\.db(\.gz|\.zst)?$")
+_PERIOD = {"daily": lambda t: t.date(), "weekly": lambda t: t.isocalendar()[:2], "monthly": lambda t: (t.year, t.month)}
+
+class BackupError(RuntimeError):
+    pass
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def default_compression():
+    return "zst" if _zstd() else "gz"
+
+def _open(path, mode):
+    # Archivo binario (des)comprimido según la extensión
+    path = str(path)
+    if path.endswith(".gz"): return gzip.open(path, mode + "b", compresslevel=LEVEL["gz"])
+    if path.endswith(".zst"):
+        zstd = _zstd()
+        if zstd is None: raise BackupError("Para archivos .zst hay que instalar zstandard")
+        f = open(path, mode + "b")
+        return zstd.ZstdCompressor(level=LEVEL["zst"]).stream_writer(f, closefd=True) if mode == "w" else zstd.ZstdDecompressor().stream_reader(f, closefd=True)
+    return open(path, mode + "b")
+
+def snapshot(dst, path=None, pages=PAGES, pause=PAUSE):
+    """Copia consistente de la base en dst (.db sin comprimir, modo DELETE: un solo archivo)."""
+    src = sqlite3.connect(db.resolve(path))
+    out = sqlite3.connect(dst)
+    try:
+        # La transacción de lectura fija la foto: los commits de otros no reinician el backup
+        src.execute("BEGIN"); src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        src.backup(out, pages=pages, progress=lambda status, remaining, total: time.sleep(pause) if remaining else None)
+        src.execute("COMMIT")
+        out.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        out.close(); src.close()
+    return dst
+
+def check(db_file):
+    """'ok' o el primer problema que informa PRAGMA integrity_check."""
+    c = sqlite3.connect(f"file:{Path(db_file).as_posix()}?mode=ro", uri=True)
+    try:
+        return c.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        c.close()
+
+def backup(path=None, out_dir=BACKUP_DIR, compression=None, keep=KEEP, now=None):
+    """Respaldo verificado y comprimido en out_dir + retención. Devuelve la entrada del log."""
+    out_dir = Path(out_dir); out_dir.mkdir(parents=True, exist_ok=True)
+    path = db.resolve(path)
+    compression = compression or default_compression()
+    now = now or datetime.now()
+    name = f"pascucci_{now:%Y%m%d_%H%M%S}.db"
+    raw, final = out_dir / (name + ".tmp"), out_dir / f"{name}.{compression}"
+    t0 = time.perf_counter()
+    try:
+        snapshot(raw, path)
+        t_copy = time.perf_counter() - t0
+        integrity = check(raw)
+        if integrity != "ok":
+            raise BackupError(f"El respaldo no pasó integrity_check: {integrity}")
+        with open(raw, "rb") as f, _open(final, "w") as z:
+            shutil.copyfileobj(f, z, 1 << 20)
+        db_bytes = raw.stat().st_size
+    finally:
+        raw.unlink(missing_ok=True)
+    entry = {"ts": now.isoformat(timespec="seconds"), "file": final.name, "db_bytes": db_bytes,
+             "bytes": final.stat().st_size, "copy_s": round(t_copy, 3), "seconds": round(time.perf_counter() - t0, 3),
+             "integrity": integrity}
+    entry["removed"] = [p.name for p in prune(out_dir, keep)]
+    with open(out_dir / LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return entry
+
+def _stamp(name):
+    m = _NAME.match(name)
+    return datetime.strptime(m.group(1), "%Y%m%d_%H%M%S") if m else None
+
+def prune(out_dir=BACKUP_DIR, keep=KEEP):
+    """Retención abuelo-padre-hijo: el respaldo más reciente de cada uno de los últimos N días,
+    semanas y meses (según keep). Borra el resto y devuelve las rutas eliminadas."""
+    files = sorted(((t, p) for p in Path(out_dir).iterdir() if (t := _stamp(p.name))), reverse=True)
+    kept = set()
+    for rule, n in keep.items():
+        periods = set()
+        for t, p in files:
+            k = _PERIOD[rule](t)
+            if k in periods: continue
+            if len(periods) == n: break
+            periods.add(k); kept.add(p)
+    removed = [p for _, p in files if p not in kept]
+    for p in removed: p.unlink(missing_ok=True)
+    return removed
+
+def history(out_dir=BACKUP_DIR, limit=30):
+    """Últimas entradas del log (más reciente primero)."""
+    log = Path(out_dir) / LOG
+    if not log.exists(): return []
+    lines = log.read_text(encoding="utf-8").splitlines()[-limit:]
+    return [json.loads(l) for l in reversed(lines) if l.strip()]
+
+def restore(src, path=None, safety_dir=BACKUP_DIR):
+    """Reemplaza el contenido de la base por el respaldo src (.db, .db.gz o .db.zst). Antes verifica
+    el respaldo y, si la base existe, la respalda en safety_dir. Devuelve la entrada de ese respaldo."""
+    path = db.resolve(path)
+    tmp = Path(path).with_name(Path(path).name + ".restore.tmp")
+    try:
+        with _open(src, "r") as z, open(tmp, "wb") as f:
+            shutil.copyfileobj(z, f, 1 << 20)
+        integrity = check(tmp)
+        if integrity != "ok":
+            raise BackupError(f"{src} no pasó integrity_check: {integrity}")
+        safety = backup(path, safety_dir) if Path(path).exists() else None
+        # Se copia con la API de backup sobre la base viva (en un solo paso: los lectores ven
+        # la versión anterior o la restaurada, nunca una mezcla) y luego se migra si es antigua
+        s, d = sqlite3.connect(tmp), sqlite3.connect(path, timeout=30)
+        try:
+            s.backup(d)
+            d.execute("PRAGMA journal_mode=WAL")
+            migrate(d)
+        finally:
+            d.close(); s.close()
+    finally:
+        tmp.unlink(missing_ok=True)
+    archive.invalidate(path)   # el archivo Parquet era de la base anterior
+    return safety
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Respaldos de la base: crear, restaurar, aplicar retención, ver historial")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("backup"); b.add_argument("--compression", choices=["zst", "gz"])
+    r = sub.add_parser("restore", help="reemplaza la base (detener la app antes)"); r.add_argument("file")
+    sub.add_parser("prune"); sub.add_parser("history")
+    for p in sub.choices.values():
+        p.add_argument("--db", default=db.DB); p.add_argument("--dir", default=str(BACKUP_DIR))
+    args = ap.parse_args()
+    if args.cmd == "backup":
+        e = backup(args.db, args.dir, args.compression)
+        print(f"{e['file']}: {e['db_bytes']/2**20:.1f} MB -> {e['bytes']/2**20:.1f} MB en {e['seconds']:.2f}s "
+              f"(copia {e['copy_s']:.2f}s), integridad {e['integrity']}, {len(e['removed'])} eliminados")
+    elif args.cmd == "restore":
+        safety = restore(args.file, args.db, args.dir)
+        print(f"Restaurado {args.file} en {args.db}" + (f" (base anterior respaldada en {safety['file']})" if safety else ""))
+    elif args.cmd == "prune":
+        for p in prune(args.dir): print(f"eliminado {p.name}")
+    else:
+        for e in history(args.dir):
+            print(f"{e['ts']}  {e['file']:<32} {e['db_bytes']/2**20:8.1f} MB -> {e['bytes']/2**20:7.1f} MB  {e['seconds']:6.2f}s  {e['integrity']}")
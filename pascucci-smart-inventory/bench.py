@@ -0,0 +1,503 @@
+import argparse, json, os, platform, random, shutil, sqlite3, statistics, subprocess, sys, tempfile, time, tracemalloc
+from datetime import date, datetime, time as dtime, timedelta
+from pathlib import Path
+
+import db
+import fefo
+import rollup
+
+# Micro-benchmarks. Trabajan siempre sobre copias temporales: nunca modifican la base indicada.
+#   python bench.py conn --db pascucci.db -n 2000
+#   python bench.py fefo --products 500 --lots 20 --sales 3000
+#   python bench.py suite --scales 10k,1m        (rutas principales; historial en bench_history.json)
+#   python bench.py stores --stores 20           (consolidación multi-local: serie vs hilos vs procesos)
+#   python bench.py cashiers --procs 4 --threads 2 (cajeros concurrentes: stock consistente y ventas/s)
+#   python bench.py ingest --receipts 20000     (API de ingesta del POS: boletas/s e idempotencia)
+#   python bench.py imports                      (tiempo de importación de app.py; falla si pasa el presupuesto)
+
+def _per_call_us(fn, n):
+    fn()  # calentar
+    t0 = time.perf_counter()
+    for _ in range(n): fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def _copy(src, dst):
+    s, d = sqlite3.connect(src), sqlite3.connect(dst)
+    s.backup(d); d.execute("PRAGMA journal_mode=DELETE")
+    s.close(); d.close()
+    return dst
+
+def bench_conn(path, n):
+    tmp = tempfile.mkdtemp(prefix="bench_conn_")
+    try:
+        before_db = _copy(path, os.path.join(tmp, "before.db"))
+        after_db = _copy(path, os.path.join(tmp, "after.db"))
+        read_q = "SELECT id, sku, sale_price FROM products WHERE id=1"
+        write_q = "INSERT INTO audit(entity, entity_id, action, user, diff_json) VALUES('bench', 1, 'create', 'local', '{}')"
+
+        # Antes: conexión nueva por consulta, journal DELETE, PRAGMAs por defecto
+        def read_before():
+            c = sqlite3.connect(before_db, check_same_thread=False)
+            c.execute(read_q).fetchall(); c.close()
+        def write_before():
+            c = sqlite3.connect(before_db, check_same_thread=False)
+            c.execute(write_q); c.commit(); c.close()
+
+        # Después: lector por hilo + escritor único, WAL y PRAGMAs de db.py
+        def read_after():
+            db.reader(after_db).execute(read_q).fetchall()
+        def write_after():
+            with db.transaction(after_db) as c:
+                c.execute(write_q)
+
+        rows = [("lectura", _per_call_us(read_before, n), _per_call_us(read_after, n)),
+                ("escritura+commit", _per_call_us(write_before, max(1, n // 10)), _per_call_us(write_after, max(1, n // 10)))]
+        print(f"{'operación':<18}{'antes (µs)':>12}{'después (µs)':>14}{'x':>7}")
+        for name, b, a in rows:
+            print(f"{name:<18}{b:>12.1f}{a:>14.1f}{b / a:>7.1f}")
+        return rows
+    finally:
+        db.close_all()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _catalog(path, n_products, lots_per_product, lot_qty=20, seed=7):
+    rng = random.Random(seed); now = datetime.now().replace(microsecond=0)
+    c = db.connect(path)
+    c.executemany("INSERT INTO products(id, sku, name, category, unit_cost, sale_price) VALUES(?,?,?,?,?,?)",
+                  [(i, f"B-{i:05d}", f"Producto {i}", "Bench", 500.0, 1500.0) for i in range(1, n_products + 1)])
+    c.executemany("""INSERT INTO lots(product_id, lot_code, received_at, expiration, qty_initial, qty_current, unit_cost, status)
+                     VALUES(?,?,?,?,?,?,?,'vigente')""",
+                  [(p, f"L-{p}-{k}", now.isoformat(), (now + timedelta(days=rng.randint(1, 30), hours=k)).isoformat(), lot_qty, lot_qty, 500.0)
+                   for p in range(1, n_products + 1) for k in range(lots_per_product)])
+    c.commit(); c.close()
+
+def _baskets(n_products, n_sales, seed=11):
+    rng = random.Random(seed)
+    return [[(rng.randint(1, n_products), rng.randint(1, 3), 1500.0, 500.0) for _ in range(rng.randint(1, 4))] for _ in range(n_sales)]
+
+def _legacy_sale(cur, sold_at, lines):
+    # Flujo anterior de ventas(): SELECT ordenado + un UPDATE por lote, por línea; sale_items sin lote
+    for pid, qty, _, _ in lines:
+        remain = qty
+        for lot_id, qty_cur in cur.execute("SELECT id, qty_current FROM lots WHERE product_id=? AND status='vigente' AND qty_current>0 ORDER BY expiration_epoch ASC", (pid,)).fetchall():
+            if remain <= 0: break
+            take = min(remain, qty_cur)
+            cur.execute("UPDATE lots SET qty_current=qty_current-? WHERE id=?", (take, lot_id)); remain -= take
+    cur.execute("INSERT INTO sales(sold_at, channel, payment_method, receipt_no, total) VALUES(?,?,?,?,?)",
+                (sold_at, "local", "mixto", None, sum(q*p for _, q, p, _ in lines)))
+    sale_id = cur.lastrowid
+    for pid, qty, price, _ in lines:
+        cur.execute("INSERT INTO sale_items(sale_id, product_id, lot_id, qty, unit_price, promo_id) VALUES(?,?,?,?,?,NULL)", (sale_id, pid, None, qty, price))
+    rollup.apply_lines(cur, sold_at, lines)
+
+def bench_fefo(n_products, lots_per_product, n_sales, batch=500):
+    tmp = tempfile.mkdtemp(prefix="bench_fefo_")
+    try:
+        legacy_db, new_db = os.path.join(tmp, "legacy.db"), os.path.join(tmp, "fefo.db")
+        for p in (legacy_db, new_db): _catalog(p, n_products, lots_per_product)
+        baskets = _baskets(n_products, n_sales); sold_at = datetime.now().isoformat()
+
+        def run(path, sell, per_tx):
+            t0 = time.perf_counter()
+            for i in range(0, n_sales, per_tx):
+                with db.transaction(path) as w:
+                    sell(w.cursor(), baskets[i:i + per_tx])
+            return time.perf_counter() - t0
+
+        def legacy_sell(cur, chunk):
+            for lines in chunk: _legacy_sale(cur, sold_at, lines)
+        def new_sell(cur, chunk):
+            fefo.record_sales(cur, [{"sold_at": sold_at, "lines": lines} for lines in chunk], path=new_db)
+
+        results = []
+        for per_tx in (1, batch):
+            legacy = n_sales / run(legacy_db, legacy_sell, per_tx)
+            new = n_sales / run(new_db, new_sell, per_tx)
+            results.append((per_tx, legacy, new))
+        # Mismo stock final: la asignación es idéntica, sólo cambia cómo se escribe
+        q = "SELECT SUM(qty_current) FROM lots"
+        same = sqlite3.connect(legacy_db).execute(q).fetchone() == sqlite3.connect(new_db).execute(q).fetchone()
+        print(f"{n_products * lots_per_product} lotes abiertos, {n_sales} ventas por corrida; stock final igual: {same}")
+        print(f"{'ventas/tx':<10}{'antes (v/s)':>13}{'después (v/s)':>15}{'x':>6}")
+        for per_tx, legacy, new in results:
+            print(f"{per_tx:<10}{legacy:>13.0f}{new:>15.0f}{new / legacy:>6.1f}")
+        return results
+    finally:
+        db.close_all()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+# Cajeros concurrentes: P procesos x T hilos registran ventas sobre la misma base, como ventas()
+# (transacción + FEFO + ítems + auditoría). Verifica que el stock descontado de cada lote sea
+# exactamente lo vendido de ese lote y que ninguna venta falle por bloqueo.
+
+def _cashier(path, threads, n_sales, n_products, seed):
+    import threading, audit
+    out = {"ok": 0, "errors": {}, "lat": [], "units": {}}
+    mu = threading.Lock()
+    def run(k):
+        rng = random.Random(seed * 100 + k)
+        for _ in range(n_sales):
+            lines = [(rng.randint(1, n_products), rng.randint(1, 3), 1500.0, 500.0) for _ in range(rng.randint(1, 3))]
+            t0 = time.perf_counter()
+            try:
+                with db.transaction(path) as c:
+                    sale_id, _ = fefo.record_sale(c.cursor(), datetime.now(), lines, payment_method="efectivo", path=path)
+                    audit.write(c, "sales", sale_id, "create", {"bench": True})
+            except Exception as e:
+                with mu: out["errors"][f"{type(e).__name__}: {e}"] = out["errors"].get(f"{type(e).__name__}: {e}", 0) + 1
+                continue
+            with mu:
+                out["ok"] += 1; out["lat"].append(time.perf_counter() - t0)
+                for pid, q, _, _ in lines: out["units"][pid] = out["units"].get(pid, 0) + q
+    ts = [threading.Thread(target=run, args=(k,)) for k in range(threads)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    db.close_all()
+    return out
+
+def bench_cashiers(procs=4, threads=2, n_sales=200, n_products=50, lots_per_product=5):
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    tmp = tempfile.mkdtemp(prefix="bench_cashiers_")
+    try:
+        path = os.path.join(tmp, "cajas.db")
+        _catalog(path, n_products, lots_per_product)   # stock acotado: parte de las ventas queda sin lote
+        c = sqlite3.connect(path); before = dict(c.execute("SELECT id, qty_current FROM lots")); c.close()
+        with ProcessPoolExecutor(procs, mp_context=mp.get_context("spawn")) as pool:
+            pool.submit(time.sleep, 0).result()
+            t0 = time.perf_counter()
+            res = list(pool.map(_cashier, [path] * procs, [threads] * procs, [n_sales] * procs, [n_products] * procs, range(procs)))
+            elapsed = time.perf_counter() - t0
+        ok = sum(r["ok"] for r in res); lat = sorted(x for r in res for x in r["lat"])
+        errors = {}
+        for r in res:
+            for k, v in r["errors"].items(): errors[k] = errors.get(k, 0) + v
+        c = sqlite3.connect(path)
+        after = dict(c.execute("SELECT id, qty_current FROM lots"))
+        by_lot = dict(c.execute("SELECT lot_id, SUM(qty) FROM sale_items WHERE lot_id IS NOT NULL GROUP BY lot_id"))
+        by_product = dict(c.execute("SELECT product_id, SUM(qty) FROM sale_items GROUP BY product_id"))
+        n_db = c.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        open_zero = c.execute("SELECT COUNT(*) FROM lots WHERE status='vigente' AND qty_current<=0").fetchone()[0]
+        c.close()
+        units = {}
+        for r in res:
+            for pid, q in r["units"].items(): units[pid] = units.get(pid, 0) + q
+        lost = {lot: (before[lot] - after[lot], by_lot.get(lot, 0)) for lot in before if before[lot] - after[lot] != by_lot.get(lot, 0)}
+        checks = {"ventas registradas = confirmadas": n_db == ok,
+                  "stock descontado = vendido por lote": not lost,
+                  "sin lotes negativos": min(after.values()) >= 0,
+                  "unidades por producto = pedidas": by_product == units,
+                  "sin lotes agotados vigentes": open_zero == 0,
+                  "sin errores": not errors}
+        sold = sum(before.values()) - sum(after.values())
+        print(f"{procs} procesos x {threads} cajeros, {procs * threads * n_sales:,} ventas intentadas; "
+              f"{sold:,} de {sum(before.values()):,} unidades en lotes vendidas")
+        print(f"{ok:,} ventas en {elapsed:.2f}s: {ok / elapsed:,.0f} ventas/s; latencia p50 {lat[len(lat) // 2] * 1e3:.1f} ms, "
+              f"p95 {lat[int(len(lat) * .95)] * 1e3:.1f} ms, máx {lat[-1] * 1e3:.0f} ms" if lat else "ninguna venta confirmada")
+        for msg, n in sorted(errors.items(), key=lambda x: -x[1])[:5]: print(f"  {n:>5} x {msg}")
+        for name, passed in checks.items(): print(f"  {'OK   ' if passed else 'FALLA'} {name}")
+        if not all(checks.values()): raise SystemExit(1)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+# Ingesta del POS (ingest.py): el servicio HTTP en su propio proceso y C clientes que envían lotes de
+# B boletas por conexiones keep-alive. Verifica que cada boleta quede una sola vez (también al
+# reenviar un lote) y que el stock descontado sea lo vendido de cada lote.
+
+def bench_ingest(receipts=20000, batch=500, clients=4, n_products=500, lots_per_product=20, port=8597):
+    import http.client, threading
+    tmp = tempfile.mkdtemp(prefix="bench_ingest_")
+    proc = None
+    try:
+        path = os.path.join(tmp, "pos.db")
+        _catalog(path, n_products, lots_per_product)
+        c = sqlite3.connect(path); stock0 = dict(c.execute("SELECT id, qty_current FROM lots")); c.close()
+        rng = random.Random(5); day = datetime.now().replace(microsecond=0) - timedelta(days=1)
+        data = [{"receipt_no": f"POS-{i:07d}", "sold_at": (day + timedelta(seconds=i)).isoformat(), "payment_method": "tarjeta",
+                 "lines": [{"sku": f"B-{rng.randint(1, n_products):05d}", "qty": rng.randint(1, 3)} for _ in range(rng.randint(1, 4))]}
+                for i in range(receipts)]
+        bodies = [json.dumps({"receipts": data[i:i + batch]}).encode() for i in range(0, receipts, batch)]
+        proc = subprocess.Popen([sys.executable, str(Path(__file__).with_name("ingest.py")), "serve", "--db", path, "--port", str(port)], stdout=subprocess.PIPE, text=True)
+        proc.stdout.readline()   # escuchando
+        def post(conn, body):
+            conn.request("POST", "/sales", body, {"Content-Type": "application/json"})
+            r = conn.getresponse(); out = json.loads(r.read())
+            if r.status != 200: raise RuntimeError(out)
+            return out
+        lat, counts, mu, queue = [], {"creada": 0, "duplicada": 0, "rechazada": 0}, threading.Lock(), list(enumerate(bodies))
+        def client():
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            while True:
+                with mu:
+                    if not queue: break
+                    _, body = queue.pop(0)
+                t0 = time.perf_counter(); out = post(conn, body); dt = time.perf_counter() - t0
+                with mu:
+                    lat.append(dt)
+                    for k in counts: counts[k] += out[k]
+            conn.close()
+        t0 = time.perf_counter()
+        ts = [threading.Thread(target=client) for _ in range(clients)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        elapsed = time.perf_counter() - t0
+        # Reenvío (p.ej. el POS no recibió la respuesta): todo duplicado
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        t1 = time.perf_counter(); again = post(conn, bodies[0]); again_s = time.perf_counter() - t1; conn.close()
+        c = sqlite3.connect(path)
+        n_sales, n_distinct = c.execute("SELECT COUNT(*), COUNT(DISTINCT receipt_no) FROM sales").fetchone()
+        stock1 = dict(c.execute("SELECT id, qty_current FROM lots"))
+        by_lot = dict(c.execute("SELECT lot_id, SUM(qty) FROM sale_items WHERE lot_id IS NOT NULL GROUP BY lot_id"))
+        units = c.execute("SELECT SUM(qty) FROM sale_items").fetchone()[0]
+        c.close()
+        lat.sort()
+        checks = {"una venta por boleta": n_sales == n_distinct == receipts == counts["creada"],
+                  "reenvío: todo duplicado": again["duplicada"] == len(json.loads(bodies[0])["receipts"]) and not again["creada"],
+                  "stock descontado = vendido por lote": all(stock0[l] - stock1[l] == by_lot.get(l, 0) for l in stock0),
+                  "unidades = pedidas": units == sum(l["qty"] for r in data for l in r["lines"])}
+        print(f"{receipts:,} boletas en lotes de {batch} ({len(bodies)} requests), {clients} clientes, {os.cpu_count()} CPU")
+        print(f"{receipts / elapsed:,.0f} boletas/s ({elapsed:.2f}s); por lote p50 {lat[len(lat) // 2] * 1e3:.0f} ms, "
+              f"p95 {lat[int(len(lat) * .95)] * 1e3:.0f} ms; reenvío de un lote {again_s * 1e3:.0f} ms")
+        for name, passed in checks.items(): print(f"  {'OK   ' if passed else 'FALLA'} {name}")
+        if not all(checks.values()): raise SystemExit(1)
+    finally:
+        if proc: proc.terminate(); proc.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+# Suite por escalas: fixtures deterministas (simulate.generate con fecha de término fija) que se
+# construyen una vez y se reutilizan; cada ruta se mide sin navegador y sin caché de Streamlit.
+
+SCALES = {  # ~líneas de venta
+    "10k": dict(skus=100, stores=1, years=0.5, tickets=25),
+    "1m": dict(skus=1000, stores=5, years=1, tickets=250),
+    "10m": dict(skus=10000, stores=20, years=2, tickets=300),
+}
+FIXTURE_END = date(2025, 6, 30)
+FIXTURE_DIR = "bench_fixtures"
+HISTORY = "bench_history.json"
+
+def fixture(scale, fixture_dir=FIXTURE_DIR):
+    path = os.path.join(fixture_dir, f"{scale}.db")
+    if not os.path.exists(path):
+        import simulate
+        os.makedirs(fixture_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        for f in (tmp, tmp + "-wal", tmp + "-shm"):
+            if os.path.exists(f): os.remove(f)
+        print(f"Construyendo fixture {scale} ({SCALES[scale]})...", flush=True)
+        simulate.generate(tmp, end=FIXTURE_END, **SCALES[scale])
+        db.close_all(); fefo.invalidate(tmp)
+        os.replace(tmp, path)
+    return path
+
+def _measure(fn, repeat):
+    fn()  # calentar caché de páginas
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        fn(); peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"median_s": statistics.median(times), "min_s": min(times), "peak_mb": peak / 2**20}
+
+class _Rollback(Exception):
+    pass
+
+def suite_paths(path, now, n_sales=500):
+    """Rutas medidas: mismas funciones que usa app.py, llamadas con un db_loader sin caché."""
+    import analytics, forecast
+    from report_pdf import build_weekly_monthly_pdf
+    load, today = analytics.sqlite_loader(path), now.date()
+    # Sin guardar el estado: la fixture no cambia entre corridas
+    model = forecast.update(path, today, save=False)
+    Y, wd = forecast._matrix(db.reader(path).cursor(), model.ids, today - timedelta(days=forecast.HISTORY_DAYS), today)
+    n_products = db.reader(path).execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    baskets = _baskets(n_products, n_sales); sold_at = now.isoformat()
+    pdf = os.path.join(tempfile.mkdtemp(prefix="bench_pdf_"), "resumen.pdf")
+
+    def repos_liq():
+        stats = forecast.stats(model, today)
+        return analytics.replenishment(load, stats), analytics.liquidation(load, stats, now)
+    def fefo_consume():
+        # Se revierte al terminar: la fixture no cambia entre corridas
+        try:
+            with db.transaction(path) as w:
+                fefo.record_sales(w.cursor(), [{"sold_at": sold_at, "lines": lines} for lines in baskets], path)
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            fefo.invalidate(path, {pid for lines in baskets for pid, _, _, _ in lines})
+    return {
+        "forecast (carga + ajuste)": lambda: forecast.update(path, today, save=False),
+        "forecast_fit (NumPy)": lambda: forecast.fit(Y, wd, *forecast.initial_state(Y, wd)),
+        "panel_repos_liq": repos_liq,
+        "kpi_cards (Todo)": lambda: analytics.kpis(load),
+        "kpi_cards (Mes)": lambda: analytics.kpis(load, *analytics.period_range("Mes", today)),
+        f"fefo_consume ({n_sales} ventas)": fefo_consume,
+        "build_weekly_monthly_pdf": lambda: build_weekly_monthly_pdf(load, out_path=pdf),
+    }
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def bench_suite(scales, repeat=3, history=HISTORY, fixture_dir=FIXTURE_DIR):
+    runs = json.load(open(history, encoding="utf-8")) if history and os.path.exists(history) else []
+    now = datetime.combine(FIXTURE_END, dtime(21, 0))
+    records = []
+    for scale in scales:
+        path = fixture(scale, fixture_dir)
+        c = db.reader(path)
+        info = {"sale_lines": c.execute("SELECT COUNT(*) FROM sale_items").fetchone()[0],
+                "skus": c.execute("SELECT COUNT(*) FROM products").fetchone()[0]}
+        results = {name: _measure(fn, repeat) for name, fn in suite_paths(path, now).items()}
+        prev = next((r for r in reversed(runs) if r["scale"] == scale), None)
+        print(f"\n[{scale}] {info['sale_lines']:,} líneas, {info['skus']:,} SKUs" + (f" (vs {prev['commit']} {prev['ts'][:16]})" if prev else ""))
+        print(f"{'ruta':<32}{'mediana (ms)':>14}{'pico (MB)':>11}{'antes (ms)':>12}{'x':>7}")
+        for name, r in results.items():
+            before = prev["results"].get(name, {}).get("median_s") if prev else None
+            cmp = f"{before*1e3:>12.1f}{r['median_s'] / before:>7.2f}" if before else f"{'-':>12}{'':>7}"
+            flag = "  <- más lento" if before and r['median_s'] > before * 1.2 else ""
+            print(f"{name:<32}{r['median_s']*1e3:>14.1f}{r['peak_mb']:>11.1f}{cmp}{flag}")
+        rec = {"ts": datetime.now().isoformat(timespec="seconds"), "commit": _commit(), "python": platform.python_version(),
+               "sqlite": sqlite3.sqlite_version, "scale": scale, "fixture": info, "repeat": repeat, "results": results}
+        records.append(rec); runs.append(rec)
+    if history:
+        with open(history, "w", encoding="utf-8") as f: json.dump(runs, f, indent=1)
+    db.close_all()
+    return records
+
+# Multi-local: N bases de un local cada una (semillas distintas), con la foto de reposiciones ya
+# calculada como la dejaría el scheduler
+
+STORE_SCALE = dict(skus=200, stores=1, years=1, tickets=60)
+
+def store_fixtures(n, fixture_dir=FIXTURE_DIR):
+    import simulate, snapshots
+    paths = {}
+    for i in range(1, n + 1):
+        path = os.path.join(fixture_dir, "stores", f"local_{i:02d}.db")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            for f in (tmp, tmp + "-wal", tmp + "-shm"):
+                if os.path.exists(f): os.remove(f)
+            print(f"Construyendo local {i}/{n} ({STORE_SCALE})...", flush=True)
+            simulate.generate(tmp, seed=7 + i, end=FIXTURE_END, **STORE_SCALE)
+            snapshots.refresh(tmp, datetime.combine(FIXTURE_END, dtime(21, 0)))
+            db.close_all(); fefo.invalidate(tmp)
+            os.replace(tmp, path)
+        paths[f"Local {i:02d}"] = path
+    return paths
+
+def bench_stores(n, repeat=3, fixture_dir=FIXTURE_DIR, workers=None):
+    import analytics, stores
+    paths = store_fixtures(n, fixture_dir)
+    workers = workers or min(n, max(2, os.cpu_count() or 1))
+    lines = sum(db.reader(p).execute("SELECT COUNT(*) FROM sale_items").fetchone()[0] for p in paths.values())
+    print(f"\n{n} locales, {lines:,} líneas de venta; {workers} workers, {os.cpu_count()} CPU")
+    print(f"{'ruta':<28}{'serie (ms)':>12}{'hilos (ms)':>12}{'procesos (ms)':>15}")
+    modes = {"serie": stores.Chain(paths, 1), "hilos": stores.Chain(paths, workers, processes=False),
+             "procesos": stores.Chain(paths, workers)}
+    try:
+        for chain in modes.values(): chain.map(stores._daily)   # arranque del pool fuera de la medición
+        month = analytics.period_range("Mes", FIXTURE_END)
+        for name, call in {"kpis (Todo)": lambda c: c.kpis(), "kpis (Mes)": lambda c: c.kpis(*month),
+                           "ventas semanal/mensual": lambda c: c.weekly_monthly(), "reposiciones": lambda c: c.replenishment()}.items():
+            # Sin caché de la cadena: se mide la consulta a todos los locales y la suma de parciales
+            row = [_measure(lambda: (chain._cache.clear(), call(chain)), repeat)["median_s"] for chain in modes.values()]
+            print(f"{name:<28}" + "".join(f"{t*1e3:>{w}.1f}" for t, w in zip(row, (12, 12, 15))))
+        total, by_store = modes["serie"].kpis()
+        assert all(abs(m.kpis()[0]["sales"] - total["sales"]) < 1e-6 for m in modes.values())
+        assert abs(total["sales"] - sum(analytics.kpis(analytics.sqlite_loader(p))["sales"] for p in paths.values())) < 1e-6
+    finally:
+        for chain in modes.values(): chain.shutdown()
+        db.close_all()
+
+# Arranque: lo que app.py importa al cargar, además de la base que toda página necesita (Streamlit,
+# pandas, numpy: se importan antes y no se cuentan). Reportes PDF, gráficos, correo y scheduler se
+# importan al usarse; si vuelven al arranque, falla.
+IMPORT_BASE = ("streamlit", "pandas", "numpy")
+IMPORT_BUDGET_MS = 150
+LAZY_MODULES = ("matplotlib", "reportlab", "apscheduler", "smtplib", "report_pdf", "reports", "emailer")
+
+def app_imports(script="app.py"):
+    """Módulos que el script importa a nivel de módulo (no los de dentro de funciones)."""
+    import ast
+    tree = ast.parse(open(script, encoding="utf-8").read())
+    mods = []
+    for node in tree.body:
+        if isinstance(node, ast.Import): mods += [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0: mods.append(node.module)
+    return [m for m in dict.fromkeys(mods) if m.split(".")[0] not in IMPORT_BASE]
+
+def _importtime(mods):
+    # -X importtime en un proceso nuevo: {módulo raíz: ms acumulados} y módulos cargados después de la base
+    code = "\n".join(f"import {m}" for m in IMPORT_BASE + ("sys",)) + "\nprint('--', file=sys.stderr)\n" + "\n".join(f"import {m}" for m in mods)
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True).stderr
+    err = err.split("\n--\n", 1)[1]
+    rows = [l.split("|") for l in err.splitlines() if l.startswith("import time:")]
+    roots = {n.strip(): int(cum) / 1000 for _, cum, n in rows if not n.startswith("  ")}   # raíz: 1 espacio
+    return roots, {n.strip() for _, _, n in rows}
+
+def bench_imports(budget_ms=IMPORT_BUDGET_MS, repeat=5, script="app.py"):
+    mods = app_imports(script)
+    runs = [_importtime(mods) for _ in range(repeat)]
+    roots, loaded = min(runs, key=lambda r: sum(r[0].values()))   # la corrida más rápida: menos ruido
+    total = sum(roots.values())
+    print(f"{script}: {len(mods)} imports de módulo; {len(loaded)} módulos cargados además de {', '.join(IMPORT_BASE)}")
+    for mod, ms in sorted(roots.items(), key=lambda x: -x[1])[:12]:
+        print(f"  {ms:8.1f} ms  {mod}")
+    eager = sorted({m.split(".")[0] for m in loaded} & set(LAZY_MODULES))
+    print(f"Total {total:.0f} ms (presupuesto {budget_ms} ms)")
+    if eager: print("Se importan al arrancar y deberían ser diferidos:", ", ".join(eager))
+    if total > budget_ms or eager:
+        raise SystemExit(1)
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks de Pascucci Smart Inventory")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("conn", help="overhead por consulta: conexión nueva vs pool WAL")
+    p.add_argument("--db", default=db.DB); p.add_argument("-n", type=int, default=2000)
+    p = sub.add_parser("fefo", help="throughput de ventas con asignación FEFO")
+    p.add_argument("--products", type=int, default=500); p.add_argument("--lots", type=int, default=20)
+    p.add_argument("--sales", type=int, default=3000); p.add_argument("--batch", type=int, default=500)
+    p = sub.add_parser("suite", help="rutas principales por escala; agrega el resultado al historial JSON")
+    p.add_argument("--scales", default="10k", help=f"separadas por coma: {', '.join(SCALES)}")
+    p.add_argument("--repeat", type=int, default=3); p.add_argument("--history", default=HISTORY)
+    p.add_argument("--fixtures", default=FIXTURE_DIR)
+    p = sub.add_parser("stores", help="KPIs, ventas y reposiciones consolidadas de N locales (stores.py)")
+    p.add_argument("--stores", type=int, default=20); p.add_argument("--workers", type=int)
+    p.add_argument("--repeat", type=int, default=3); p.add_argument("--fixtures", default=FIXTURE_DIR)
+    p = sub.add_parser("cashiers", help="cajeros concurrentes (procesos x hilos) sobre una base: stock consistente y ventas/s")
+    p.add_argument("--procs", type=int, default=4); p.add_argument("--threads", type=int, default=2)
+    p.add_argument("--sales", type=int, default=200, help="ventas por cajero"); p.add_argument("--products", type=int, default=50)
+    p = sub.add_parser("ingest", help="API de ingesta del POS (ingest.py): boletas/s por HTTP e idempotencia")
+    p.add_argument("--receipts", type=int, default=20000); p.add_argument("--batch", type=int, default=500)
+    p.add_argument("--clients", type=int, default=4)
+    p = sub.add_parser("imports", help="tiempo de importación al arrancar app.py (-X importtime) contra un presupuesto")
+    p.add_argument("--budget-ms", type=int, default=IMPORT_BUDGET_MS); p.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    if args.cmd == "conn":
+        bench_conn(args.db, args.n)
+    elif args.cmd == "fefo":
+        bench_fefo(args.products, args.lots, args.sales, args.batch)
+    elif args.cmd == "suite":
+        bench_suite([s.strip() for s in args.scales.split(",")], args.repeat, args.history, args.fixtures)
+    elif args.cmd == "stores":
+        bench_stores(args.stores, args.repeat, args.fixtures, args.workers)
+    elif args.cmd == "cashiers":
+        bench_cashiers(args.procs, args.threads, args.sales, args.products)
+    elif args.cmd == "ingest":
+        bench_ingest(args.receipts, args.batch, args.clients)
+    elif args.cmd == "imports":
+        bench_imports(args.budget_ms, args.repeat)
+
+if __name__ == "__main__":
+    main()
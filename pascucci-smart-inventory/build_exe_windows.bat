@@ -6,6 +6,28 @@ set ADD_DATA=init_db.sql;init_db.sql ^
 ;app.py;app.py ^
 ;emailer.py;emailer.py ^
 ;report_pdf.py;report_pdf.py ^
+;schema.py;schema.py ^
+;db.py;db.py ^
+;analytics.py;analytics.py ^
+;rollup.py;rollup.py ^
+;margins.py;margins.py ^
+;fefo.py;fefo.py ^
+;importer.py;importer.py ^
+;exporter.py;exporter.py ^
+;qcache.py;qcache.py ^
+;snapshots.py;snapshots.py ^
+;reports.py;reports.py ^
+;backups.py;backups.py ^
+;audit.py;audit.py ^
+;paging.py;paging.py ^
+;forecast.py;forecast.py ^
+;stores.py;stores.py ^
+;lifecycle.py;lifecycle.py ^
+;archive.py;archive.py ^
+;profiler.py;profiler.py ^
+;outbox.py;outbox.py ^
+;ingest.py;ingest.py ^
+;migrations;migrations ^
 ;email_config.json;email_config.json ^
 ;pascucci.db;pascucci.db
 
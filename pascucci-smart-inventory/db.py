@@ -0,0 +1,237 @@
+import random, re, sqlite3, threading, time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+from schema import migrate
+
+DB = "pascucci.db"
+INIT_SQL = Path(__file__).with_name("init_db.sql")
+
+# PRAGMAs por conexión (journal_mode=WAL es persistente y se fija una vez en _setup)
+PRAGMAS = {
+    "synchronous": "NORMAL",     # con WAL no se pierde consistencia, sólo el último commit ante un corte
+    "cache_size": -32000,        # ~32 MB de page cache
+    "mmap_size": 268435456,      # 256 MB
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+    "busy_timeout": 2000,        # ms que SQLite espera el bloqueo de otro proceso antes de SQLITE_BUSY
+}
+
+# Escrituras: cada transacción empieza con BEGIN IMMEDIATE (toma el bloqueo de escritura antes de
+# leer: FEFO lee lotes y los descuenta sin que otro proceso escriba en medio). Si otro proceso lo
+# tiene más de busy_timeout, se reintenta hasta LOCK_RETRIES veces con espera exponencial y jitter.
+# Dentro del proceso los escritores hacen fila (FIFO) en la cola de escritura de cada base.
+LOCK_RETRIES = 5
+LOCK_BACKOFF_S = 0.05
+
+_lock = threading.Lock()
+_ready = set()
+_writers = {}
+_writer_locks = {}
+_tx_depth = {}
+_local = threading.local()
+
+# Versiones por tabla para cachés de lectura (qcache.py). El escritor anota qué tablas toca cada
+# sentencia y las incrementa al hacer commit; un commit de otro proceso sólo se ve como cambio de
+# PRAGMA data_version en el escritor y sube la época externa (invalida todo).
+_versions = defaultdict(lambda: defaultdict(int))   # path -> {tabla: n}; "*" = DDL
+_external = {}                                      # path -> [data_version visto, época]
+_WRITE_RE = re.compile(r"\b(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(?:\w+\.)?[\"`\[]?(\w+)", re.I)
+
+@lru_cache(maxsize=1024)
+def written_tables(sql):
+    if re.match(r"\s*(CREATE|DROP|ALTER)\b", sql, re.I): return ("*",)
+    return tuple({t.lower() for t in _WRITE_RE.findall(sql)} - {"set"})  # "DO UPDATE SET" de un upsert
+
+class _TrackingCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        self.connection._written.update(written_tables(sql))
+        return super().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        self.connection._written.update(written_tables(sql))
+        return super().executemany(sql, seq)
+
+class _WriterConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._written, self._path = set(), None
+        self._on_rollback = []   # callbacks de la transacción en curso (on_rollback)
+
+    def cursor(self, factory=_TrackingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+    def commit(self):
+        super().commit()
+        if self._written:
+            v = _versions[self._path]
+            with _lock:
+                for t in self._written: v[t] += 1
+            self._written.clear()
+        self._on_rollback.clear()
+
+    def rollback(self):
+        super().rollback()
+        self._written.clear()
+        hooks, self._on_rollback = self._on_rollback, []
+        for fn in hooks:
+            try:
+                fn()
+            except Exception as e:
+                print("Rollback hook error:", e)
+
+class _WriteQueue:
+    """Lock reentrante que atiende a los hilos en orden de llegada (threading.RLock no lo garantiza:
+    con muchos cajeros, uno puede quedar esperando mientras otros vuelven a entrar)."""
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._owner, self._depth, self._waiting = None, 0, deque()
+
+    def acquire(self, blocking=True):
+        me = threading.get_ident()
+        with self._mutex:
+            if self._owner == me or (self._owner is None and not self._waiting):
+                self._owner = me; self._depth += 1
+                return True
+            if not blocking: return False
+            ev = threading.Event(); self._waiting.append((me, ev))
+        ev.wait()   # release() nos pasa el lock
+        return True
+
+    def release(self):
+        with self._mutex:
+            self._depth -= 1
+            if self._depth: return
+            self._owner = None
+            if self._waiting:
+                self._owner, ev = self._waiting.popleft(); self._depth = 1; ev.set()
+
+    def waiting(self):
+        return len(self._waiting)
+
+    __enter__ = acquire
+    def __exit__(self, *exc): self.release()
+
+def _locked(e):
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e))
+
+def _begin(w, retries=LOCK_RETRIES, backoff=LOCK_BACKOFF_S):
+    for attempt in range(retries + 1):
+        try:
+            w.execute("BEGIN IMMEDIATE"); return
+        except sqlite3.OperationalError as e:
+            if not _locked(e) or attempt == retries: raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def _setup(path):
+    # Una vez por archivo y proceso: WAL + esquema base + migraciones pendientes
+    with _lock:
+        if path in _ready: return
+        c = sqlite3.connect(path)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.executescript(INIT_SQL.read_text(encoding="utf-8"))
+            migrate(c)
+        finally:
+            c.close()
+        _ready.add(path)
+
+def use(path=None):
+    """Base por defecto de este hilo (la app la fija en cada rerun según el local elegido; None = DB)."""
+    _local.path = path
+
+def resolve(path=None):
+    return path or getattr(_local, "path", None) or DB
+
+def connect(path=None, readonly=False, factory=sqlite3.Connection):
+    """Conexión nueva con los PRAGMAs del proyecto (para scripts y el pool)."""
+    path = resolve(path)
+    _setup(path)
+    c = sqlite3.connect(path, check_same_thread=False, factory=factory)
+    for k, v in PRAGMAS.items():
+        c.execute(f"PRAGMA {k}={v}")
+    if readonly:
+        c.execute("PRAGMA query_only=ON")
+    return c
+
+def reader(path=None):
+    """Conexión de lectura reutilizada por hilo (Streamlit ejecuta cada sesión en su hilo)."""
+    path = resolve(path)
+    pool = getattr(_local, "readers", None)
+    if pool is None:
+        pool = _local.readers = {}
+    if path not in pool:
+        pool[path] = connect(path, readonly=True)
+    return pool[path]
+
+def writer(path=None):
+    """Única conexión de escritura del proceso; usar vía transaction() salvo en scripts de un hilo."""
+    path = resolve(path)
+    with _lock:
+        if path in _writers: return _writers[path]
+    w = connect(path, factory=_WriterConnection); w._path = path
+    with _lock:
+        if path not in _writers:
+            _writers[path] = w; _writer_locks[path] = _WriteQueue(); _tx_depth[path] = 0
+            _external.setdefault(path, [w.execute("PRAGMA data_version").fetchone()[0], 0])
+        else:
+            w.close()
+        return _writers[path]
+
+def on_rollback(c, fn):
+    """Llama fn() si se revierte la transacción abierta en c (conexión de escritura o un cursor suyo),
+    también si falla el COMMIT; p.ej. para descartar estado en memoria que asumía esas escrituras.
+    Devuelve False si c no es del escritor (el llamador se arregla solo)."""
+    hooks = getattr(getattr(c, "connection", c), "_on_rollback", None)
+    if hooks is None: return False
+    hooks.append(fn)
+    return True
+
+@contextmanager
+def transaction(path=None):
+    """Serializa escritores del proceso (cola FIFO) y abre una transacción IMMEDIATE; commit al salir
+    del bloque más externo, rollback si falla."""
+    path = resolve(path)
+    w = writer(path)
+    with _writer_locks[path]:
+        _tx_depth[path] += 1
+        try:
+            if _tx_depth[path] == 1 and not w.in_transaction: _begin(w)
+            yield w
+            if _tx_depth[path] == 1: w.commit()
+        except BaseException:
+            if _tx_depth[path] == 1: w.rollback()
+            raise
+        finally:
+            _tx_depth[path] -= 1
+
+def versions(tables, path=None):
+    """Sello de validez para un resultado que lee `tables`: cambia cuando este proceso escribe en
+    alguna de ellas o cuando otro proceso hace commit."""
+    path = resolve(path)
+    w = writer(path); lock = _writer_locks[path]
+    # Si hay una transacción en curso no se espera: el cambio externo se detecta en la próxima consulta
+    if lock.acquire(blocking=False):
+        try:
+            dv = w.execute("PRAGMA data_version").fetchone()[0]
+            ext = _external[path]
+            if dv != ext[0]: ext[0] = dv; ext[1] += 1
+        finally:
+            lock.release()
+    v = _versions[path]
+    return (_external[path][1], v["*"]) + tuple(v[t] for t in tables)
+
+def close_all():
+    with _lock:
+        for w in _writers.values(): w.close()
+        _writers.clear(); _writer_locks.clear(); _tx_depth.clear()
+    for c in getattr(_local, "readers", {}).values(): c.close()
+    _local.readers = {}
@@ -1,30 +1,105 @@
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import base64, smtplib, uuid
+from email.header import Header
+from email.utils import formatdate, make_msgid
 from pathlib import Path
 
-def send_email(smtp_host, smtp_port, username, password, to_emails, subject, body, attachments=None, use_tls=True):
-    msg = MIMEMultipart()
-    msg['From'] = username
-    msg['To'] = ', '.join(to_emails)
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+# Envío SMTP. Session abre una conexión (STARTTLS + login) que sirve para varios correos; cada
+# correo se escribe al socket por partes (DATA): los adjuntos se leen del disco y se codifican en
+# base64 de a CHUNK bytes, sin armar el mensaje completo en memoria. Un error a mitad del DATA deja
+# la conexión en un estado desconocido: se cierra y el siguiente correo abre otra.
+
+CHUNK = 57 * 1024   # múltiplo de 57 bytes: líneas base64 completas de 76 caracteres
+TIMEOUT = 30
+
+def _b64_lines(data):
+    enc = base64.b64encode(data)
+    return b"".join(enc[i:i + 76] + b"\r\n" for i in range(0, len(enc), 76))
 
-    for att in (attachments or []):
+def _header(value):
+    return Header(value, "utf-8").encode() if not value.isascii() else value
+
+def _message(sender, to_emails, subject, body, attachments):
+    """Partes del mensaje MIME (bytes). El texto y los adjuntos van en base64: ninguna línea empieza
+    con '.', así que no hace falta el dot-stuffing de DATA."""
+    boundary = f"=_pascucci_{uuid.uuid4().hex}"
+    yield (f"From: {sender}\r\nTo: {', '.join(to_emails)}\r\nSubject: {_header(subject)}\r\n"
+           f"Date: {formatdate(localtime=True)}\r\nMessage-ID: {make_msgid()}\r\nMIME-Version: 1.0\r\n"
+           f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n').encode("ascii")
+    yield (f"--{boundary}\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Transfer-Encoding: base64\r\n\r\n").encode("ascii")
+    yield _b64_lines(body.encode("utf-8"))
+    for att in attachments:
         p = Path(att)
-        if p.exists():
-            part = MIMEBase('application','octet-stream')
-            with open(p, 'rb') as f:
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename="{p.name}"')
-            msg.attach(part)
-
-    server = smtplib.SMTP(smtp_host, smtp_port, timeout=30)
-    if use_tls:
-        server.starttls()
-    server.login(username, password)
-    server.sendmail(username, to_emails, msg.as_string())
-    server.quit()
+        name = p.name if p.name.isascii() else Header(p.name, "utf-8").encode()
+        yield (f"--{boundary}\r\nContent-Type: application/octet-stream\r\nContent-Transfer-Encoding: base64\r\n"
+               f'Content-Disposition: attachment; filename="{name}"\r\n\r\n').encode("ascii")
+        with open(p, "rb") as f:
+            while chunk := f.read(CHUNK):
+                yield _b64_lines(chunk)
+    yield f"--{boundary}--\r\n".encode("ascii")
+
+class Session:
+    """Conexión SMTP reutilizable: with Session(...) as s: s.send(...); s.send(...)."""
+    def __init__(self, smtp_host, smtp_port, username, password, use_tls=True, timeout=TIMEOUT):
+        self.host, self.port, self.username, self.password = smtp_host, int(smtp_port), username, password
+        self.use_tls, self.timeout = use_tls, timeout
+        self.smtp = None
+
+    def _connect(self):
+        self.smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            self.smtp.starttls()
+        if self.password:
+            self.smtp.login(self.username, self.password)
+
+    def __enter__(self):
+        self._connect()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.smtp.quit()
+        except smtplib.SMTPException:
+            self.smtp.close()
+        except OSError:
+            pass
+
+    def send(self, to_emails, subject, body, attachments=()):
+        """Envía un correo por la conexión abierta. Devuelve la respuesta del servidor al DATA."""
+        missing = [str(a) for a in attachments if not Path(a).exists()]
+        if missing: raise FileNotFoundError(f"Adjunto no encontrado: {', '.join(missing)}")
+        if self.smtp.sock is None: self._connect()   # cerrada tras un error a mitad del DATA
+        s = self.smtp
+        s.ehlo_or_helo_if_needed()
+        in_data = False
+        try:
+            code, resp = s.mail(self.username)
+            if code != 250: raise smtplib.SMTPSenderRefused(code, resp, self.username)
+            refused = {}
+            for rcpt in to_emails:
+                code, resp = s.rcpt(rcpt)
+                if code not in (250, 251): refused[rcpt] = (code, resp)
+            if len(refused) == len(to_emails): raise smtplib.SMTPRecipientsRefused(refused)
+            code, resp = s.docmd("DATA")
+            if code != 354: raise smtplib.SMTPDataError(code, resp)
+            in_data = True
+            for part in _message(self.username, to_emails, subject, body, attachments):
+                s.send(part)
+            s.send(b".\r\n")
+            code, resp = s.getreply()
+            in_data = False
+            if code != 250: raise smtplib.SMTPDataError(code, resp)
+        except Exception:
+            if in_data:
+                s.close()
+            else:
+                try:
+                    s.rset()   # la conexión queda lista para el siguiente correo
+                except (smtplib.SMTPException, OSError):
+                    s.close()
+            raise
+        return f"{code} {resp.decode(errors='replace')}"
+
+def send_email(smtp_host, smtp_port, username, password, to_emails, subject, body, attachments=None, use_tls=True):
+    # Un correo, con su propia conexión (el envío en segundo plano va por outbox.py)
+    with Session(smtp_host, smtp_port, username, password, use_tls) as s:
+        return s.send(to_emails, subject, body, [a for a in (attachments or []) if Path(a).exists()])
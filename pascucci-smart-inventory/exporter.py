@@ -0,0 +1,110 @@
+import csv, gzip
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+import db
+from schema import epoch
+
+# Exportación en streaming: un cursor recorre la tabla en bloques de BATCH filas y cada bloque se
+# escribe de inmediato (CSV gzip o Parquet, un row group por bloque). La memoria depende del
+# tamaño del bloque, no de la tabla. Se lee dentro de una transacción: es una foto consistente.
+
+EXPORTABLE = ["products", "lots", "sales", "sale_items", "waste", "promos", "suppliers", "audit"]
+FORMATS = {"csv.gz": "CSV (gzip)", "parquet": "Parquet"}
+BATCH = 10_000
+EXPORT_DIR = Path("exports")
+
+# Columna epoch usada por el filtro de fechas (sale_items se filtra por la fecha de su venta)
+DATE_COLUMN = {"sales": "sold_at_epoch", "lots": "received_at_epoch", "waste": "ts_epoch",
+               "audit": "ts_epoch", "promos": "starts_at_epoch", "sale_items": "s.sold_at_epoch"}
+
+@lru_cache(maxsize=1)
+def _pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+def formats():
+    """Los FORMATS que se pueden escribir en esta instalación (Parquet requiere pyarrow)."""
+    return {k: v for k, v in FORMATS.items() if k != "parquet" or _pyarrow()}
+
+def _query(table, start=None, end=None):
+    frm = f"{table} t" + (" JOIN sales s ON s.id=t.sale_id" if table == "sale_items" and (start or end) else "")
+    col = DATE_COLUMN.get(table)
+    col = col if col is None or "." in col else f"t.{col}"
+    cond, params = [], []
+    if col and start is not None: cond.append(f"{col} >= ?"); params.append(epoch(start))
+    if col and end is not None: cond.append(f"{col} < ?"); params.append(epoch(end))
+    return frm + (" WHERE " + " AND ".join(cond) if cond else ""), params
+
+def _arrow_schema(c, table, names):
+    import pyarrow as pa
+    types = {r[1]: (r[2] or "").upper() for r in c.execute(f"PRAGMA table_xinfo({table})").fetchall()}
+    def arrow_type(t):
+        if "INT" in t: return pa.int64()
+        if "REAL" in t or "FLOA" in t or "DOUB" in t: return pa.float64()
+        return pa.string()
+    return pa.schema([(n, arrow_type(types.get(n, ""))) for n in names])
+
+def export_table(table, dst, fmt="csv.gz", start=None, end=None, path=None, batch=BATCH, progress=None):
+    """Escribe `table` en dst (ruta o archivo binario) como csv.gz o parquet. start/end: rango
+    semiabierto de fechas (sólo tablas con columna de fecha). progress(filas, total). Devuelve filas escritas."""
+    if table not in EXPORTABLE: raise ValueError(f"Tabla no exportable: {table}")
+    if fmt not in formats(): raise ValueError(f"Formato no soportado: {fmt}" + (" (falta pyarrow)" if fmt in FORMATS else ""))
+    if (start or end) and table not in DATE_COLUMN: raise ValueError(f"{table} no tiene filtro de fecha")
+    frm, params = _query(table, start, end)
+    # Conexión propia: un recorrido largo no debe quedar a medias en el lector compartido del hilo
+    c = db.connect(path, readonly=True)
+    try:
+        c.execute("BEGIN")
+        total = c.execute(f"SELECT COUNT(*) FROM {frm}", params).fetchone()[0] if progress else None
+        cur = c.execute(f"SELECT t.* FROM {frm} ORDER BY t.rowid", params)
+        names = [d[0] for d in cur.description]
+        n = 0
+        if fmt == "csv.gz":
+            with gzip.open(dst, "wt", encoding="utf-8", newline="") as f:
+                w = csv.writer(f); w.writerow(names)
+                while rows := cur.fetchmany(batch):
+                    w.writerows(rows); n += len(rows)
+                    if progress: progress(n, total)
+        else:
+            import pyarrow as pa, pyarrow.parquet as pq
+            schema = _arrow_schema(c, table, names)
+            with pq.ParquetWriter(dst, schema, compression="zstd") as w:
+                while rows := cur.fetchmany(batch):
+                    cols = list(zip(*rows))
+                    w.write_table(pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(cols, schema)], schema=schema))
+                    n += len(rows)
+                    if progress: progress(n, total)
+        return n
+    finally:
+        c.close()
+
+def export_file(table, fmt="csv.gz", start=None, end=None, path=None, out_dir=EXPORT_DIR, progress=None):
+    """Exporta a out_dir/<tabla>_<rango o timestamp>.<fmt>; devuelve (ruta, filas)."""
+    out_dir = Path(out_dir); out_dir.mkdir(parents=True, exist_ok=True)
+    tag = f"{start:%Y%m%d}-{end - timedelta(days=1):%Y%m%d}" if start and end else datetime.now().strftime("%Y%m%d_%H%M%S")
+    out = out_dir / f"{table}_{tag}.{fmt}"
+    return out, export_table(table, out, fmt, start, end, path, progress=progress)
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import date
+    ap = argparse.ArgumentParser(description="Exporta tablas en streaming (p.ej. volcado nocturno)")
+    ap.add_argument("tables", nargs="+", help=f"tablas o 'all' ({', '.join(EXPORTABLE)})")
+    ap.add_argument("--db", default=db.DB); ap.add_argument("--format", choices=list(formats()), default="csv.gz")
+    ap.add_argument("--since", type=date.fromisoformat, help="desde (incluido), YYYY-MM-DD")
+    ap.add_argument("--until", type=date.fromisoformat, help="hasta (incluido), YYYY-MM-DD")
+    ap.add_argument("--out-dir", default=str(EXPORT_DIR))
+    args = ap.parse_args()
+    tables = EXPORTABLE if args.tables == ["all"] else args.tables
+    start = datetime.combine(args.since, datetime.min.time()) if args.since else None
+    end = datetime.combine(args.until + timedelta(days=1), datetime.min.time()) if args.until else None
+    for t in tables:
+        # En 'all' las tablas sin fecha (products, suppliers) se exportan completas
+        s, e = (start, end) if t in DATE_COLUMN else (None, None)
+        out, n = export_file(t, args.format, s, e, args.db, args.out_dir)
+        print(f"{t}: {n:,} filas -> {out}")
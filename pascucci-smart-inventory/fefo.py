@@ -0,0 +1,164 @@
+import heapq, threading
+from collections import defaultdict
+
+import db
+import rollup
+
+# Asignación FEFO compartida por la app y simulate.py.
+# Mantiene en memoria, por producto, un heap de lotes abiertos ordenado por vencimiento
+# (sin vencimiento primero, igual que ORDER BY expiration_epoch ASC) y descuenta la canasta
+# completa con un único executemany dentro de la transacción del llamador.
+
+_NO_EXP = -(1 << 62)
+
+class StaleLots(Exception):
+    pass
+
+class FefoAllocator:
+    """No es thread-safe por sí solo: se usa con la conexión de escritura, bajo db.transaction()."""
+
+    def __init__(self):
+        self._heaps = {}      # product_id -> heap de [exp_epoch, lot_id, qty]
+        self._stock = {}      # product_id -> suma de qty en el heap
+        self._warm = False    # True si los heaps tienen todos los lotes abiertos del catálogo
+        self._data_version = None
+
+    def invalidate(self, product_ids=None):
+        if product_ids is None:
+            self._heaps.clear(); self._stock.clear(); self._warm = False; return
+        for pid in product_ids:
+            self._heaps.pop(int(pid), None); self._stock.pop(int(pid), None)
+
+    def _sync(self, cur):
+        # data_version cambia cuando otra conexión (otro proceso) hace commit
+        v = cur.execute("PRAGMA data_version").fetchone()[0]
+        if v != self._data_version:
+            self.invalidate(); self._data_version = v
+
+    def _fill(self, rows, product_ids):
+        touched = set(product_ids)
+        for p in touched:
+            self._heaps[p] = []; self._stock[p] = 0
+        for pid, exp, lot_id, qty in rows:
+            if pid not in touched:
+                self._heaps[pid] = []; self._stock[pid] = 0; touched.add(pid)
+            self._heaps[pid].append([_NO_EXP if exp is None else exp, lot_id, qty]); self._stock[pid] += qty
+        for p in touched:
+            heapq.heapify(self._heaps[p])
+
+    def _load(self, cur, product_ids):
+        if not self._warm:
+            # Primer uso: todos los lotes abiertos en una sola lectura (proporcional al stock físico)
+            self._fill(cur.execute("SELECT product_id, expiration_epoch, id, qty_current FROM lots WHERE status='vigente' AND qty_current>0").fetchall(), product_ids)
+            self._warm = True
+            return
+        missing = [p for p in product_ids if p not in self._heaps]
+        if not missing: return
+        self._fill(cur.execute(f"""SELECT product_id, expiration_epoch, id, qty_current FROM lots
+            WHERE product_id IN ({','.join('?'*len(missing))}) AND status='vigente' AND qty_current>0""", missing).fetchall(), missing)
+
+    def allocate(self, cur, lines):
+        """[(product_id, qty)] -> [(product_id, [(lot_id, qty)], faltante)]; descuenta en memoria."""
+        self._sync(cur)
+        need = defaultdict(int)
+        for pid, qty in lines: need[int(pid)] += int(qty)
+        self._load(cur, need)
+        # Antes de declarar faltante, recargar desde la base (la memoria pudo quedar atrasada)
+        short = [p for p, q in need.items() if self._stock[p] < q]
+        if short:
+            for p in short: del self._heaps[p]
+            self._load(cur, short)
+        out = []
+        for pid, qty in lines:
+            pid = int(pid); heap = self._heaps[pid]; remain = int(qty); taken = []
+            while remain > 0 and heap:
+                top = heap[0]; take = min(remain, top[2])
+                taken.append((top[1], take)); top[2] -= take; remain -= take
+                if top[2] == 0: heapq.heappop(heap)
+            self._stock[pid] -= int(qty) - remain
+            out.append((pid, taken, remain))
+        return out
+
+    def apply(self, cur, allocations):
+        """Descuenta los lotes con un solo executemany (los que se agotan pasan a 'vendido').
+        StaleLots si algún lote ya no tenía ese stock o ya no está vigente (vencido/descartado)."""
+        per_lot = defaultdict(int)   # en un lote de ventas, varias líneas suelen tomar del mismo lote
+        for _, taken, _ in allocations:
+            for lot_id, take in taken: per_lot[lot_id] += take
+        ups = [(take, take, lot_id, take) for lot_id, take in per_lot.items()]
+        if not ups: return
+        # El lote que queda en 0 sale de los abiertos en el mismo UPDATE (lifecycle.py)
+        cur.executemany("""UPDATE lots SET qty_current=qty_current-?, status=CASE WHEN qty_current=? THEN 'vendido' ELSE status END
+                           WHERE id=? AND status='vigente' AND qty_current>=?""", ups)
+        if cur.rowcount != len(ups):
+            raise StaleLots(f"{len(ups) - cur.rowcount} lote(s) con stock distinto al esperado")
+
+_lock = threading.Lock()
+_allocators = {}
+
+def get_allocator(path=None):
+    path = db.resolve(path)
+    with _lock:
+        if path not in _allocators: _allocators[path] = FefoAllocator()
+        return _allocators[path]
+
+def invalidate(path=None, product_ids=None):
+    # Llamar tras escribir lotes fuera de record_sale (alta/edición/borrado/importación) en este proceso
+    get_allocator(path).invalidate(product_ids)
+
+def consume(cur, lines, path=None):
+    """Asigna y descuenta lotes FEFO para [(product_id, qty)]; reintenta una vez si la memoria estaba atrasada."""
+    alloc = get_allocator(path)
+    for attempt in (1, 2):
+        cur.execute("SAVEPOINT fefo")
+        allocations = alloc.allocate(cur, lines)
+        try:
+            alloc.apply(cur, allocations)
+            cur.execute("RELEASE fefo")
+            return allocations
+        except StaleLots:
+            cur.execute("ROLLBACK TO fefo"); cur.execute("RELEASE fefo")
+            alloc.invalidate()
+            if attempt == 2: raise
+
+def _iso(ts):
+    return ts.isoformat() if hasattr(ts, "isoformat") else str(ts)
+
+def record_sales(cur, sales, path=None):
+    """Registra un lote de ventas sin hacer commit. Cada venta es un dict con sold_at y
+    lines=[(product_id, qty, unit_price, unit_cost)] (opcionales: payment_method, channel, receipt_no).
+    Escribe sales, una sale_items por lote asignado (lot_id NULL para lo que no tuvo stock),
+    el descuento FEFO de lotes y los rollups diarios; lotes, ítems y rollup con un executemany cada uno.
+    Devuelve [(sale_id, asignaciones)] en el mismo orden."""
+    if not sales: return []
+    allocations = consume(cur, [(pid, q) for s in sales for pid, q, _, _ in s['lines']], path)
+    touched = {pid for pid, _, _ in allocations}
+    # La memoria ya descontó estos lotes: si la transacción del llamador se revierte después (auditoría,
+    # COMMIT fallido...), se recargan de la base
+    db.on_rollback(cur, lambda: get_allocator(path).invalidate(touched))
+    try:
+        out, items, roll, totals, k = [], [], [], [], 0
+        for s in sales:
+            sold_at, lines = _iso(s['sold_at']), s['lines']
+            total = sum(int(q)*float(price) for _, q, price, _ in lines)
+            cur.execute("INSERT INTO sales(sold_at, channel, payment_method, receipt_no, total) VALUES(?,?,?,?,?)",
+                        (sold_at, s.get('channel', 'local'), s.get('payment_method', 'mixto'), s.get('receipt_no'), total))
+            sale_id = cur.lastrowid
+            sale_alloc = allocations[k:k + len(lines)]; k += len(lines)
+            for (pid, q, price, cost), (_, taken, remain) in zip(lines, sale_alloc):
+                items += [(sale_id, int(pid), lot_id, take, float(price), float(cost or 0)) for lot_id, take in taken]
+                if remain > 0: items.append((sale_id, int(pid), None, remain, float(price), float(cost or 0)))
+            roll.append((sold_at, lines)); totals.append((sold_at, total))
+            out.append((sale_id, sale_alloc))
+        cur.executemany("INSERT INTO sale_items(sale_id, product_id, lot_id, qty, unit_price, promo_id, unit_cost) VALUES(?,?,?,?,?,NULL,?)", items)
+        rollup.apply_sales(cur, roll); rollup.apply_totals(cur, totals)
+    except Exception:
+        # Por si la conexión no es la del escritor (sin on_rollback)
+        get_allocator(path).invalidate(touched)
+        raise
+    return out
+
+def record_sale(cur, sold_at, lines, payment_method="mixto", channel="local", receipt_no=None, path=None):
+    """Una venta (ver record_sales). Devuelve (sale_id, asignaciones)."""
+    return record_sales(cur, [{"sold_at": sold_at, "lines": lines, "payment_method": payment_method,
+                               "channel": channel, "receipt_no": receipt_no}], path)[0]
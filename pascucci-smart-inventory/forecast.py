@@ -0,0 +1,156 @@
+import json, threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import db
+
+# Pronóstico de demanda diaria por producto: suavizado exponencial con estacionalidad semanal
+# (Holt-Winters aditivo sin tendencia) ajustado para todos los SKU a la vez sobre una matriz
+# días x SKU. El estado (nivel, 7 estacionales y error por SKU) se guarda en forecast_state:
+# cuando llegan días nuevos sólo se leen y se aplican esos días. Sólo entran días completos
+# (hasta ayer). Media y error del pronóstico alimentan ROP y liquidaciones (analytics).
+
+ALPHA, GAMMA, BETA = 0.05, 0.05, 0.05  # suavizado de nivel, estacionalidad y error cuadrático
+HISTORY_DAYS = 730                     # ventana del ajuste completo
+INIT_DAYS = 28                         # días para el estado inicial
+HORIZON = 7                            # días que promedia mean_daily
+_SEASON = [f"s{i}" for i in range(7)]
+
+def fit(Y, weekdays, level, season, mse, alpha=ALPHA, gamma=GAMMA, beta=BETA):
+    """Aplica los días de Y (días x SKU) en orden; weekdays: día de la semana (0=lunes) de cada fila.
+    Actualiza level (SKU), season (7 x SKU) y mse (SKU) en el lugar."""
+    for y, w in zip(Y, weekdays):
+        s = season[w]
+        e = y - level - s                      # error del pronóstico a un día
+        mse += beta * (e * e - mse)
+        level += alpha * e
+        season[w] = s + gamma * (y - level - s)
+    return level, season, mse
+
+def initial_state(Y, weekdays):
+    """Nivel = media de los primeros INIT_DAYS días; estacional = media por día de semana - nivel."""
+    head, wd = Y[:INIT_DAYS], np.asarray(weekdays[:INIT_DAYS])
+    n = Y.shape[1]
+    level = head.mean(axis=0) if len(head) else np.zeros(n)
+    season = np.zeros((7, n))
+    for w in range(7):
+        if (wd == w).any(): season[w] = head[wd == w].mean(axis=0) - level
+    mse = head.var(axis=0) if len(head) else np.zeros(n)
+    return level, season, mse
+
+def predict(level, season, mse, first_day, horizon=HORIZON):
+    """(media diaria de los próximos `horizon` días desde first_day, desviación del error) por SKU."""
+    w = (first_day.weekday() + np.arange(horizon)) % 7
+    return np.clip(level + season[w], 0, None).mean(axis=0), np.sqrt(mse)
+
+class Model:
+    def __init__(self, ids, level, season, mse, next_day):
+        self.ids, self.level, self.season, self.mse, self.next_day = ids, level, season, mse, next_day
+
+    def align(self, ids):
+        """Agrega productos nuevos (estado en cero) manteniendo el orden por id."""
+        new = np.setdiff1d(ids, self.ids)
+        if not len(new): return
+        all_ids = np.union1d(self.ids, new); pos = np.searchsorted(all_ids, self.ids)
+        level, season, mse = np.zeros(len(all_ids)), np.zeros((7, len(all_ids))), np.zeros(len(all_ids))
+        level[pos], season[:, pos], mse[pos] = self.level, self.season, self.mse
+        self.ids, self.level, self.season, self.mse = all_ids, level, season, mse
+
+def _matrix(cur, ids, start, end):
+    # Y[día, SKU] para [start, end) con una sola consulta; los días sin fila en el rollup son 0
+    days = (end - start).days
+    Y = np.zeros((max(days, 0), len(ids)))
+    rows = cur.execute("SELECT julianday(day) - julianday(?), product_id, qty FROM daily_product_sales WHERE day >= ? AND day < ?",
+                       (start.isoformat(), start.isoformat(), end.isoformat())).fetchall() if days > 0 else []
+    if rows:
+        a = np.array(rows, dtype=np.float64)
+        d, p = a[:, 0].astype(np.int64), a[:, 1].astype(np.int64)
+        keep = np.isin(p, ids)
+        Y[d[keep], np.searchsorted(ids, p[keep])] = a[keep, 2]
+    return Y, [(start + timedelta(days=i)).weekday() for i in range(days)]
+
+def _params():
+    return json.dumps({"alpha": ALPHA, "gamma": GAMMA, "beta": BETA})
+
+def _load(cur):
+    meta = cur.execute("SELECT computed_at, params FROM snapshot_meta WHERE name='forecast'").fetchone()
+    if not meta or meta[1] != _params(): return None
+    st = np.array(cur.execute(f"SELECT product_id, level, {', '.join(_SEASON)}, mse FROM forecast_state ORDER BY product_id").fetchall(), dtype=np.float64)
+    if not len(st): return None
+    return Model(st[:, 0].astype(np.int64), st[:, 1].copy(), st[:, 2:9].T.copy(), st[:, 9].copy(), date.fromisoformat(meta[0][:10]))
+
+def _save(model, path):
+    rows = [(int(i), float(l), *map(float, s), float(m)) for i, l, s, m in zip(model.ids, model.level, model.season.T, model.mse)]
+    with db.transaction(path) as c:
+        c.execute("DELETE FROM forecast_state")
+        c.executemany(f"INSERT INTO forecast_state VALUES({','.join('?' * 10)})", rows)
+        c.execute("INSERT OR REPLACE INTO snapshot_meta(name, computed_at, params) VALUES('forecast', ?, ?)",
+                  (model.next_day.isoformat(), _params()))
+
+_lock = threading.Lock()
+_models = {}   # path -> Model (copia en memoria del estado guardado)
+
+def _fitted(cur):
+    # Día hasta el que llega el estado guardado ('' si no hay): lo escribe _save y lo borra invalidate,
+    # también desde otro proceso (ingest.py)
+    return (cur.execute("SELECT computed_at FROM snapshot_meta WHERE name='forecast'").fetchone() or [""])[0][:10]
+
+def invalidate(path=None, since=None):
+    """Descarta el estado (p.ej. tras importar o borrar ventas de días pasados): el próximo update
+    reajusta todo. Con since (día 'YYYY-MM-DD' del cambio) no hace nada si ese día aún no se aplicó."""
+    path = db.resolve(path)
+    with _lock:
+        if since is not None:
+            fitted = _fitted(db.reader(path).cursor())
+            if not fitted or str(since)[:10] >= fitted: return
+        _models.pop(path, None)
+        with db.transaction(path) as c:
+            c.execute("DELETE FROM forecast_state"); c.execute("DELETE FROM snapshot_meta WHERE name='forecast'")
+
+def update(path=None, today=None, save=True):
+    """Modelo ajustado hasta ayer (respecto de `today`): aplica sólo los días que falten."""
+    path = db.resolve(path)
+    today = today or date.today()
+    with _lock:
+        cur = db.reader(path).cursor()
+        ids = np.array([r[0] for r in cur.execute("SELECT id FROM products ORDER BY id")], dtype=np.int64)
+        model = _models.get(path)
+        if model is None or model.next_day.isoformat() != _fitted(cur):
+            model = _load(cur)   # sin copia, o la base cambió (otro proceso guardó o invalidó)
+        if model is not None and model.next_day > today:
+            model, save = None, False   # consulta a una fecha pasada: ajuste aparte, sin guardar
+        if model is None or (today - model.next_day).days > HISTORY_DAYS:
+            start = today - timedelta(days=HISTORY_DAYS)
+            Y, wd = _matrix(cur, ids, start, today)
+            model = Model(ids, *initial_state(Y, wd), start)
+        else:
+            model.align(ids)
+            Y, wd = _matrix(cur, model.ids, model.next_day, today)
+        if len(Y):
+            fit(Y, wd, model.level, model.season, model.mse)
+            model.next_day = today
+            if save: _save(model, path)
+        if save: _models[path] = model
+        return model
+
+def stats(model, today, horizon=HORIZON):
+    """Mismo formato que analytics.demand_stats: product_id, mean_daily (pronóstico medio de los
+    próximos `horizon` días) y std_daily (error del pronóstico a un día)."""
+    mean, std = predict(model.level, model.season, model.mse, today, horizon)
+    return pd.DataFrame({"product_id": model.ids, "mean_daily": mean, "std_daily": std})
+
+def demand_stats(path=None, today=None, horizon=HORIZON):
+    today = today or date.today()
+    return stats(update(path, today), today, horizon)
+
+if __name__ == "__main__":
+    import argparse, time
+    ap = argparse.ArgumentParser(description="Ajusta (o reajusta) el pronóstico de demanda")
+    ap.add_argument("--db", default=db.DB); ap.add_argument("--refit", action="store_true", help="descartar el estado y ajustar de cero")
+    ap.add_argument("--today", type=date.fromisoformat)
+    args = ap.parse_args()
+    if args.refit: invalidate(args.db)
+    t = time.perf_counter(); m = update(args.db, args.today)
+    print(f"{len(m.ids):,} productos ajustados hasta {m.next_day - timedelta(days=1)} en {time.perf_counter() - t:.2f}s")
@@ -0,0 +1,216 @@
+import csv, io, os
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import archive
+import db
+from schema import generated_columns
+import fefo
+import forecast
+import rollup
+
+# Importación de CSV por bloques: lee en streaming, valida/convierte según el esquema de la tabla
+# (init_db.sql + migraciones), rechaza filas inválidas con su motivo e inserta con executemany,
+# todo en una sola transacción: si algo falla a mitad de camino no queda nada a medias.
+
+IMPORTABLE = ["products", "lots", "sales", "sale_items", "waste", "promos", "suppliers"]
+CHUNK_ROWS = 5000
+MAX_REJECTS = 10_000       # detalle guardado; el conteo de rechazos es siempre completo
+_IN_BATCH = 900            # variables por IN (...) (límite clásico de SQLite: 999)
+
+# CHECK de init_db.sql que conviene validar antes de insertar (un CHECK fallido abortaría el executemany)
+ENUMS = {("lots", "status"): {"vigente", "vendido", "vencido", "descartado"}}
+
+class InvalidImport(ValueError):
+    pass
+
+def _columns(cur, table):
+    # (nombre, tipo, notnull, default, pk) sin columnas GENERATED
+    return [(r[1], (r[2] or "").upper(), bool(r[3]), r[4], bool(r[5]))
+            for r in cur.execute(f"PRAGMA table_xinfo({table})").fetchall() if r[6] == 0]
+
+def _default(sql_default):
+    if sql_default is None: return None
+    if sql_default.upper() == "CURRENT_TIMESTAMP": return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    return sql_default.strip("'")
+
+_INT_MAX = 2**63 - 1       # INTEGER de SQLite
+
+def _int(v):
+    # Entero exacto (sin pasar por float: ids y números de boleta sobre 2^53); acepta '3.0' o '1e3'
+    try:
+        n = int(v)
+    except ValueError:
+        try:
+            d = Decimal(v)
+        except InvalidOperation:
+            raise ValueError(f"'{v}' no es entero")
+        if not d.is_finite() or d != d.to_integral_value(): raise ValueError(f"'{v}' no es entero")
+        if d.adjusted() > 18: raise ValueError(f"'{v}' fuera de rango")
+        n = int(d)
+    if not -_INT_MAX - 1 <= n <= _INT_MAX: raise ValueError(f"'{v}' fuera de rango")
+    return n
+
+def _coercer(col_type):
+    if "INT" in col_type:
+        return _int
+    if "REAL" in col_type or "FLOA" in col_type or "DOUB" in col_type:
+        return float
+    if "DATE" in col_type:
+        def conv(v):
+            d = datetime.fromisoformat(v)
+            return v if len(v) == 10 else d.isoformat()
+        return conv
+    return str
+
+def _unique_cols(cur, table):
+    cols = {"id"}
+    for idx in cur.execute(f"PRAGMA index_list({table})").fetchall():
+        if idx[2]:  # unique
+            info = cur.execute(f"PRAGMA index_info({idx[1]})").fetchall()
+            if len(info) == 1: cols.add(info[0][2])
+    return cols
+
+def _existing(cur, table, col, values):
+    return {r[0] for r in _pairs(cur, f"SELECT {col} FROM {table} WHERE {col} IN ({{}})", values)}
+
+def import_csv(fileobj, table, path=None, upsert=False, chunk_rows=CHUNK_ROWS, progress=None):
+    """Importa un CSV (objeto binario) a `table`. upsert=True (sólo products) actualiza por SKU.
+    progress(fracción, resultado_parcial) se llama tras cada bloque.
+    Devuelve {"read", "inserted", "updated", "rejected", "rejects": [(línea, motivo, fila)]}.
+    Lanza InvalidImport (sin escribir nada) si el archivo no calza con la tabla."""
+    if table not in IMPORTABLE: raise InvalidImport(f"Tabla no importable: {table}")
+    if upsert and table != "products": raise InvalidImport("El upsert por SKU sólo aplica a products")
+    size = None
+    if fileobj.seekable():
+        fileobj.seek(0, os.SEEK_END); size = fileobj.tell(); fileobj.seek(0)
+    reader = csv.reader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+    header = [h.strip() for h in next(reader, [])]
+    res = {"read": 0, "inserted": 0, "updated": 0, "rejected": 0, "rejects": []}
+
+    def reject(line, reason, row):
+        res["rejected"] += 1
+        if len(res["rejects"]) < MAX_REJECTS: res["rejects"].append((line, reason, row))
+
+    with db.transaction(path) as c:
+        cur = c.cursor()
+        if not header: raise InvalidImport("CSV vacío")
+        schema = {name: (ctype, notnull, dflt, pk) for name, ctype, notnull, dflt, pk in _columns(cur, table)}
+        generated = set(generated_columns(c, table))  # p.ej. *_epoch de exportaciones: se recalculan solas
+        unknown = [h for h in header if h not in schema and h not in generated]
+        if unknown: raise InvalidImport(f"Columnas desconocidas para {table}: {', '.join(unknown)}")
+        if upsert and "sku" not in header: raise InvalidImport("El upsert requiere la columna sku")
+        # En upsert el id lo asigna la base: la clave es el SKU
+        cols = [h for h in header if h in schema and not (upsert and h == "id")]
+        pos = [header.index(h) for h in cols]
+        conv = [_coercer(schema[h][0]) for h in cols]
+        fks = {r[3]: (r[2], r[4] or "id") for r in cur.execute(f"PRAGMA foreign_key_list({table})").fetchall() if r[3] in cols}
+        uniques = [u for u in _unique_cols(cur, table) if u in cols and not (upsert and u == "sku")]
+        # Columnas con DEFAULT que vienen vacías: se usa el default (igual que si la columna no viniera)
+        defaults = {i: _default(schema[h][2]) for i, h in enumerate(cols) if schema[h][2] is not None}
+        placeholders = ",".join("?"*len(cols))
+        sql = f"INSERT INTO {table}({','.join(cols)}) VALUES({placeholders})"
+        if upsert:
+            sets = ", ".join(f"{h}=excluded.{h}" for h in cols if h != "sku")
+            sql += f" ON CONFLICT(sku) DO UPDATE SET {sets}" if sets else " ON CONFLICT(sku) DO NOTHING"
+        item_cost = dict(cur.execute("SELECT id, unit_cost FROM products").fetchall()) if table == "sale_items" else {}
+
+        def flush(chunk):
+            # chunk: [(línea, valores, fila_cruda)]
+            for col, (ref, to) in fks.items():
+                i = cols.index(col)
+                ok = _existing(cur, ref, to, {v[i] for _, v, _ in chunk if v[i] is not None})
+                bad = [(ln, v, raw) for ln, v, raw in chunk if v[i] is not None and v[i] not in ok]
+                for ln, v, raw in bad: reject(ln, f"{col}={v[i]} no existe en {ref}", raw)
+                if bad: chunk = [t for t in chunk if t[1][i] is None or t[1][i] in ok]
+            for col in uniques:
+                i = cols.index(col); seen = _existing(cur, table, col, {v[i] for _, v, _ in chunk if v[i] is not None}); kept = []
+                for t in chunk:
+                    val = t[1][i]
+                    if val is not None and val in seen: reject(t[0], f"{col}={val} duplicado", t[2]); continue
+                    if val is not None: seen.add(val)
+                    kept.append(t)
+                chunk = kept
+            if not chunk: return
+            rows = [v for _, v, _ in chunk]
+            if upsert:
+                i = cols.index("sku"); existing = _existing(cur, table, "sku", {v[i] for v in rows}); new_skus = set()
+                for v in rows:
+                    if v[i] in existing or v[i] in new_skus: res["updated"] += 1
+                    else: res["inserted"] += 1; new_skus.add(v[i])
+            else:
+                res["inserted"] += len(rows)
+            cur.executemany(sql, rows)
+            if table == "sale_items" and "sale_id" in cols and "product_id" in cols:
+                _rollup_items(cur, cols, rows, item_cost)
+            if table == "sales" and "sold_at" in cols:
+                # Ventas importadas (con o sin ítems) suman al total diario, como las registradas en la app
+                i, t = cols.index("sold_at"), cols.index("total") if "total" in cols else None
+                rollup.apply_totals(cur, [(v[i], v[t] if t is not None else 0) for v in rows])
+
+        def row_values(raw):
+            if len(raw) != len(header): raise ValueError(f"{len(raw)} campos, se esperaban {len(header)}")
+            vals = []
+            for k, (p, f, h) in enumerate(zip(pos, conv, cols)):
+                v = raw[p].strip()
+                if v == "":
+                    v = defaults.get(k)
+                    if v is None and h == "unit_cost" and table == "sale_items":
+                        pid = raw[header.index("product_id")].strip() if "product_id" in header else ""
+                        v = item_cost.get(_int(pid)) if pid else None
+                    if v is None and schema[h][1]: raise ValueError(f"{h} es obligatorio")
+                    vals.append(None if v is None else f(str(v))); continue
+                try:
+                    v = f(v)
+                except (ValueError, OverflowError):
+                    raise ValueError(f"{h}: valor inválido '{raw[p]}'")
+                if (table, h) in ENUMS and v not in ENUMS[(table, h)]:
+                    raise ValueError(f"{h}: '{v}' no permitido")
+                vals.append(v)
+            return tuple(vals)
+
+        chunk = []
+        for line, raw in enumerate(reader, start=2):
+            if not raw: continue
+            res["read"] += 1
+            try:
+                chunk.append((line, row_values(raw), raw))
+            except ValueError as e:
+                reject(line, str(e), raw)
+            if len(chunk) >= chunk_rows:
+                flush(chunk); chunk = []
+                if progress: progress(fileobj.tell() / size if size else 0.0, res)
+        flush(chunk)
+        if progress: progress(1.0, res)
+    if table == "lots": fefo.invalidate(path)
+    if table == "sale_items" and res.get("inserted"): forecast.invalidate(path)
+    if table in archive.TABLES and (res.get("inserted") or res.get("updated")): archive.invalidate(path)
+    return res
+
+def _rollup_items(cur, cols, rows, item_cost):
+    # Las sale_items importadas suman al rollup diario en el día de su venta; sin unit_cost se usa
+    # el costo actual del producto, igual que rollup.rebuild (COALESCE(si.unit_cost, p.unit_cost))
+    get = lambda v, name: v[cols.index(name)] if name in cols else None
+    sold = dict(_pairs(cur, "SELECT id, sold_at FROM sales WHERE id IN ({})", {get(v, "sale_id") for v in rows}))
+    rollup.apply_sales(cur, [(sold[get(v, "sale_id")], [(get(v, "product_id"), get(v, "qty") or 0, get(v, "unit_price") or 0,
+                                                                 item_cost.get(get(v, "product_id")) if get(v, "unit_cost") is None else get(v, "unit_cost"))])
+                             for v in rows if sold.get(get(v, "sale_id"))])
+
+def _pairs(cur, sql, values):
+    values = [v for v in values if v is not None]
+    for i in range(0, len(values), _IN_BATCH):
+        part = values[i:i + _IN_BATCH]
+        yield from cur.execute(sql.format(",".join("?"*len(part))), part)
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="Importa un CSV a una tabla (streaming, una transacción)")
+    ap.add_argument("table", choices=IMPORTABLE); ap.add_argument("csv")
+    ap.add_argument("--db", default=db.DB); ap.add_argument("--upsert", action="store_true", help="products: actualizar por SKU")
+    ap.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args()
+    with open(args.csv, "rb") as f:
+        r = import_csv(f, args.table, args.db, args.upsert, args.chunk,
+                       progress=lambda frac, r: print(f"\r{frac:6.1%}  {r['read']:,} leídas", end="", file=sys.stderr))
+    print(f"\n{r['inserted']:,} insertadas, {r['updated']:,} actualizadas, {r['rejected']:,} rechazadas")
+    for line, reason, _ in r["rejects"][:20]: print(f"  línea {line}: {reason}")
@@ -0,0 +1,234 @@
+import json, math, os
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import archive
+import audit
+import db
+import fefo
+import forecast
+import stores
+
+# Ingesta de ventas desde el POS: un servicio HTTP local, al lado de la app, que recibe lotes de
+# boletas en JSON (POST /sales) y los registra como ventas() pero en bloque: FEFO, sales,
+# sale_items y rollup de todo el lote en UNA transacción (db.transaction, IMMEDIATE). Es idempotente
+# por receipt_no: una boleta que ya existe (o repetida en el mismo lote) no se vuelve a registrar y
+# se responde 'duplicada' con su sale_id, así que el POS puede reenviar un lote tras un corte.
+#   python ingest.py serve --port 8502 [--token ...]
+#   curl -X POST localhost:8502/sales -d '{"receipts": [{"receipt_no": "B-1", "lines": [{"sku": "CAF-001", "qty": 2}]}]}'
+# Cada boleta: receipt_no, sold_at (ISO; por defecto ahora), payment_method, channel (por defecto
+# 'pos') y lines [{product_id o sku, qty, unit_price y unit_cost opcionales: los del producto}].
+
+HOST, PORT = "127.0.0.1", 8502
+MAX_BATCH = 5000               # boletas por request
+MAX_BODY = 32 << 20            # bytes
+PAYMENTS = ("efectivo", "tarjeta", "mixto")
+CHANNEL = "pos"
+TOKEN_ENV = "PASCUCCI_API_TOKEN"
+_IN_BATCH = 900                # variables por IN (...)
+
+class Rejected(ValueError):
+    pass
+
+def _no_constant(name):
+    # json acepta NaN, Infinity y -Infinity por defecto; ningún campo de una boleta los admite
+    raise ValueError(f"{name} no es un valor JSON válido")
+
+def _when(value):
+    if value in (None, ""): return datetime.now().replace(microsecond=0)
+    try:
+        dt = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise Rejected(f"sold_at inválido: {value!r}")
+    return dt.astimezone().replace(tzinfo=None) if dt.tzinfo else dt   # la base guarda hora local
+
+def _number(line, key, cast, minimum):
+    v = line.get(key)
+    if v is None: return None
+    try:
+        v = cast(v)
+    except (TypeError, ValueError, OverflowError):
+        raise Rejected(f"{key} inválido: {line.get(key)!r}")
+    if not math.isfinite(v) or v < minimum or (cast is int and v != line[key]): raise Rejected(f"{key} inválido: {line[key]!r}")
+    return v
+
+def _parse(r):
+    """Boleta JSON -> (receipt_no, sold_at, medio de pago, canal, [(ref, qty, precio, costo)]); ref es
+    ('id', n) o ('sku', s). Rejected si falta algo o un valor no sirve."""
+    if not isinstance(r, dict): raise Rejected("la boleta debe ser un objeto")
+    no = str(r.get("receipt_no") or "").strip()
+    if not no: raise Rejected("falta receipt_no")
+    pay = r.get("payment_method") or "mixto"
+    if pay not in PAYMENTS: raise Rejected(f"payment_method debe ser {', '.join(PAYMENTS)}")
+    lines = r.get("lines")
+    if not isinstance(lines, list) or not lines: raise Rejected("la boleta no tiene líneas")
+    out = []
+    for line in lines:
+        if not isinstance(line, dict): raise Rejected("cada línea debe ser un objeto")
+        if line.get("product_id") is not None:
+            ref = ("id", _number(line, "product_id", int, 1))
+        elif line.get("sku"):
+            ref = ("sku", str(line["sku"]).strip())
+        else:
+            raise Rejected("línea sin product_id ni sku")
+        qty = _number(line, "qty", int, 1)
+        if qty is None: raise Rejected("línea sin qty")
+        out.append((ref, qty, _number(line, "unit_price", float, 0), _number(line, "unit_cost", float, 0)))
+    return no, _when(r.get("sold_at")), pay, str(r.get("channel") or CHANNEL), out
+
+def _lookup(cur, sql, keys):
+    # {primera columna: resto} para keys, en tramos de _IN_BATCH variables
+    keys, out = list(keys), {}
+    for i in range(0, len(keys), _IN_BATCH):
+        part = keys[i:i + _IN_BATCH]
+        out.update({r[0]: r[1:] for r in cur.execute(sql.format(",".join("?" * len(part))), part)})
+    return out
+
+def ingest(receipts, path=None):
+    """Registra un lote de boletas en una transacción. Devuelve un resultado por boleta, en orden:
+    {receipt_no, status: creada|duplicada|rechazada, sale_id, sin_stock (unidades sin lote), error}."""
+    if len(receipts) > MAX_BATCH: raise ValueError(f"Máximo {MAX_BATCH} boletas por lote")
+    results, parsed = [], []
+    for r in receipts:
+        try:
+            parsed.append(_parse(r)); results.append(None)
+        except Rejected as e:
+            parsed.append(None)
+            results.append({"receipt_no": r.get("receipt_no") if isinstance(r, dict) else None, "status": "rechazada", "error": str(e)})
+    first_day = None
+    with db.transaction(path) as c:
+        cur = c.cursor()
+        existing = {k: v[0] for k, v in _lookup(cur, "SELECT receipt_no, MIN(id) FROM sales WHERE receipt_no IN ({}) GROUP BY receipt_no",
+                                                 {p[0] for p in parsed if p}).items()}
+        refs = [ref for p in parsed if p for ref, *_ in p[4]]
+        by_id = _lookup(cur, "SELECT id, sale_price, unit_cost FROM products WHERE id IN ({})", {v for k, v in refs if k == "id"})
+        by_sku = _lookup(cur, "SELECT sku, id, sale_price, unit_cost FROM products WHERE sku IN ({})", {v for k, v in refs if k == "sku"})
+        sales, created, seen = [], [], {}
+        for i, p in enumerate(parsed):
+            if p is None: continue
+            no, sold_at, pay, channel, lines = p
+            if no in existing or no in seen:
+                results[i] = {"receipt_no": no, "status": "duplicada", "sale_id": existing.get(no)}
+                if no in seen: seen[no].append(i)
+                continue
+            try:
+                rows = []
+                for (kind, ref), qty, price, cost in lines:
+                    prod = by_id.get(ref) if kind == "id" else by_sku.get(ref)
+                    if prod is None: raise Rejected(f"producto no encontrado: {ref}")
+                    pid, sale_price, unit_cost = (ref, *prod) if kind == "id" else prod
+                    rows.append((int(pid), qty, sale_price if price is None else price, unit_cost if cost is None else cost))
+            except Rejected as e:
+                results[i] = {"receipt_no": no, "status": "rechazada", "error": str(e)}; continue
+            sales.append({"sold_at": sold_at, "lines": rows, "payment_method": pay, "channel": channel, "receipt_no": no})
+            created.append(i); seen[no] = []
+        for i, (sale_id, alloc) in zip(created, fefo.record_sales(cur, sales, path)):
+            no = parsed[i][0]
+            results[i] = {"receipt_no": no, "status": "creada", "sale_id": sale_id, "sin_stock": sum(remain for _, _, remain in alloc)}
+            for j in seen[no]: results[j]["sale_id"] = sale_id
+        if sales:
+            first_day = min(s["sold_at"] for s in sales)
+            audit.write(c, "sales", None, "create", {"ingest": len(sales), "desde": sales[0]["receipt_no"], "hasta": sales[-1]["receipt_no"]})
+    if first_day is not None:
+        # Ventas de días o meses pasados (p.ej. el volcado nocturno del POS): cada mes archivado que tocan
+        for month in sorted({s["sold_at"].date().replace(day=1) for s in sales}):
+            archive.invalidate(path, when=month)
+        forecast.invalidate(path, since=first_day.date().isoformat())
+    return results
+
+def summary(results):
+    out = {s: 0 for s in ("creada", "duplicada", "rechazada")}
+    for r in results: out[r["status"]] += 1
+    return out
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive: el POS manda varios lotes por conexión
+    server_version = "PascucciIngest/1.0"
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8"); self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def _db(self, url):
+        # ?local=Nombre (stores.json); sin él, la base con que se levantó el servicio
+        name = parse_qs(url.query).get("local", [None])[0]
+        return self.server.db if name is None else self.server.stores.get(name)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/health": return self._reply(404, {"error": "no encontrado"})
+        self._reply(200, {"ok": True, "locales": list(self.server.stores)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/sales": return self._reply(404, {"error": "no encontrado"})
+        if self.server.token and self.headers.get("Authorization") != f"Bearer {self.server.token}":
+            return self._reply(401, {"error": "token inválido"})
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True   # sin largo no se sabe dónde termina el cuerpo
+            return self._reply(411, {"error": "falta Content-Length"})
+        size = int(length) if length.isascii() and length.strip().isdigit() else -1   # ni signo ni '_'
+        if size < 0:
+            self.close_connection = True
+            return self._reply(400, {"error": f"Content-Length inválido: {length!r}"})
+        if size > MAX_BODY:
+            self.close_connection = True   # no se lee el cuerpo
+            return self._reply(413, {"error": f"cuerpo de más de {MAX_BODY} bytes"})
+        try:
+            body = json.loads(self.rfile.read(size) or b"null", parse_constant=_no_constant)
+        except ValueError as e:
+            return self._reply(400, {"error": f"JSON inválido: {e}"})
+        receipts = body.get("receipts") if isinstance(body, dict) else body
+        if not isinstance(receipts, list): return self._reply(400, {"error": "se espera {\"receipts\": [...]} o una lista de boletas"})
+        if len(receipts) > MAX_BATCH: return self._reply(413, {"error": f"máximo {MAX_BATCH} boletas por lote"})
+        path = self._db(url)
+        if path is None: return self._reply(404, {"error": "local no encontrado"})
+        try:
+            results = ingest(receipts, path)
+        except Exception as e:
+            # Nada quedó escrito (una sola transacción): el POS puede reenviar el lote
+            return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        self._reply(200, {**summary(results), "results": results})
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose: super().log_message(fmt, *args)
+
+def server(path=None, host=HOST, port=PORT, token=None, verbose=False):
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    httpd.db, httpd.stores = db.resolve(path), stores.load()
+    httpd.token, httpd.verbose = token, verbose
+    return httpd
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="API HTTP local para ingresar ventas del POS por lotes")
+    sp = ap.add_subparsers(dest="cmd", required=True)
+    p = sp.add_parser("serve"); p.add_argument("--db", default=db.DB)
+    p.add_argument("--host", default=HOST); p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--token", default=os.environ.get(TOKEN_ENV), help=f"exigir 'Authorization: Bearer <token>' (o {TOKEN_ENV})")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p = sp.add_parser("load", help="registra un archivo JSON de boletas sin pasar por HTTP")
+    p.add_argument("json"); p.add_argument("--db", default=db.DB)
+    args = ap.parse_args()
+    if args.cmd == "serve":
+        httpd = server(args.db, args.host, args.port, args.token, args.verbose)
+        print(f"Ingesta de ventas en http://{args.host}:{args.port}/sales ({httpd.db})", flush=True)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+    else:
+        with open(args.json, encoding="utf-8") as f:
+            data = json.load(f, parse_constant=_no_constant)
+        receipts = data.get("receipts") if isinstance(data, dict) else data
+        res = [r for i in range(0, len(receipts), MAX_BATCH) for r in ingest(receipts[i:i + MAX_BATCH], args.db)]
+        s = summary(res)
+        print(f"{s['creada']:,} creadas, {s['duplicada']:,} duplicadas, {s['rechazada']:,} rechazadas")
+        for r in [r for r in res if r["status"] == "rechazada"][:20]: print(f"  {r['receipt_no']}: {r['error']}", file=sys.stderr)
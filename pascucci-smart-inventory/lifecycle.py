@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import db
+import fefo
+import audit
+from schema import epoch
+
+# Ciclo de vida de los lotes. Un lote deja de estar 'vigente' cuando:
+#  - se agota: FEFO lo marca 'vendido' en el mismo UPDATE que lo descuenta (fefo.py);
+#  - vence: sweep() (job diario del scheduler) lo marca 'vencido' y, si está activado el ajuste
+#    expired_to_waste, su saldo pasa a merma por caducidad y el lote queda en 0.
+# Así los lotes abiertos (vigentes con saldo, índice parcial ix_lots_open) crecen con el stock
+# físico y no con el historial.
+
+WASTE_SETTING = "expired_to_waste"
+
+def close_depleted(cur):
+    """Lotes vigentes sin saldo (editados a 0, importados o anteriores al ciclo de vida) -> 'vendido'."""
+    return cur.execute("UPDATE lots SET status='vendido' WHERE status='vigente' AND qty_current<=0").rowcount
+
+def expire(cur, until, waste=False, ts=None, shift="tarde"):
+    """Lotes vigentes con saldo que vencen hasta `until` -> 'vencido'. Con waste, su saldo se registra
+    como merma ('caducidad', en ts) y el lote queda en 0. Devuelve [(lot_id, product_id, saldo, costo)]."""
+    rows = cur.execute("""SELECT id, product_id, qty_current, unit_cost FROM lots
+        WHERE status='vigente' AND qty_current>0 AND expiration_epoch<=?""", (epoch(until),)).fetchall()
+    if waste:
+        ts = (ts or until).isoformat()
+        cur.executemany("""INSERT INTO waste(ts, product_id, lot_id, qty, unit_cost_est, reason, shift, evidence_path, approved_by)
+            VALUES(?,?,?,?,?,'caducidad',?,NULL,'sistema')""", [(ts, pid, lid, q, c, shift) for lid, pid, q, c in rows])
+    cur.executemany(f"UPDATE lots SET status='vencido'{', qty_current=0' if waste else ''} WHERE id=?", [(r[0],) for r in rows])
+    return rows
+
+def waste_enabled(path=None):
+    row = db.reader(path).execute("SELECT value FROM settings WHERE key=?", (WASTE_SETTING,)).fetchone()
+    return bool(row) and row[0] == "1"
+
+def sweep(path=None, now=None, waste=None):
+    """Cierra los lotes agotados y vence los lotes vencidos a `now`, en una transacción."""
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    waste = waste_enabled(path) if waste is None else waste
+    with db.transaction(path) as c:
+        sold = close_depleted(c)
+        rows = expire(c, now, waste)
+        pids = {r[1] for r in rows}
+        res = {"vendidos": sold, "vencidos": len(rows), "productos": len(pids), "merma": sum(r[2] for r in rows) if waste else 0}
+        if sold or rows: audit.write(c, "lots", None, "update", {"sweep": res})
+    fefo.invalidate(path, pids)
+    return res
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Cierra lotes agotados y vence los lotes vencidos")
+    ap.add_argument("--db", default=db.DB); ap.add_argument("--now", type=datetime.fromisoformat)
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--waste", dest="waste", action="store_true", default=None, help="registrar el saldo vencido como merma")
+    g.add_argument("--no-waste", dest="waste", action="store_false")
+    args = ap.parse_args()
+    r = sweep(args.db, args.now, args.waste)
+    print(f"{r['vendidos']:,} lotes agotados -> vendido; {r['vencidos']:,} lotes vencidos ({r['productos']:,} productos), "
+          f"{r['merma']:,} unidades a merma")
@@ -0,0 +1,104 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# Política de margen mínimo. Precedencia: producto > categoría > global (settings.margin_min_percent, default 0.22).
+# Las reglas se cargan una vez y se resuelven para todo el catálogo en una pasada vectorizada.
+
+DEFAULT_MARGIN = 0.22
+MarginRules = namedtuple("MarginRules", ["global_min", "by_category", "by_product"])
+
+def load_rules(db_loader):
+    s = db_loader("SELECT value FROM settings WHERE key='margin_min_percent'")
+    m_global = DEFAULT_MARGIN
+    if not s.empty:
+        try: m_global = float(s['value'].iloc[0])
+        except (TypeError, ValueError): pass
+    r = db_loader("SELECT scope, ref, margin_min_percent FROM margin_rules ORDER BY id")
+    by_scope = {scope: dict(zip(g['ref'].astype(str), g['margin_min_percent'].astype(float))) for scope, g in r.groupby('scope')} if not r.empty else {}
+    return MarginRules(m_global, by_scope.get('category', {}), by_scope.get('product', {}))
+
+def required_margin(prods, rules):
+    """Margen mínimo efectivo por producto (Series alineada con prods)."""
+    req = prods['id'].astype(str).map(rules.by_product)
+    req = req.fillna(prods['category'].map(rules.by_category))
+    return req.fillna(rules.global_min).astype(float)
+
+def required_for(prod, rules):
+    # Versión escalar (un producto), misma precedencia
+    if str(prod['id']) in rules.by_product: return rules.by_product[str(prod['id'])]
+    if prod['category'] in rules.by_category: return rules.by_category[prod['category']]
+    return rules.global_min
+
+def evaluate(prods, rules, discount_pct=0.0):
+    """Margen real (con descuento % opcional) vs requerido para todo el catálogo.
+    Los productos sin costo positivo quedan fuera, igual que en la evaluación fila a fila."""
+    cost = prods['unit_cost'].astype(float).to_numpy()
+    price = prods['sale_price'].astype(float).to_numpy() * (1.0 - discount_pct / 100.0)
+    valid = cost > 0
+    df = prods.loc[valid].copy()
+    df['req'] = required_margin(df, rules)
+    df['margen'] = (price[valid] - cost[valid]) / cost[valid]
+    df['below'] = df['margen'] < df['req']
+    return df
+
+def low_margin_table(prods, rules):
+    df = evaluate(prods, rules)
+    df = df[df['below']]
+    out = pd.DataFrame({
+        "sku": df['sku'], "name": df['name'], "category": df['category'],
+        "costo": df['unit_cost'].astype(int), "precio_actual": df['sale_price'].astype(int),
+        "margen_actual_%": (df['margen']*100).round(1),
+        "margen_requerido_%": (df['req']*100).astype(int),
+        "precio_sugerido_min": np.round(df['unit_cost']*(1.0 + df['req'])).astype(int),
+    })
+    return out.sort_values("margen_actual_%").reset_index(drop=True)
+
+def _check_precedence():
+    # Casos fijos en una base en memoria: global 0.30, categoría Bebidas 0.40, productos 3 (Bebidas,
+    # gana el producto: 0.10) y 4 (sin regla de categoría) con regla propia; 5 sin costo queda fuera
+    import sqlite3, db
+    from schema import migrate
+    c = sqlite3.connect(":memory:")
+    c.executescript(db.INIT_SQL.read_text(encoding="utf-8")); migrate(c)
+    c.execute("INSERT INTO settings(key, value) VALUES('margin_min_percent', '0.30')")
+    c.executemany("INSERT INTO margin_rules(scope, ref, margin_min_percent) VALUES(?,?,?)",
+                  [("category", "Bebidas", 0.40), ("product", "3", 0.10), ("product", "4", 0.50)])
+    c.executemany("INSERT INTO products(id, sku, name, category, unit_cost, sale_price) VALUES(?,?,?,?,?,?)",
+                  [(1, "S-1", "Sin reglas", "Snacks", 100, 135), (2, "B-2", "Categoría", "Bebidas", 100, 130),
+                   (3, "B-3", "Producto > categoría", "Bebidas", 100, 130), (4, "S-4", "Producto", "Snacks", 100, 160),
+                   (5, "S-5", "Sin costo", "Snacks", 0, 100)])
+    load = lambda q, params=(): pd.read_sql_query(q, c, params=params)
+    prods, rules = load("SELECT * FROM products ORDER BY id"), load_rules(load)
+    expected = {1: 0.30, 2: 0.40, 3: 0.10, 4: 0.50, 5: 0.30}
+    req = dict(zip(prods['id'], required_margin(prods, rules)))
+    assert req == expected, f"required_margin: {req}"
+    assert all(required_for(r, rules) == expected[r['id']] for _, r in prods.iterrows()), "required_for"
+    # Margen sin descuento: .35 .30 .30 .60; con 10%: .215 .17 .17 .44
+    for discount, below in ((0.0, {1: False, 2: True, 3: False, 4: False}), (10.0, {1: True, 2: True, 3: False, 4: True})):
+        ev = evaluate(prods, rules, discount)
+        got = dict(zip(ev['id'], ev['below']))
+        assert got == below, f"below con {discount}% de descuento: {got}"
+    assert low_margin_table(prods, rules)['sku'].tolist() == ["B-2"], "low_margin_table"
+    c.close()
+
+if __name__ == "__main__":
+    # Precedencia sobre casos fijos y equivalencia vectorizada vs fila a fila sobre una base real
+    import argparse, db
+    from analytics import sqlite_loader
+    ap = argparse.ArgumentParser(description="Verifica la precedencia de márgenes (producto > categoría > global)")
+    ap.add_argument("--db", default=db.DB); ap.add_argument("--discount", type=float, default=20.0)
+    args = ap.parse_args()
+    _check_precedence()
+    print("OK: precedencia producto > categoría > global y descuentos (casos fijos)")
+    load = sqlite_loader(args.db)
+    prods, rules = load("SELECT * FROM products"), load_rules(load)
+    vec = required_margin(prods, rules)
+    scalar = prods.apply(lambda r: required_for(r, rules), axis=1)
+    assert np.allclose(vec.to_numpy(), scalar.to_numpy()), "required_margin difiere de required_for"
+    ev = evaluate(prods, rules, args.discount)
+    for _, r in prods.iterrows():
+        if not r['unit_cost'] > 0: continue
+        m = (r['sale_price']*(1 - args.discount/100.0) - r['unit_cost']) / r['unit_cost']
+        assert bool(ev.loc[_, 'below']) == (m < required_for(r, rules)), f"producto {r['id']}"
+    print(f"OK: {len(prods)} productos, {len(rules.by_category)} reglas de categoría, {len(rules.by_product)} de producto")
@@ -0,0 +1,27 @@
+-- Columnas epoch (segundos, hora local naive) derivadas de los DATETIME en texto.
+-- Son VIRTUAL: no ocupan espacio en la tabla, sólo en los índices que las usan,
+-- y permiten filtrar/ordenar sin llamar a datetime() en cada fila.
+ALTER TABLE sales ADD COLUMN sold_at_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', sold_at) AS INTEGER)) VIRTUAL;
+ALTER TABLE lots ADD COLUMN received_at_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', received_at) AS INTEGER)) VIRTUAL;
+ALTER TABLE lots ADD COLUMN expiration_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', expiration) AS INTEGER)) VIRTUAL;
+ALTER TABLE waste ADD COLUMN ts_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', ts) AS INTEGER)) VIRTUAL;
+ALTER TABLE audit ADD COLUMN ts_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', ts) AS INTEGER)) VIRTUAL;
+ALTER TABLE promos ADD COLUMN starts_at_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', starts_at) AS INTEGER)) VIRTUAL;
+
+-- FEFO: product_id + status por igualdad, orden por vencimiento, qty_current cubierto.
+CREATE INDEX IF NOT EXISTS ix_lots_fefo ON lots(product_id, status, expiration_epoch, qty_current);
+-- Alertas de vencimiento / liquidaciones (status='vigente' AND expiration <= ?).
+CREATE INDEX IF NOT EXISTS ix_lots_status_exp ON lots(status, expiration_epoch);
+CREATE INDEX IF NOT EXISTS ix_lots_received ON lots(received_at_epoch);
+
+CREATE INDEX IF NOT EXISTS ix_sales_sold_at ON sales(sold_at_epoch, total);
+CREATE INDEX IF NOT EXISTS ix_sale_items_sale ON sale_items(sale_id, product_id, qty, unit_price);
+CREATE INDEX IF NOT EXISTS ix_sale_items_product ON sale_items(product_id);
+CREATE INDEX IF NOT EXISTS ix_waste_ts ON waste(ts_epoch, product_id, qty, unit_cost_est);
+CREATE INDEX IF NOT EXISTS ix_audit_ts ON audit(ts_epoch);
+CREATE INDEX IF NOT EXISTS ix_promos_starts ON promos(starts_at_epoch);
+
+-- INSERT OR REPLACE en margin_rules necesita una clave única (scope, ref); sin ella
+-- cada "Guardar" agregaba una fila nueva. Se conserva la regla más reciente.
+DELETE FROM margin_rules WHERE id NOT IN (SELECT MAX(id) FROM margin_rules GROUP BY scope, ref);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_margin_rules_scope_ref ON margin_rules(scope, ref);
@@ -0,0 +1,20 @@
+-- Costo unitario congelado al momento de la venta: permite revertir exactamente
+-- el aporte de una línea al rollup aunque después cambie products.unit_cost.
+ALTER TABLE sale_items ADD COLUMN unit_cost REAL;
+UPDATE sale_items SET unit_cost=(SELECT p.unit_cost FROM products p WHERE p.id=sale_items.product_id) WHERE unit_cost IS NULL;
+
+-- Rollup diario por producto, mantenido por rollup.py en la misma transacción que la venta.
+CREATE TABLE IF NOT EXISTS daily_product_sales (
+  day TEXT NOT NULL,
+  product_id INTEGER NOT NULL,
+  qty INTEGER NOT NULL DEFAULT 0,
+  revenue REAL NOT NULL DEFAULT 0,
+  cost REAL NOT NULL DEFAULT 0,
+  PRIMARY KEY(day, product_id)
+) WITHOUT ROWID;
+
+INSERT INTO daily_product_sales(day, product_id, qty, revenue, cost)
+SELECT date(s.sold_at), si.product_id, SUM(si.qty), SUM(si.qty*si.unit_price), SUM(si.qty*COALESCE(si.unit_cost, 0))
+FROM sale_items si JOIN sales s ON s.id=si.sale_id
+WHERE date(s.sold_at) IS NOT NULL
+GROUP BY date(s.sold_at), si.product_id;
@@ -0,0 +1,36 @@
+-- Fotos precalculadas del panel de reposiciones/liquidaciones (snapshots.py), con los
+-- parámetros por defecto de settings. El Dashboard las lee directo; sólo recalcula en vivo
+-- si el usuario cambia lead/cobertura/z.
+CREATE TABLE IF NOT EXISTS replenishment_snapshot (
+  sku TEXT,
+  name TEXT,
+  category TEXT,
+  stock REAL,
+  mean_daily REAL,
+  std_daily REAL,
+  ROP REAL,
+  sug_repo REAL,
+  necesita_repo INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS liquidation_snapshot (
+  sku TEXT,
+  name TEXT,
+  lot_code TEXT,
+  qty_current INTEGER,
+  days_left INTEGER,
+  proj_demand_until_exp REAL,
+  exceso REAL,
+  sugerencia TEXT
+);
+
+CREATE TABLE IF NOT EXISTS snapshot_meta (
+  name TEXT PRIMARY KEY,
+  computed_at DATETIME,
+  params TEXT
+);
+
+INSERT OR IGNORE INTO settings(key, value) VALUES
+  ('repo_lead_days', '3'),
+  ('repo_cover_days', '7'),
+  ('repo_service_z', '1.28');
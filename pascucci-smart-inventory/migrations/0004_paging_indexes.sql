@@ -0,0 +1,8 @@
+-- Índices (filtro, fecha) para la paginación por clave de Lotes, Mermas y Auditoría (paging.py):
+-- con un filtro de igualdad la página sale en orden del índice, sin ordenar todo el historial.
+CREATE INDEX IF NOT EXISTS ix_lots_status_received ON lots(status, received_at_epoch);
+CREATE INDEX IF NOT EXISTS ix_lots_product_received ON lots(product_id, received_at_epoch);
+CREATE INDEX IF NOT EXISTS ix_waste_product_ts ON waste(product_id, ts_epoch);
+CREATE INDEX IF NOT EXISTS ix_waste_reason_ts ON waste(reason, ts_epoch);
+CREATE INDEX IF NOT EXISTS ix_audit_entity_ts ON audit(entity, ts_epoch);
+CREATE INDEX IF NOT EXISTS ix_audit_action_ts ON audit(action, ts_epoch);
@@ -0,0 +1,10 @@
+-- Estado del pronóstico de demanda (forecast.py): nivel, estacionalidad por día de la semana
+-- (s0 = lunes ... s6 = domingo) y error cuadrático medio suavizado por producto. Hasta qué día
+-- está ajustado queda en snapshot_meta (name = 'forecast'): al llegar días nuevos sólo se leen esos.
+CREATE TABLE IF NOT EXISTS forecast_state (
+  product_id INTEGER PRIMARY KEY,
+  level REAL NOT NULL,
+  s0 REAL NOT NULL, s1 REAL NOT NULL, s2 REAL NOT NULL, s3 REAL NOT NULL,
+  s4 REAL NOT NULL, s5 REAL NOT NULL, s6 REAL NOT NULL,
+  mse REAL NOT NULL
+);
@@ -0,0 +1,6 @@
+-- Lotes abiertos (vigentes con saldo): FEFO, stock, vencimientos y liquidaciones filtran por
+-- status='vigente' AND qty_current>0. Índice parcial y cubriente sólo con esos lotes: crece con
+-- el stock físico y no con el historial (lifecycle.py saca de aquí los lotes agotados y vencidos).
+CREATE INDEX IF NOT EXISTS ix_lots_open ON lots(product_id, expiration_epoch, qty_current) WHERE status='vigente' AND qty_current>0;
+-- Lotes agotados que quedaron 'vigente' antes del ciclo de vida
+UPDATE lots SET status='vendido' WHERE status='vigente' AND qty_current<=0;
@@ -0,0 +1,19 @@
+-- Bandeja de salida de correos (outbox.py): cada correo se guarda antes de enviarse y un job del
+-- scheduler lo envía con reintentos. status: pendiente -> enviando -> enviado | fallido.
+-- attachments: JSON con las rutas de las copias en outbox/ (se borran al enviarse).
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  created_at TEXT NOT NULL,
+  to_emails TEXT NOT NULL,
+  subject TEXT NOT NULL,
+  body TEXT NOT NULL DEFAULT '',
+  attachments TEXT NOT NULL DEFAULT '[]',
+  status TEXT NOT NULL DEFAULT 'pendiente',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_epoch INTEGER NOT NULL DEFAULT 0,
+  claimed_epoch INTEGER,
+  last_error TEXT,
+  sent_at TEXT
+);
+-- Correos por enviar, por vencimiento del próximo intento
+CREATE INDEX IF NOT EXISTS ix_outbox_due ON outbox(status, next_attempt_epoch);
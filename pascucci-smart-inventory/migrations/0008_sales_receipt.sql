@@ -0,0 +1,4 @@
+-- Ingesta desde el POS (ingest.py): idempotente por número de boleta. No es UNIQUE: bases e
+-- importaciones anteriores pueden tener boletas repetidas; la API busca la boleta dentro de su
+-- transacción IMMEDIATE (db.transaction), así que dos lotes no pueden crear la misma a la vez.
+CREATE INDEX IF NOT EXISTS ix_sales_receipt ON sales(receipt_no) WHERE receipt_no IS NOT NULL;
@@ -0,0 +1,14 @@
+-- Ventas por día a nivel de boleta (SUM(sales.total)), la misma fuente que el KPI "Ventas" y el PDF
+-- ejecutivo. daily_product_sales suma líneas (qty*unit_price): no cuenta ventas sin ítems (p.ej.
+-- importadas sólo como sales) ni totales que difieren de la suma de sus líneas. Los gráficos y el PDF
+-- semanal/mensual toman el total de aquí y el costo de daily_product_sales. rollup.py lo mantiene.
+CREATE TABLE IF NOT EXISTS daily_totals (
+  day TEXT NOT NULL PRIMARY KEY,
+  sales INTEGER NOT NULL DEFAULT 0,
+  total REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT INTO daily_totals(day, sales, total)
+SELECT date(sold_at), COUNT(*), SUM(COALESCE(total, 0)) FROM sales
+WHERE date(sold_at) IS NOT NULL
+GROUP BY date(sold_at);
@@ -0,0 +1,183 @@
+import json, random, shutil, time, uuid
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+import db
+
+# Bandeja de salida de correos. enqueue() guarda el correo en la tabla outbox (y copia los adjuntos
+# a outbox/<base>/<id>/) y vuelve enseguida; send_due() (job del scheduler) toma los pendientes por
+# lotes de BATCH con un UPDATE ... RETURNING atómico, abre UNA sesión SMTP por lote y envía cada
+# correo leyendo los adjuntos del disco (emailer.Session). Un error temporal reprograma el correo
+# con espera exponencial (RETRY_BASE_S * 2^(intentos-1), hasta RETRY_MAX_S, con jitter); un rechazo
+# permanente (5xx) o MAX_ATTEMPTS intentos lo dejan 'fallido' con el error, para reintentarlo a mano.
+# Si el proceso muere a mitad de un envío, el correo 'enviando' vuelve a la cola tras CLAIM_TIMEOUT_S.
+
+CONFIG = Path("email_config.json")
+SPOOL = Path("outbox")
+BATCH = 20
+RETRY_BASE_S = 60
+RETRY_MAX_S = 3600
+MAX_ATTEMPTS = 8
+CLAIM_TIMEOUT_S = 600
+STATUSES = ("pendiente", "enviando", "enviado", "fallido")
+
+def load_config(file=CONFIG):
+    file = Path(file)
+    return json.loads(file.read_text(encoding="utf-8")) if file.exists() else None
+
+def invalid_addresses(emails):
+    """Direcciones que smtplib no puede enviar: sin '@', con nombre o espacios, o no ASCII (sin SMTPUTF8)."""
+    from email.utils import parseaddr
+    return [e for e in emails if not e.isascii() or parseaddr(e)[1] != e or e.count("@") != 1 or " " in e]
+
+def recipients(cfg):
+    """Destinatarios de la configuración guardada; ValueError si no sirve para enviar."""
+    if not cfg: raise ValueError("Primero guarda la configuración de correo")
+    if not cfg.get("smtp_host"): raise ValueError("Falta el servidor SMTP")
+    to_emails = [e for e in cfg.get("to_emails") or [] if e]
+    if not to_emails: raise ValueError("Sin destinatarios")
+    bad = invalid_addresses(to_emails + [u for u in [cfg.get("username")] if u])
+    if bad: raise ValueError(f"Dirección inválida: {', '.join(bad)}")
+    return to_emails
+
+def _spool(path):
+    return SPOOL / Path(db.resolve(path)).stem / uuid.uuid4().hex
+
+def enqueue(path, to_emails, subject, body="", attachments=(), now=None):
+    """Guarda un correo para enviarlo en segundo plano. Los adjuntos se copian (el original puede
+    cambiar o borrarse antes del envío). Devuelve el id."""
+    to_emails = [e for e in to_emails if e]
+    if not to_emails: raise ValueError("Sin destinatarios")
+    files = []
+    if attachments:
+        d = _spool(path); d.mkdir(parents=True, exist_ok=True)
+        for a in attachments:
+            files.append(str(shutil.copy2(a, d / Path(a).name)))
+    now = now or time.time()
+    with db.transaction(path) as c:
+        return c.execute("""INSERT INTO outbox(created_at, to_emails, subject, body, attachments, next_attempt_epoch)
+            VALUES(?,?,?,?,?,?)""", (datetime.fromtimestamp(now).isoformat(timespec="seconds"), json.dumps(to_emails),
+                                     subject, body, json.dumps(files), int(now))).lastrowid
+
+def backoff(attempts):
+    """Segundos hasta el próximo intento tras `attempts` intentos fallidos."""
+    delay = min(RETRY_BASE_S * 2 ** (attempts - 1), RETRY_MAX_S)
+    return delay + random.uniform(0, delay / 10)
+
+def _claim(path, now, batch):
+    with db.transaction(path) as c:
+        # Reclamados por un envío que no terminó (proceso caído): de vuelta a la cola
+        c.execute("UPDATE outbox SET status='pendiente', claimed_epoch=NULL WHERE status='enviando' AND claimed_epoch<?",
+                  (int(now) - CLAIM_TIMEOUT_S,))
+        return c.execute("""UPDATE outbox SET status='enviando', claimed_epoch=? WHERE id IN (
+                SELECT id FROM outbox WHERE status='pendiente' AND next_attempt_epoch<=?
+                ORDER BY next_attempt_epoch, id LIMIT ?)
+            RETURNING id, to_emails, subject, body, attachments, attempts""", (int(now), int(now), batch)).fetchall()
+
+def _permanent(e):
+    import smtplib
+    # 5xx: el servidor rechaza el correo (destinatario, tamaño...); reintentar no cambia nada
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+
+def _sent(c, row_id, files, now):
+    c.execute("UPDATE outbox SET status='enviado', attempts=attempts+1, sent_at=?, last_error=NULL, claimed_epoch=NULL WHERE id=?",
+              (datetime.fromtimestamp(now).isoformat(timespec="seconds"), row_id))
+    if files: shutil.rmtree(Path(files[0]).parent, ignore_errors=True)
+
+def _failed(c, row_id, attempts, error, now, permanent=False):
+    attempts += 1
+    if permanent or attempts >= MAX_ATTEMPTS:
+        c.execute("UPDATE outbox SET status='fallido', attempts=?, last_error=?, claimed_epoch=NULL WHERE id=?", (attempts, error, row_id))
+        return "fallido"
+    c.execute("UPDATE outbox SET status='pendiente', attempts=?, last_error=?, claimed_epoch=NULL, next_attempt_epoch=? WHERE id=?",
+              (attempts, error, int(now + backoff(attempts)), row_id))
+    return "pendiente"
+
+def _error(e):
+    return f"{type(e).__name__}: {e}"[:500]
+
+def send_due(path=None, now=None, config=None, batch=BATCH):
+    """Envía los correos vencidos, un lote (una sesión SMTP) tras otro. Devuelve {estado: n}."""
+    import smtplib
+    from emailer import Session   # smtplib y emailer, al enviar (no en el arranque de la app)
+    cfg = config or load_config()
+    res = {"enviado": 0, "pendiente": 0, "fallido": 0}
+    if not cfg: return res
+    while True:
+        t = now or time.time()
+        rows = _claim(path, t, batch)
+        if not rows: return res
+        done = []   # (id, archivos) enviados, o (id, intentos, error, permanente)
+        try:
+            with Session(cfg["smtp_host"], cfg["smtp_port"], cfg["username"], cfg["password"], cfg.get("use_tls", True)) as s:
+                for row_id, to, subject, body, files, attempts in rows:
+                    try:
+                        files = json.loads(files)
+                        s.send(json.loads(to), subject, body, files)
+                        done.append((row_id, files))
+                    except FileNotFoundError as e:
+                        done.append((row_id, attempts, _error(e), True))
+                    except smtplib.SMTPServerDisconnected as e:
+                        # Conexión perdida: se corta el lote (los no intentados cuentan un intento abajo)
+                        done.append((row_id, attempts, _error(e), False)); raise
+                    except smtplib.SMTPException as e:
+                        # Rechazo de este correo: la sesión sigue (RSET) para el resto del lote
+                        done.append((row_id, attempts, _error(e), _permanent(e)))
+                    except OSError as e:
+                        done.append((row_id, attempts, _error(e), False)); raise
+                    except Exception as e:
+                        # Datos que no se pueden enviar (p.ej. dirección no ASCII): reintentar no cambia nada
+                        done.append((row_id, attempts, _error(e), True))
+        except Exception as e:
+            # Sin sesión (conexión, STARTTLS, login) o cortada: los correos no intentados cuentan un intento
+            tried = {d[0] for d in done}
+            done += [(r[0], r[5], _error(e), False) for r in rows if r[0] not in tried]
+        finally:
+            # Siempre se registra el lote: lo enviado no vuelve a la cola ni se reenvía
+            t = now or time.time()
+            with db.transaction(path) as c:
+                for d in done:
+                    if len(d) == 2:
+                        _sent(c, d[0], d[1], t); res["enviado"] += 1
+                    else:
+                        res[_failed(c, *d[:3], t, d[3])] += 1
+        # Lote incompleto (no queda nada vencido) o con errores (se sigue en la próxima pasada)
+        if len(rows) < batch or any(len(d) != 2 for d in done):
+            return res
+
+def retry(path=None, ids=None):
+    """Vuelve a encolar correos fallidos (todos, o los ids dados) para enviarse ya."""
+    q = "UPDATE outbox SET status='pendiente', attempts=0, next_attempt_epoch=0 WHERE status='fallido'"
+    params = ()
+    if ids:
+        q += f" AND id IN ({','.join('?' * len(ids))})"; params = tuple(int(i) for i in ids)
+    with db.transaction(path) as c:
+        return c.execute(q, params).rowcount
+
+def counts(path=None):
+    rows = dict(db.reader(path).execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    return {s: rows.get(s, 0) for s in STATUSES}
+
+def recent(path=None, limit=50):
+    return pd.read_sql_query("""SELECT id, created_at, subject, to_emails, status, attempts,
+            datetime(next_attempt_epoch, 'unixepoch', 'localtime') AS next_attempt, sent_at, last_error
+        FROM outbox ORDER BY id DESC LIMIT ?""", db.reader(path), params=(limit,))
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Bandeja de salida de correos: estado, enviar pendientes, reintentar fallidos")
+    ap.add_argument("cmd", choices=["status", "send", "retry"]); ap.add_argument("--db", default=db.DB)
+    ap.add_argument("--config", default=str(CONFIG)); ap.add_argument("--ids", type=int, nargs="*")
+    args = ap.parse_args()
+    if args.cmd == "send":
+        t = time.perf_counter(); r = send_due(args.db, config=load_config(args.config))
+        print(f"{r['enviado']} enviados, {r['pendiente']} reprogramados, {r['fallido']} fallidos ({time.perf_counter() - t:.1f}s)")
+    elif args.cmd == "retry":
+        print(f"{retry(args.db, args.ids)} correos de vuelta a la cola")
+    else:
+        print(", ".join(f"{s}: {n}" for s, n in counts(args.db).items()))
+        print(recent(args.db, 20).to_string(index=False))
@@ -0,0 +1,75 @@
+import pandas as pd
+
+from schema import epoch
+
+# Paginación por clave (keyset) para las tablas largas (lotes, ventas, mermas, auditoría): orden
+# por fecha descendente + id, y cada página continúa desde la última fila de la anterior con
+# (fecha, id) < (?, ?) sobre índices, así el costo no crece con el historial (sin OFFSET).
+# Las filas sin fecha van al final, por id.
+
+PAGE_SIZE = 50
+
+# vista -> FROM, tabla base (para contar sin joins), columnas, columna de fecha (epoch), id,
+# filtros {nombre: condición con un ?} y, si conviene otra forma para contar, count_filters
+VIEWS = {
+    "lots": {"from": "lots l JOIN products p ON p.id=l.product_id", "table": "lots l", "key": "l.received_at_epoch", "id": "l.id",
+             "select": "l.id, p.name AS producto, l.lot_code, l.qty_initial, l.qty_current, l.unit_cost, l.received_at, l.expiration, l.status",
+             "filters": {"product_id": "l.product_id = ?", "status": "l.status = ?"}},
+    "sales": {"from": "sales s", "table": "sales s", "key": "s.sold_at_epoch", "id": "s.id",
+              "select": "s.*",
+              # La página recorre el índice de fecha y corta en la fila 51; el conteo parte de los ítems del producto
+              "filters": {"product_id": "EXISTS (SELECT 1 FROM sale_items si WHERE si.sale_id=s.id AND si.product_id = ?)",
+                          "payment_method": "s.payment_method = ?"},
+              "count_filters": {"product_id": "s.id IN (SELECT sale_id FROM sale_items WHERE product_id = ?)"}},
+    "waste": {"from": "waste w JOIN products p ON p.id=w.product_id", "table": "waste w", "key": "w.ts_epoch", "id": "w.id",
+              "select": "w.id, p.name AS producto, w.qty, w.unit_cost_est, w.reason, w.shift, w.ts",
+              "filters": {"product_id": "w.product_id = ?", "reason": "w.reason = ?"}},
+    "audit": {"from": "audit a", "table": "audit a", "key": "a.ts_epoch", "id": "a.id",
+              "select": "a.id, a.ts, a.user, a.entity, a.entity_id, a.action, a.diff_json",
+              "filters": {"entity": "a.entity = ?", "action": "a.action = ?"}},
+}
+
+def _where(view, filters, counting=False):
+    v = VIEWS[view]; cond, params = [], []
+    alt = v.get("count_filters", {}) if counting else {}
+    if filters.get("start") is not None: cond.append(f"{v['key']} >= ?"); params.append(epoch(filters["start"]))
+    if filters.get("end") is not None: cond.append(f"{v['key']} < ?"); params.append(epoch(filters["end"]))
+    for name, sql in v["filters"].items():
+        if filters.get(name) not in (None, ""): cond.append(alt.get(name, sql)); params.append(filters[name])
+    return cond, params
+
+def _query(view, cond, order, limit):
+    v = VIEWS[view]
+    where = " WHERE " + " AND ".join(cond) if cond else ""
+    return f"SELECT {v['select']}, {v['key']} AS _key FROM {v['from']}{where} ORDER BY {order} LIMIT {int(limit)}"
+
+def page(db_loader, view, filters=None, after=None, size=PAGE_SIZE):
+    """Una página de `view` (más reciente primero). after: cursor devuelto por la página anterior.
+    Devuelve (df, cursor_siguiente); cursor_siguiente es None en la última página."""
+    v = VIEWS[view]; filters = filters or {}
+    cond, params = _where(view, filters)
+    dated = filters.get("start") is not None or filters.get("end") is not None
+    frames = []
+    if after is None or after[0] is not None:
+        c = cond + ([f"({v['key']}, {v['id']}) < (?, ?)"] if after else [f"{v['key']} IS NOT NULL"])
+        frames.append(db_loader(_query(view, c, f"{v['key']} DESC, {v['id']} DESC", size + 1), tuple(params) + tuple(after or ())))
+    got = len(frames[0]) if frames else 0
+    # Filas sin fecha (no entran en un filtro de fechas): tras las fechadas, por id
+    if got <= size and not dated:
+        c = cond + [f"{v['key']} IS NULL"] + ([f"{v['id']} < ?"] if after and after[0] is None else [])
+        frames.append(db_loader(_query(view, c, f"{v['id']} DESC", size + 1 - got), tuple(params) + ((after[1],) if after and after[0] is None else ())))
+    frames = [f for f in frames if len(f)] or frames[:1]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    nxt = None
+    if len(df) > size:
+        df = df.iloc[:size]
+        last = df.iloc[-1]
+        nxt = (None if pd.isna(last["_key"]) else int(last["_key"]), int(last["id"]))
+    return df.drop(columns="_key"), nxt
+
+def count(db_loader, view, filters=None):
+    """Filas que cumplen los filtros."""
+    v = VIEWS[view]
+    cond, params = _where(view, filters or {}, counting=True)
+    where = " WHERE " + " AND ".join(cond) if cond else ""
+    return int(db_loader(f"SELECT COUNT(*) AS n FROM {v['table']}{where}", tuple(params))["n"].iloc[0])
@@ -0,0 +1,168 @@
+import json, logging, re, threading, time, tracemalloc
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache, wraps
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import db
+
+# Instrumentación del proceso: cada consulta (load_df, run_sql) y cada panel registra su duración,
+# filas, acierto de caché y pico de memoria en una ventana de las últimas SAMPLES muestras por
+# nombre, de donde salen p50/p95 (sección oculta "Rendimiento", ?perf=1). Las consultas que pasan
+# SLOW_MS se escriben con su EXPLAIN QUERY PLAN en slow_queries.log (rotativo, JSON por línea).
+# El pico de memoria sólo se mide con tracemalloc activo (PYTHONTRACEMALLOC=1 o desde la sección):
+# cuesta CPU en todas las asignaciones.
+
+SLOW_MS = 250
+SAMPLES = 500
+SLOW_LOG = Path("slow_queries.log")
+LOG_BYTES, LOG_BACKUPS = 1 << 20, 3
+
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=SAMPLES))   # (tipo, nombre) -> [(ms, filas, en caché, pico MB, consultas, aciertos)]
+_recent = deque(maxlen=200)                             # últimas consultas, para la tabla de la sección
+_local = threading.local()
+_log = None
+
+def _slow_log():
+    global _log
+    if _log is None:
+        with _lock:
+            # Un solo handler por proceso aunque dos hilos lleguen a la vez (o el módulo se recargue):
+            # dos RotatingFileHandler sobre el mismo archivo duplican líneas y pelean al rotar
+            log = logging.getLogger("pascucci.slow")
+            if not log.handlers:
+                log.propagate = False
+                h = RotatingFileHandler(SLOW_LOG, maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+                h.setFormatter(logging.Formatter("%(message)s")); log.addHandler(h)
+            _log = log
+    return _log
+
+@lru_cache(maxsize=1024)
+def normalize(sql):
+    """SQL en una línea y sin literales: misma forma -> mismo nombre en las estadísticas."""
+    sql = re.sub(r"'[^']*'", "?", " ".join(sql.split()))
+    return re.sub(r"\b\d+\b", "?", sql)
+
+class Sample:
+    def __init__(self, kind, name):
+        self.kind, self.name = kind, name
+        self.rows, self.cached, self.ms, self.peak = None, None, 0.0, None
+        self.queries = self.hits = 0
+        self._base = None   # memoria trazada al empezar (None: sin tracemalloc)
+
+def _record(s):
+    with _lock:
+        _samples[(s.kind, s.name)].append((s.ms, s.rows, s.cached, s.peak, s.queries, s.hits))
+
+@contextmanager
+def _measure(kind, name):
+    # Pico de memoria anidado: el hijo reinicia el pico de tracemalloc, así que antes se lo pasa al padre
+    if not hasattr(_local, "stack"): _local.stack = []
+    stack, s = _local.stack, Sample(kind, name)
+    parent = stack[-1] if stack and stack[-1]._base is not None else None
+    if tracemalloc.is_tracing():
+        cur, peak = tracemalloc.get_traced_memory()
+        if parent: parent.peak = max(parent.peak or 0, peak - parent._base)
+        tracemalloc.reset_peak(); s._base = cur
+    stack.append(s)
+    t = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.ms = (time.perf_counter() - t) * 1000
+        stack.pop()
+        if s._base is not None and tracemalloc.is_tracing():
+            s.peak = max(s.peak or 0, tracemalloc.get_traced_memory()[1] - s._base)
+            if parent: parent.peak = max(parent.peak or 0, s.peak + s._base - parent._base)
+        if s.peak is not None: s.peak /= 2**20
+        if kind == "sql":
+            for p in stack: p.queries += 1; p.hits += bool(s.cached)
+        _record(s)
+
+@contextmanager
+def query(sql, params=(), path=None):
+    """Mide una consulta. El llamador fija s.rows y s.cached (False si fue a la base, None sin caché)."""
+    with _measure("sql", normalize(sql)) as s:
+        yield s
+    with _lock:
+        _recent.append({"ts": datetime.now().strftime("%H:%M:%S"), "ms": round(s.ms, 1), "filas": s.rows,
+                        "caché": {True: "acierto", False: "fallo"}.get(s.cached, ""), "pico_mb": s.peak, "sql": s.name})
+    if s.ms >= SLOW_MS and not s.cached:
+        slow(sql, params, path, s)
+
+def slow(sql, params, path, s):
+    """Registra una consulta lenta con su plan en el log rotativo."""
+    try:
+        plan = [r[-1] for r in db.reader(path).execute("EXPLAIN QUERY PLAN " + sql, tuple(params)).fetchall()]
+    except Exception as e:
+        plan = [f"(sin plan: {e})"]
+    _slow_log().warning(json.dumps({"ts": datetime.now().isoformat(timespec="seconds"), "db": db.resolve(path), "ms": round(s.ms, 1),
+                                    "rows": s.rows, "peak_mb": s.peak, "sql": " ".join(sql.split()),
+                                    "params": [str(p) for p in params], "plan": plan}, ensure_ascii=False))
+
+def timed(fn):
+    """Decorador para paneles: duración, consultas que hizo (y cuántas del caché) y pico de memoria."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _measure("panel", fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def span(name):
+    with _measure("panel", name) as s:
+        yield s
+
+def stats(kind=None):
+    """p50/p95/máx (ms), n y acierto de caché por nombre; kind: 'panel' o 'sql'. En un panel, las
+    consultas son las de su última ejecución y el acierto, el de todas sus consultas."""
+    with _lock:
+        items = [(k, list(v)) for k, v in _samples.items() if kind is None or k[0] == kind]
+    rows = []
+    for (k, name), v in items:
+        ms = np.array([x[0] for x in v]); peaks = [x[3] for x in v if x[3] is not None]
+        if k == "sql":
+            cached = [x[2] for x in v if x[2] is not None]
+            hit = sum(cached) / len(cached) if cached else None
+        else:
+            n = sum(x[4] for x in v); hit = sum(x[5] for x in v) / n if n else None
+        rows.append({"tipo": k, "nombre": name, "n": len(v), "p50_ms": np.percentile(ms, 50), "p95_ms": np.percentile(ms, 95),
+                     "max_ms": ms.max(), "ultimo_ms": ms[-1], "filas": v[-1][1], "consultas": v[-1][4] if k != "sql" else None,
+                     "acierto_cache": hit, "pico_mb": max(peaks) if peaks else None})
+    cols = ["tipo", "nombre", "n", "p50_ms", "p95_ms", "max_ms", "ultimo_ms", "filas", "consultas", "acierto_cache", "pico_mb"]
+    return pd.DataFrame(rows, columns=cols).sort_values("p95_ms", ascending=False, ignore_index=True)
+
+def recent():
+    with _lock:
+        return pd.DataFrame(list(_recent)[::-1], columns=["ts", "ms", "filas", "caché", "pico_mb", "sql"])
+
+def reset():
+    with _lock:
+        _samples.clear(); _recent.clear()
+
+def slow_entries(limit=50, log=SLOW_LOG):
+    """Últimas consultas lentas del log (incluye los archivos rotados)."""
+    out = []
+    for f in [Path(f"{log}.{i}") for i in range(LOG_BACKUPS, 0, -1)] + [Path(log)]:
+        if f.exists():
+            out += [json.loads(l) for l in f.read_text(encoding="utf-8").splitlines() if l.strip()]
+    return out[-limit:][::-1]
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Resumen del log de consultas lentas")
+    ap.add_argument("--log", default=str(SLOW_LOG)); ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args()
+    e = pd.DataFrame(slow_entries(10**9, args.log))
+    if e.empty: print("Sin consultas lentas registradas"); raise SystemExit
+    e["forma"] = e["sql"].map(normalize)
+    g = e.groupby("forma").agg(n=("ms", "size"), p50_ms=("ms", "median"), max_ms=("ms", "max"), plan=("plan", "last"))
+    for forma, r in g.sort_values("max_ms", ascending=False).head(args.top).iterrows():
+        print(f"{r['n']:>4}x  p50 {r['p50_ms']:>8.0f} ms  máx {r['max_ms']:>8.0f} ms  {forma[:160]}")
+        for line in r["plan"]: print(f"        {line}")
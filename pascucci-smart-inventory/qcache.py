@@ -0,0 +1,70 @@
+import re, threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import db
+
+# Caché de consultas de lectura consciente de escrituras. Cada resultado guarda el sello
+# db.versions() de las tablas que lee y sigue siendo válido hasta que alguna cambie (escritura en
+# este proceso o commit de otro proceso); sin TTL. Desalojo LRU acotado por memoria.
+
+MAX_MB = 128
+
+@lru_cache(maxsize=1024)
+def _identifiers(sql):
+    return frozenset(w.lower() for w in re.findall(r"[A-Za-z_]\w*", sql))
+
+class QueryCache:
+    def __init__(self, max_mb=MAX_MB, path=None):
+        self.max_bytes, self.path = int(max_mb * 2**20), path
+        self._entries = OrderedDict()   # (sql, params) -> (sello, df, bytes)
+        self._bytes = 0
+        self._tables, self._tables_stamp = frozenset(), None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def _known_tables(self):
+        # El catálogo sólo se relee tras un DDL (versión "*") o un commit externo
+        stamp = db.versions((), self.path)
+        if stamp != self._tables_stamp:
+            rows = db.reader(self.path).execute("SELECT lower(name) FROM sqlite_master WHERE type IN ('table','view')").fetchall()
+            self._tables, self._tables_stamp = frozenset(r[0] for r in rows), stamp
+        return self._tables
+
+    def tables(self, sql):
+        """Tablas de las que depende una consulta (todas las que nombra: conservador)."""
+        return tuple(sorted(_identifiers(sql) & self._known_tables()))
+
+    def get(self, sql, params, load):
+        """Resultado de load() para (sql, params); copia para que el llamador pueda modificarlo."""
+        key = (sql, tuple(params))
+        stamp = db.versions(self.tables(sql), self.path)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[0] == stamp:
+                self._entries.move_to_end(key); self.hits += 1
+                return hit[1].copy()
+            self.misses += 1
+        # Fuera del lock: consultas distintas no se serializan. El sello es el de antes de leer,
+        # así una escritura concurrente deja la entrada ya vencida.
+        df = load()
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self._bytes -= old[2]
+            if size <= self.max_bytes:
+                self._entries[key] = (stamp, df, size); self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, _, b) = self._entries.popitem(last=False); self._bytes -= b; self.evictions += 1
+        return df.copy()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear(); self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "entries": len(self._entries), "mb": self._bytes / 2**20, "max_mb": self.max_bytes / 2**20,
+                    "evictions": self.evictions}
@@ -1,40 +1,52 @@
+import tempfile
 from datetime import datetime, timedelta
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import cm
 from reportlab.lib.utils import ImageReader
 from pathlib import Path
 
-def build_weekly_monthly_pdf(db_loader, out_path='resumen_pascucci.pdf', weeks=4):
-    sales = db_loader('SELECT * FROM sales')
-    if sales.empty:
+from analytics import daily_sales, weekly_monthly_from
+
+def render_line_chart(values, title, xlabel, out_png):
+    """Gráfico de línea a PNG. Sin pyplot (estado global): seguro en hilos y en un pool de procesos."""
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(range(len(values)), values)
+    ax.set_title(title); ax.set_xlabel(xlabel); ax.set_ylabel('CLP')
+    fig.savefig(out_png, bbox_inches='tight')
+    return str(out_png)
+
+def build_weekly_monthly_pdf(db_loader, out_path='resumen_pascucci.pdf', weeks=4, chart_dir=None, pool=None, progress=None, archive=None):
+    """chart_dir: carpeta de los PNG (por defecto una temporal que se borra al terminar).
+    pool: executor para dibujar los gráficos en paralelo. progress(fracción, etapa).
+    archive: archivo Parquet de la base (archive.py) para los meses cerrados."""
+    if chart_dir is None:
+        with tempfile.TemporaryDirectory(prefix='charts_') as tmp:
+            return build_weekly_monthly_pdf(db_loader, out_path, weeks, tmp, pool, progress, archive)
+    step = progress or (lambda frac, stage: None)
+    step(0.1, 'Leyendo ventas')
+    daily = daily_sales(db_loader, archive=archive)
+    if daily.empty:
         c = canvas.Canvas(out_path, pagesize=A4)
         c.drawString(3*cm, 27*cm, 'No hay ventas para generar reporte.')
         c.save()
         return out_path
 
-    sales['sold_at'] = pd.to_datetime(sales['sold_at'])
-    weekly = sales.groupby(sales['sold_at'].dt.to_period('W'))['total'].sum().reset_index()
-    monthly = sales.groupby(sales['sold_at'].dt.to_period('M'))['total'].sum().reset_index()
-
-    charts = Path('charts'); charts.mkdir(exist_ok=True)
-    w_png = charts / 'ventas_semanales.png'
-    m_png = charts / 'ventas_mensuales.png'
-
-    fig1 = plt.figure()
-    plt.plot(range(len(weekly)), weekly['total'])
-    plt.title('Ventas semanales'); plt.xlabel('Semana'); plt.ylabel('CLP')
-    fig1.savefig(w_png, bbox_inches='tight'); plt.close(fig1)
+    weekly, monthly = weekly_monthly_from(daily)
 
-    fig2 = plt.figure()
-    plt.plot(range(len(monthly)), monthly['total'])
-    plt.title('Ventas mensuales'); plt.xlabel('Mes'); plt.ylabel('CLP')
-    fig2.savefig(m_png, bbox_inches='tight'); plt.close(fig2)
+    step(0.4, 'Dibujando gráficos')
+    charts = Path(chart_dir)
+    specs = [(weekly['total'].tolist(), 'Ventas semanales', 'Semana', str(charts / 'ventas_semanales.png')),
+             (monthly['total'].tolist(), 'Ventas mensuales', 'Mes', str(charts / 'ventas_mensuales.png'))]
+    w_png, m_png = pool.map(render_line_chart, *zip(*specs)) if pool else [render_line_chart(*a) for a in specs]
 
-    total = int(sales['total'].sum())
-    last_week = int(sales[sales['sold_at']>(sales['sold_at'].max()-pd.Timedelta(days=7))]['total'].sum())
+    step(0.8, 'Armando PDF')
+    days = pd.to_datetime(daily['day'])
+    total = int(daily['total'].sum())
+    last_week = int(daily[days>(days.max()-pd.Timedelta(days=7))]['total'].sum())
 
     c = canvas.Canvas(out_path, pagesize=A4)
     c.setFont('Helvetica-Bold', 14)
@@ -51,23 +63,21 @@ def build_weekly_monthly_pdf(db_loader, out_path='resumen_pascucci.pdf', weeks=4
     c.showPage(); c.save()
     return out_path
 
-def build_executive_pdf(db_loader, out_path='resumen_ejecutivo.pdf'):
-    import pandas as pd
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.units import cm
+def build_executive_pdf(db_loader, out_path='resumen_ejecutivo.pdf', progress=None):
     from reportlab.lib import colors
     from datetime import datetime as _dt
 
-    sales = db_loader('SELECT * FROM sales')
-    if sales.empty:
+    if progress: progress(0.3, 'Leyendo ventas')
+    # Sólo el total: no hace falta traer la tabla de ventas completa
+    sales = db_loader('SELECT COUNT(*) AS n, COALESCE(SUM(total), 0) AS total FROM sales')
+    if not int(sales['n'].iloc[0]):
         c = canvas.Canvas(out_path, pagesize=A4)
         c.drawString(3*cm, 27*cm, 'Sin datos para reporte.')
         c.save()
         return out_path
 
-    sales['sold_at'] = pd.to_datetime(sales['sold_at'])
-    total = int(sales['total'].sum())
+    total = int(sales['total'].iloc[0])
+    if progress: progress(0.7, 'Armando PDF')
 
     c = canvas.Canvas(out_path, pagesize=A4)
     c.setFillColorRGB(0.886, 0.102, 0.133)  # Rojo Pascucci
@@ -0,0 +1,133 @@
+import multiprocessing as mp, os, shutil, tempfile, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import archive
+import db
+from report_pdf import build_weekly_monthly_pdf, build_executive_pdf
+
+# Servicio de reportes PDF: cada reporte se genera en un hilo de trabajo (la página sólo consulta el
+# avance), los gráficos se dibujan en un pool de procesos dentro de una carpeta propia del trabajo,
+# y el PDF queda cacheado con el sello db.versions() de las tablas que lee: regenerar sin datos
+# nuevos devuelve el mismo archivo al instante. Un PDF reemplazado por una versión nueva se borra
+# recién tras KEEP_OLD_S: otra sesión puede estar descargándolo o copiándolo a la bandeja de salida.
+
+# tipo -> (builder, tablas que lee, nombre de archivo, usa gráficos, lee del archivo Parquet si está activo)
+REPORTS = {
+    "semanal_mensual": (build_weekly_monthly_pdf, ("daily_totals", "daily_product_sales"), "resumen_pascucci.pdf", True, True),
+    "ejecutivo": (build_executive_pdf, ("sales",), "resumen_ejecutivo.pdf", False, False),
+}
+CHART_WORKERS = 2
+KEEP_OLD_S = 15 * 60
+
+class ReportJob:
+    def __init__(self, kind, future=None):
+        self.kind, self.future = kind, future or Future()
+        self.progress, self.stage, self.cached = 0.0, "En cola", False
+
+    def update(self, frac, stage):
+        self.progress, self.stage = frac, stage
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """Ruta del PDF (espera si aún se está generando)."""
+        return self.future.result(timeout)
+
+class ReportService:
+    def __init__(self, db_loader, path=None, chart_workers=CHART_WORKERS):
+        self.db_loader, self.path, self.chart_workers = db_loader, path, chart_workers
+        self.root = tempfile.mkdtemp(prefix="pascucci_reports_")
+        self._threads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reports")
+        self._pool = None
+        self._cache = {}       # tipo -> (sello, ruta del PDF)
+        self._running = {}     # (tipo, sello) -> ReportJob
+        self._old = []         # (epoch desde el que se puede borrar, carpeta de un PDF reemplazado)
+        self._lock = threading.Lock()
+
+    def _chart_pool(self):
+        # spawn: hacer fork de un proceso con hilos (Streamlit, scheduler) no es seguro
+        if self._pool is None and self.chart_workers:
+            try:
+                self._pool = ProcessPoolExecutor(self.chart_workers, mp_context=mp.get_context("spawn"))
+            except (OSError, NotImplementedError):
+                self.chart_workers = 0
+        return self._pool
+
+    def submit(self, kind):
+        """Encola la generación de `kind` (o devuelve el trabajo en curso / el PDF cacheado)."""
+        stamp = db.versions(REPORTS[kind][1], self.path)
+        with self._lock:
+            hit = self._cache.get(kind)
+            if hit and hit[0] == stamp and os.path.exists(hit[1]):
+                job = ReportJob(kind); job.cached = True
+                job.update(1.0, "Sin cambios en los datos: reporte cacheado"); job.future.set_result(hit[1])
+                return job
+            job = self._running.get((kind, stamp))
+            if job is None:
+                job = self._running[(kind, stamp)] = ReportJob(kind)
+                job.future = self._threads.submit(self._run, job, stamp)
+            return job
+
+    def get(self, kind, timeout=None):
+        """Ruta del PDF de `kind`, generándolo si hace falta (bloquea; para el scheduler)."""
+        return self.submit(kind).result(timeout)
+
+    def _run(self, job, stamp):
+        builder, _, filename, charts, archived = REPORTS[job.kind]
+        job_dir = tempfile.mkdtemp(prefix=f"{job.kind}_", dir=self.root)
+        out = os.path.join(job_dir, filename)
+        kwargs = {"progress": job.update}
+        try:
+            if charts:
+                kwargs.update(chart_dir=job_dir, pool=self._chart_pool())
+            if archived:
+                kwargs["archive"] = archive.active(self.path)
+            try:
+                builder(self.db_loader, out_path=out, **kwargs)
+            except BrokenProcessPool:
+                # Un worker murió: se descarta el pool y se dibuja en este hilo
+                self._pool = None; kwargs["pool"] = None
+                builder(self.db_loader, out_path=out, **kwargs)
+            job.update(1.0, "Listo")
+            with self._lock:
+                old = self._cache.get(job.kind)
+                self._cache[job.kind] = (stamp, out)
+                if old: self._old.append((time.time() + KEEP_OLD_S, os.path.dirname(old[1])))
+            self._purge()
+            return out
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        finally:
+            with self._lock: self._running.pop((job.kind, stamp), None)
+
+    def _purge(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            due = [d for t, d in self._old if t <= now]
+            self._old = [(t, d) for t, d in self._old if t > now]
+        for d in due: shutil.rmtree(d, ignore_errors=True)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=True)
+        if self._pool: self._pool.shutdown()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+if __name__ == "__main__":
+    import argparse, time
+    from analytics import sqlite_loader
+    ap = argparse.ArgumentParser(description="Genera un reporte PDF con el servicio de reportes")
+    ap.add_argument("kind", choices=list(REPORTS)); ap.add_argument("--db", default=db.DB)
+    ap.add_argument("--out", help="copiar el PDF a esta ruta")
+    ap.add_argument("--repeat", type=int, default=1, help="regenerar N veces (la 2ª en adelante sale de caché)")
+    args = ap.parse_args()
+    svc = ReportService(sqlite_loader(args.db), args.db)
+    try:
+        for _ in range(args.repeat):
+            t = time.perf_counter(); job = svc.submit(args.kind); pdf = job.result()
+            print(f"{pdf}  {time.perf_counter() - t:.3f}s{'  (caché)' if job.cached else ''}")
+        if args.out: shutil.copyfile(pdf, args.out); print(f"-> {args.out}")
+    finally:
+        svc.shutdown()
@@ -0,0 +1,79 @@
+import argparse
+
+import db
+from schema import epoch
+
+# daily_product_sales(day, product_id, qty, revenue, cost) y daily_totals(day, sales, total): se
+# actualizan con deltas dentro de la misma transacción que escribe sales/sale_items; rebuild() los
+# recalcula desde cero. "Ventas" es siempre SUM(sales.total) (daily_totals, como el KPI); revenue
+# por producto es la suma de líneas y sólo se usa por SKU.
+
+_UPSERT = """INSERT INTO daily_product_sales(day, product_id, qty, revenue, cost) VALUES(date(?),?,?,?,?)
+ON CONFLICT(day, product_id) DO UPDATE SET qty=qty+excluded.qty, revenue=revenue+excluded.revenue, cost=cost+excluded.cost"""
+
+_UPSERT_TOTAL = """INSERT INTO daily_totals(day, sales, total) VALUES(date(?),?,?)
+ON CONFLICT(day) DO UPDATE SET sales=sales+excluded.sales, total=total+excluded.total"""
+
+_LINE_COST = "COALESCE(si.unit_cost, p.unit_cost, 0)"
+
+def apply_sales(cur, sales, sign=1):
+    """sales: [(sold_at, [(product_id, qty, unit_price, unit_cost)])]; agrega por (día, producto)
+    y escribe con un solo executemany. sign=-1 revierte."""
+    acc = {}
+    for sold_at, lines in sales:
+        day = str(sold_at)[:10]
+        for pid, q, price, cost in lines:
+            a = acc.setdefault((day, int(pid)), [0, 0.0, 0.0])
+            a[0] += int(q); a[1] += q*float(price); a[2] += q*float(cost or 0)
+    cur.executemany(_UPSERT, [(day, pid, sign*q, sign*rev, sign*cost) for (day, pid), (q, rev, cost) in acc.items()])
+
+def apply_totals(cur, sales, sign=1):
+    """sales: [(sold_at, total)] de ventas nuevas (o borradas, sign=-1)."""
+    acc = {}
+    for sold_at, total in sales:
+        if sold_at is None: continue
+        a = acc.setdefault(str(sold_at)[:10], [0, 0.0]); a[0] += 1; a[1] += float(total or 0)
+    cur.executemany(_UPSERT_TOTAL, [(day, sign*n, sign*t) for day, (n, t) in acc.items()])
+
+def apply_lines(cur, sold_at, lines, sign=1):
+    """lines: [(product_id, qty, unit_price, unit_cost)]; sign=-1 revierte."""
+    apply_sales(cur, [(sold_at, lines)], sign)
+
+def remove_sale(cur, sale_id):
+    # Llamar antes de borrar las sale_items de la venta
+    row = cur.execute("SELECT sold_at, total FROM sales WHERE id=?", (int(sale_id),)).fetchone()
+    if not row: return
+    apply_totals(cur, [row], -1)
+    lines = cur.execute(f"""SELECT si.product_id, si.qty, si.unit_price, {_LINE_COST} FROM sale_items si
+                            LEFT JOIN products p ON p.id=si.product_id WHERE si.sale_id=?""", (int(sale_id),)).fetchall()
+    apply_lines(cur, row[0], lines, -1)
+
+def rebuild(cur, start_day=None):
+    """Recalcula el rollup completo (o desde start_day, 'YYYY-MM-DD'). No hace commit."""
+    where, params = ("WHERE day >= ?", (start_day,)) if start_day else ("", ())
+    cur.execute(f"DELETE FROM daily_product_sales {where}", params)
+    where, params = ("AND s.sold_at_epoch >= ?", (epoch(start_day),)) if start_day else ("", ())
+    cur.execute(f"""INSERT INTO daily_product_sales(day, product_id, qty, revenue, cost)
+        SELECT date(s.sold_at) AS day, si.product_id, SUM(si.qty), SUM(si.qty*si.unit_price), SUM(si.qty*{_LINE_COST})
+        FROM sale_items si JOIN sales s ON s.id=si.sale_id LEFT JOIN products p ON p.id=si.product_id
+        WHERE date(s.sold_at) IS NOT NULL {where}
+        GROUP BY date(s.sold_at), si.product_id""", params)
+    where, params = ("WHERE day >= ?", (start_day,)) if start_day else ("", ())
+    cur.execute(f"DELETE FROM daily_totals {where}", params)
+    where, params = ("AND sold_at_epoch >= ?", (epoch(start_day),)) if start_day else ("", ())
+    cur.execute(f"""INSERT INTO daily_totals(day, sales, total)
+        SELECT date(sold_at), COUNT(*), SUM(COALESCE(total, 0)) FROM sales
+        WHERE date(sold_at) IS NOT NULL {where} GROUP BY date(sold_at)""", params)
+
+if __name__ == "__main__":
+    import archive
+    ap = argparse.ArgumentParser(description="Rollup diario de ventas por producto")
+    ap.add_argument("cmd", choices=["rebuild"]); ap.add_argument("--db", default=db.DB)
+    ap.add_argument("--since", help="recalcular sólo desde este día (YYYY-MM-DD)")
+    args = ap.parse_args()
+    with db.transaction(args.db) as c:
+        rebuild(c, args.since)
+        n = c.execute("SELECT COUNT(*) FROM daily_product_sales").fetchone()[0]
+        d = c.execute("SELECT COUNT(*) FROM daily_totals").fetchone()[0]
+    archive.invalidate(args.db)
+    print(f"daily_product_sales: {n} filas; daily_totals: {d} días")
@@ -1,6 +1,8 @@
-import sys
+import multiprocessing, sys
 from streamlit.web import cli as stcli
 
 if __name__ == "__main__":
+    # En el .exe los workers de los gráficos (spawn) relanzan el ejecutable
+    multiprocessing.freeze_support()
     sys.argv = ["streamlit", "run", "app.py", "--server.port=8501", "--server.address=0.0.0.0"]
     stcli.main()
@@ -0,0 +1,63 @@
+import sqlite3, calendar
+from datetime import datetime, date
+from pathlib import Path
+
+# Migraciones versionadas: migrations/NNNN_nombre.sql, aplicadas en orden sobre init_db.sql (versión 0)
+MIGRATIONS_DIR = Path(__file__).with_name("migrations")
+
+def _statements(sql):
+    buf = ""
+    for line in sql.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            yield buf
+            buf = ""
+
+def _migrations():
+    out = []
+    for p in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        version = int(p.name.split("_", 1)[0])
+        out.append((version, p.stem, p))
+    return out
+
+def schema_version(c):
+    c.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY, name TEXT, applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    return c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(c):
+    """Aplica las migraciones pendientes; cada una en su propia transacción. Devuelve las aplicadas."""
+    applied = []
+    for version, name, path in _migrations():
+        # BEGIN IMMEDIATE serializa el arranque de varias sesiones: la segunda ve la versión ya aplicada
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= schema_version(c):
+                c.execute("COMMIT"); continue
+            for stmt in _statements(path.read_text(encoding="utf-8")):
+                c.execute(stmt)
+            c.execute("INSERT INTO schema_version(version, name) VALUES(?,?)", (version, name))
+            c.execute("COMMIT")
+            applied.append(name)
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+    return applied
+
+def generated_columns(c, table):
+    # hidden=2/3 en table_xinfo: columnas GENERATED (no se pueden insertar)
+    return {r[1] for r in c.execute(f"PRAGMA table_xinfo({table})").fetchall() if r[6] in (2, 3)}
+
+def epoch(value):
+    """Equivalente en Python de CAST(strftime('%s', value) AS INTEGER) para timestamps naive."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime) and isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    return calendar.timegm(value.timetuple())
+
+if __name__ == "__main__":
+    import sys
+    db = sys.argv[1] if len(sys.argv) > 1 else "pascucci.db"
+    with sqlite3.connect(db, isolation_level=None) as c:
+        done = migrate(c)
+        print(f"schema_version={schema_version(c)}; aplicadas: {', '.join(done) or 'ninguna'}")
@@ -1,14 +1,38 @@
-import sqlite3, random, math
+import argparse
 from datetime import datetime, timedelta
-import pandas as pd
 import numpy as np
+import db
+import fefo
+import lifecycle
 
-DB = "pascucci.db"
-random.seed(7)
-np.random.seed(7)
+# Generador de datos sintéticos. Por defecto reproduce el piloto (10 productos, 1 local, 6 meses);
+# con --skus/--stores/--years escala a bases de benchmark:
+#   python simulate.py --db bench.db --skus 300 --stores 20 --years 2 --tickets 300   (~10M líneas)
+# La demanda de cada día se genera con NumPy; cada día es una transacción: reposición de lotes,
+# ventas vía fefo.record_sales (ventas, ítems por lote, descuento de lotes y rollup consistentes)
+# y merma de los lotes que vencen al cierre.
 
-def connect():
-    return sqlite3.connect(DB)
+DB = db.DB
+
+PILOT = [
+    ("PSI-101", "Capuccino", "Bebidas", "preparado", 3, 600, 2900, 18, 1, "vaso", 12),
+    ("PSI-102", "Chocolate Caliente", "Bebidas", "preparado", 3, 700, 3000, 16, 1, "vaso", 7),
+    ("PSI-103", "Croissant", "Repostería", "empacado", 3, 750, 2300, 12, 2, "unidad", 7),
+    ("PSI-104", "Jugo de Naranja", "Bebidas", "preparado", 2, 550, 2700, 10, 4, "vaso", 6),
+    ("PSI-105", "Cheesecake Frutos del Bosque (porción)", "Repostería", "empacado", 4, 1600, 4200, 6, 2, "porción", 2),
+    ("PSI-106", "Ensalada César Romana", "Alimentos", "empacado", 2, 1900, 5200, 6, 2, "unidad", 5),
+    ("PSI-107", "Café", "Bebidas", "preparado", 3, 350, 1800, 18, 1, "vaso", 14),
+    ("PSI-108", "Copa de Helado", "Alimentos", "empacado", 4, 1200, 3800, 8, 2, "unidad", 5),
+    ("PSI-109", "Torta Chocolate (porción)", "Repostería", "empacado", 4, 1400, 3900, 6, 2, "porción", 2),
+    ("PSI-110", "Rollos estilo New York", "Repostería", "empacado", 3, 900, 3200, 8, 2, "unidad", 8),
+]
+CATEGORIES = [("Bebidas", "preparado", 1, "vaso"), ("Repostería", "empacado", 2, "unidad"),
+              ("Alimentos", "empacado", 2, "unidad"), ("Abarrotes", "empacado", 3, "unidad")]
+PAYMENTS = ["efectivo", "tarjeta", "mixto"]
+OPEN_HOUR, CLOSE_HOUR = 8, 20
+LINES_EXTRA = (3, 0.4)      # líneas por boleta = 1 + Binomial(3, 0.4) (~2,2)
+QTY_EXTRA = 0.4             # unidades por línea = 1 + Poisson(0.4)
+SAFETY = 1.15               # reposición = demanda esperada del ciclo × SAFETY
 
 def seed_settings(conn):
     cur = conn.cursor()
@@ -37,141 +61,138 @@ def seed_suppliers(conn):
         cur.execute("INSERT INTO suppliers(name, contact, frequency, notes) VALUES(?,?,?,?)", s)
     conn.commit()
 
-def seed_products(conn):
-    products = [
-        ("PSI-101", "Capuccino", "Bebidas", "preparado", 3, 600, 2900, 18, 1, "vaso"),
-        ("PSI-102", "Chocolate Caliente", "Bebidas", "preparado", 3, 700, 3000, 16, 1, "vaso"),
-        ("PSI-103", "Croissant", "Repostería", "empacado", 3, 750, 2300, 12, 2, "unidad"),
-        ("PSI-104", "Jugo de Naranja", "Bebidas", "preparado", 2, 550, 2700, 10, 4, "vaso"),
-        ("PSI-105", "Cheesecake Frutos del Bosque (porción)", "Repostería", "empacado", 4, 1600, 4200, 6, 2, "porción"),
-        ("PSI-106", "Ensalada César Romana", "Alimentos", "empacado", 2, 1900, 5200, 6, 2, "unidad"),
-        ("PSI-107", "Café", "Bebidas", "preparado", 3, 350, 1800, 18, 1, "vaso"),
-        ("PSI-108", "Copa de Helado", "Alimentos", "empacado", 4, 1200, 3800, 8, 2, "unidad"),
-        ("PSI-109", "Torta Chocolate (porción)", "Repostería", "empacado", 4, 1400, 3900, 6, 2, "porción"),
-        ("PSI-110", "Rollos estilo New York", "Repostería", "empacado", 3, 900, 3200, 8, 2, "unidad")
-    ]
-    cur = conn.cursor()
-    for p in products:
-        cur.execute("""            INSERT INTO products(sku,name,category,type,shelf_life_days,unit_cost,sale_price,min_stock,supplier_id,unit_format)
-            VALUES(?,?,?,?,?,?,?,?,?,?)
-        """, p)
+def seed_products(conn, n_skus, rng):
+    """Los 10 productos del piloto + SKUs sintéticos. Devuelve el catálogo como arrays (índice = id-1)."""
+    rows = [p[:10] for p in PILOT[:n_skus]]
+    popularity = [float(p[10]) for p in PILOT[:n_skus]]
+    for i in range(len(rows), n_skus):
+        cat, kind, supplier, fmt = CATEGORIES[int(rng.integers(len(CATEGORIES)))]
+        cost = float(rng.integers(2, 40) * 50); shelf = int(rng.choice([2, 3, 4, 7, 14, 30]))
+        rows.append((f"PSI-{1000 + i}", f"{cat} {i + 1}", cat, kind, shelf, cost, round(cost * rng.uniform(1.8, 3.5), -1),
+                     int(rng.integers(4, 20)), supplier, fmt))
+        popularity.append(8.0 / (i - 8) ** 0.8)   # cola larga tipo Zipf tras el piloto
+    conn.executemany("""INSERT INTO products(id,sku,name,category,type,shelf_life_days,unit_cost,sale_price,min_stock,supplier_id,unit_format)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?)""", [(i + 1,) + r for i, r in enumerate(rows)])
     conn.commit()
+    w = np.array(popularity)
+    return {"id": np.arange(1, n_skus + 1), "sku": [r[0] for r in rows], "shelf": np.array([r[4] for r in rows]),
+            "cost": np.array([r[5] for r in rows], dtype=float), "price": np.array([r[6] for r in rows], dtype=float),
+            "supplier": np.array([r[8] for r in rows]), "weight": w / w.sum()}
 
-def create_purchase_with_lots(conn, received_at, supplier_id, items):
-    cur = conn.cursor()
-    cur.execute("INSERT INTO purchases(received_at, supplier_id, total_cost) VALUES(?,?,?)",
-                (received_at, supplier_id, 0.0))
-    purchase_id = cur.lastrowid
-    total_cost = 0.0
-    for it in items:
-        pid = cur.execute("SELECT id, shelf_life_days FROM products WHERE sku=?", (it['sku'],)).fetchone()
-        if not pid: continue
-        product_id, sld = pid
-        expiration = (datetime.fromisoformat(received_at) + timedelta(days=sld or 3)).isoformat()
-        lot_code = f"LOT-{it['sku']}-{received_at[:10]}-{int(np.random.randint(1000,9999))}"
-        cur.execute("""            INSERT INTO lots(product_id, lot_code, received_at, expiration, qty_initial, qty_current, unit_cost, supplier_id, doc_ref, status)
-            VALUES(?,?,?,?,?,?,?,?,?,?)
-        """, (product_id, lot_code, received_at, expiration, it['qty'], it['qty'], it['unit_cost'], supplier_id, None, 'vigente'))
-        lot_id = cur.lastrowid
-        cur.execute("""            INSERT INTO purchase_items(purchase_id, product_id, lot_id, qty, unit_cost)
-            VALUES(?,?,?,?,?)
-        """, (purchase_id, product_id, lot_id, it['qty'], it['unit_cost']))
-        total_cost += it['qty'] * it['unit_cost']
-    cur.execute("UPDATE purchases SET total_cost=? WHERE id=?", (total_cost, purchase_id))
+def seed_promos(conn, start_date):
+    conn.execute("""INSERT INTO promos(name,type,value,starts_at,ends_at,notes) VALUES(?,?,?,?,?,?)""",
+                 ("Happy Hour Bebidas", "%", 15, (start_date+timedelta(weeks=8)).isoformat()+"T16:00:00",
+                  (start_date+timedelta(weeks=9)).isoformat()+"T18:00:00", "16:00-18:00 en bebidas"))
     conn.commit()
 
-def fefo_consume(conn, product_id, qty_needed):
-    cur = conn.cursor()
-    lots = cur.execute("""        SELECT id, qty_current FROM lots
-        WHERE product_id=? AND status='vigente' AND (expiration IS NULL OR expiration >= ?)
-        ORDER BY datetime(expiration) ASC
-    """, (product_id, datetime.now().isoformat())).fetchall()
-    remain = qty_needed
-    used_lots = []
-    for lot_id, qty_cur in lots:
-        if remain<=0: break
-        take = min(remain, qty_cur)
-        cur.execute("UPDATE lots SET qty_current=qty_current-? WHERE id=?", (take, lot_id))
-        used_lots.append((lot_id, take))
-        remain -= take
-    if remain>0:
-        # fallback
-        lots2 = cur.execute("""            SELECT id, qty_current FROM lots
-            WHERE product_id=? AND status='vigente'
-            ORDER BY datetime(received_at) ASC
-        """, (product_id,)).fetchall()
-        for lot_id, qty_cur in lots2:
-            if remain<=0: break
-            if qty_cur<=0: continue
-            take = min(remain, qty_cur)
-            cur.execute("UPDATE lots SET qty_current=qty_current-? WHERE id=?", (take, lot_id))
-            used_lots.append((lot_id, take))
-            remain -= take
-    conn.commit()
-    return used_lots, remain<=0
+def day_factor(d, day):
+    weekend = 1.2 if day.weekday() >= 5 else 1.0
+    return weekend * (1.0 + 0.08*np.sin(2*np.pi*d/30.0)) * (1.0 + 0.05*np.sin(2*np.pi*d/365.0))
 
-def seed_sales_mermas_promos(conn, start_date, weeks=26):
-    cur = conn.cursor()
-    # purchases every 2 weeks
-    for w in range(0, weeks, 2):
-        recv = (start_date + timedelta(days=w*7)).isoformat()
-        cost_map = dict(cur.execute("SELECT sku, unit_cost FROM products").fetchall())
-        qtys = {"PSI-101":120,"PSI-102":80,"PSI-103":80,"PSI-104":70,"PSI-105":30,"PSI-106":40,"PSI-107":130,"PSI-108":50,"PSI-109":30,"PSI-110":90}
-        items = [{"sku":sku,"qty":qtys.get(sku,40),"unit_cost":float(cost_map[sku])} for sku in cost_map.keys()]
-        create_purchase_with_lots(conn, recv+"T09:00:00", 1, items)
+def day_tickets(rng, cat, day, factor, stores, tickets):
+    """Boletas del día ordenadas por hora: [{sold_at, lines, payment_method, receipt_no}]."""
+    n_t = rng.poisson(tickets * factor, size=stores)
+    T = int(n_t.sum())
+    if T == 0: return []
+    store = np.repeat(np.arange(1, stores + 1), n_t)
+    minute = rng.integers(0, (CLOSE_HOUR - OPEN_HOUR) * 60, size=T)
+    order = np.argsort(minute, kind="stable"); minute, store = minute[order], store[order]
+    k = 1 + rng.binomial(*LINES_EXTRA, size=T)
+    ticket = np.repeat(np.arange(T), k)
+    prod = rng.choice(len(cat["weight"]), size=ticket.size, p=cat["weight"])
+    qty = 1 + rng.poisson(QTY_EXTRA, size=ticket.size)
+    # Un producto repetido en la misma boleta se suma en una línea
+    n = len(cat["weight"])
+    keys, inv = np.unique(ticket * n + prod, return_inverse=True)
+    qty = np.bincount(inv, weights=qty).astype(int); ticket, prod = keys // n, keys % n
+    bounds = np.flatnonzero(np.diff(ticket)) + 1
+    lines = list(zip((prod + 1).tolist(), qty.tolist(), cat["price"][prod].tolist(), cat["cost"][prod].tolist()))
+    pay = rng.integers(len(PAYMENTS), size=T).tolist()
+    base = datetime(day.year, day.month, day.day, OPEN_HOUR)
+    out, start = [], 0
+    for t, end in enumerate(list(bounds) + [len(lines)]):
+        out.append({"sold_at": (base + timedelta(minutes=int(minute[t]))).isoformat(), "lines": lines[start:end],
+                    "payment_method": PAYMENTS[pay[t]], "receipt_no": f"{store[t]:02d}-{day:%Y%m%d}-{t + 1:05d}"})
+        start = end
+    return out
 
-    cur.execute("""        INSERT INTO promos(name,type,value,starts_at,ends_at,notes)
-        VALUES(?,?,?,?,?,?)
-    """, ("Happy Hour Bebidas", "%", 15, (start_date+timedelta(weeks=8)).isoformat()+"T16:00:00",
-           (start_date+timedelta(weeks=9)).isoformat()+"T18:00:00", "16:00-18:00 en bebidas"))
-    conn.commit()
+def restock(cur, cat, day, due, daily_units, cycle):
+    """Lotes del día (07:00) para los productos `due`, agrupados en una compra por proveedor."""
+    received = datetime(day.year, day.month, day.day, 7).isoformat()
+    qty = np.ceil(daily_units[due] * cycle[due] * SAFETY).astype(int)
+    lot_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM lots").fetchone()[0]
+    lots, items = [], []
+    for sup in np.unique(cat["supplier"][due]).tolist():
+        sel = due[cat["supplier"][due] == sup]
+        q = qty[cat["supplier"][due] == sup]
+        cur.execute("INSERT INTO purchases(received_at, supplier_id, total_cost) VALUES(?,?,?)",
+                    (received, sup, float((q * cat["cost"][sel]).sum())))
+        purchase_id = cur.lastrowid
+        for i, n in zip(sel.tolist(), q.tolist()):
+            lot_id += 1
+            exp = (day + timedelta(days=int(cat["shelf"][i]))).isoformat() + "T07:00:00"
+            lots.append((lot_id, i + 1, f"LOT-{cat['sku'][i]}-{day:%Y%m%d}", received, exp, n, n, float(cat["cost"][i]), sup))
+            items.append((purchase_id, i + 1, lot_id, n, float(cat["cost"][i])))
+    cur.executemany("""INSERT INTO lots(id, product_id, lot_code, received_at, expiration, qty_initial, qty_current, unit_cost, supplier_id, doc_ref, status)
+        VALUES(?,?,?,?,?,?,?,?,?,NULL,'vigente')""", lots)
+    cur.executemany("INSERT INTO purchase_items(purchase_id, product_id, lot_id, qty, unit_cost) VALUES(?,?,?,?,?)", items)
 
-    means = {"PSI-101":12,"PSI-107":14,"PSI-110":8,"PSI-102":7,"PSI-103":7,"PSI-104":6,"PSI-106":5,"PSI-108":5,"PSI-105":2,"PSI-109":2}
+def expire(cur, day):
+    """Al cierre: lo que queda en lotes que vencen antes de la apertura siguiente pasa a merma."""
+    until = datetime(day.year, day.month, day.day, OPEN_HOUR) + timedelta(days=1)
+    return {r[1] for r in lifecycle.expire(cur, until, waste=True, ts=datetime(day.year, day.month, day.day, 21))}
 
-    for d in range(weeks*7):
+def seed_sales_mermas_promos(conn, cat, start_date, days, stores=1, tickets=22.0, seed=7, path=None, log=None):
+    path = path or DB
+    rng = np.random.default_rng(seed)
+    seed_promos(conn, start_date)
+    # Demanda esperada por producto y día (sin estacionalidad) para dimensionar los lotes
+    lines_per_ticket = 1 + LINES_EXTRA[0] * LINES_EXTRA[1]
+    daily_units = stores * tickets * lines_per_ticket * (1 + QTY_EXTRA) * cat["weight"] * 1.06
+    cycle = np.clip(cat["shelf"] - 1, 1, 7)
+    offset = rng.integers(0, 7, size=len(cycle))
+    # El primer lote cubre hasta la primera reposición programada de cada producto
+    first = (cycle - offset % cycle) % cycle; first[first == 0] = cycle[first == 0]
+    fefo.invalidate(path)
+    n_lines = 0
+    for d in range(days):
         day = start_date + timedelta(days=d)
-        weekend = 1.2 if day.weekday()>=5 else 1.0
-        trend = 1.0 + 0.08*np.sin(2*np.pi*d/30.0)
-        for hour in range(8,20,2):
-            sale_total = 0.0; has_items=False
-            for sku, mu in means.items():
-                mu_b = mu*weekend*trend/6.0
-                qty = int(np.random.poisson(mu_b))
-                if qty<=0: continue
-                pid, price = cur.execute("SELECT id, sale_price FROM products WHERE sku=?", (sku,)).fetchone()
-                fefo_consume(conn, pid, qty)
-                sale_total += qty*float(price)
-                has_items = True
-            if has_items:
-                ts = datetime(day.year, day.month, day.day, hour, 0, 0).isoformat()
-                cur.execute("INSERT INTO sales(sold_at, channel, payment_method, receipt_no, total) VALUES(?,?,?,?,?)",
-                            (ts,"local","mixto",None,sale_total))
-                sale_id = cur.lastrowid
-                # distribute items again for sale_items (approximate)
-                for sku, mu in means.items():
-                    mu_b = mu*weekend*trend/6.0
-                    qty = int(np.random.poisson(mu_b))
-                    if qty<=0: continue
-                    pid, price = cur.execute("SELECT id, sale_price FROM products WHERE sku=?", (sku,)).fetchone()
-                    cur.execute("INSERT INTO sale_items(sale_id, product_id, lot_id, qty, unit_price, promo_id) VALUES(?,?,?,?,?,NULL)",
-                                (sale_id, pid, None, qty, float(price)))
-        # waste for low-demand items
-        for sku, p in [("PSI-105",0.30),("PSI-109",0.28),("PSI-103",0.12),("PSI-108",0.12)]:
-            if random.random() < p*0.15:
-                pid, ucost = cur.execute("SELECT id, unit_cost FROM products WHERE sku=?", (sku,)).fetchone()
-                qty = max(1, int(np.random.poisson(2)))
-                cur.execute("""                    INSERT INTO waste(ts, product_id, lot_id, qty, unit_cost_est, reason, shift, evidence_path, approved_by)
-                    VALUES(?,?,?,?,?,?,?,?,?)
-                """, (datetime(day.year, day.month, day.day, 20, 0, 0).isoformat(), pid, None, qty, float(ucost), "caducidad", "tarde", None, "sistema"))
-    conn.commit()
+        due = np.flatnonzero((d + offset) % cycle == 0) if d else np.arange(len(cycle))
+        with db.transaction(path) as c:
+            cur = c.cursor()
+            if due.size:
+                restock(cur, cat, day, due, daily_units, first if d == 0 else cycle)
+                fefo.invalidate(path, (due + 1).tolist())
+            sales = day_tickets(rng, cat, day, day_factor(d, day), stores, tickets)
+            fefo.record_sales(cur, sales, path)
+            fefo.invalidate(path, expire(cur, day))
+        n_lines += sum(len(s["lines"]) for s in sales)
+        if log and (d + 1) % 30 == 0: log(d + 1, days, n_lines)
+    return n_lines
+
+def generate(path, skus=len(PILOT), stores=1, years=0.5, tickets=22.0, seed=7, end=None, log=None):
+    """Crea y puebla una base nueva; `end` (fecha, por defecto hoy) fija el último día simulado."""
+    conn = db.writer(path)  # db crea el esquema (init_db.sql + migraciones) al abrir
+    if conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]:
+        raise SystemExit(f"{path} ya tiene productos: usa --db con un archivo nuevo")
+    rng = np.random.default_rng(seed)
+    seed_settings(conn); seed_suppliers(conn); cat = seed_products(conn, skus, rng)
+    days = max(1, int(round(years * 364)))
+    start_date = (end or datetime.now().date()) - timedelta(days=days)
+    return seed_sales_mermas_promos(conn, cat, start_date, days, stores, tickets, seed + 1, path, log), days
 
 def main():
-    conn = connect()
-    conn.executescript(open("init_db.sql","r",encoding="utf-8").read())
-    seed_settings(conn); seed_suppliers(conn); seed_products(conn)
-    start_date = (datetime.now() - timedelta(weeks=26)).date()
-    seed_sales_mermas_promos(conn, start_date, weeks=26)
-    print("Seeded 6 months for specified products.")
+    ap = argparse.ArgumentParser(description="Genera datos sintéticos (piloto o base de benchmark)")
+    ap.add_argument("--db", default=DB); ap.add_argument("--skus", type=int, default=len(PILOT))
+    ap.add_argument("--stores", type=int, default=1); ap.add_argument("--years", type=float, default=0.5)
+    ap.add_argument("--tickets", type=float, default=22.0, help="boletas por local y día (promedio)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--end", type=lambda s: datetime.fromisoformat(s).date(), help="último día simulado (YYYY-MM-DD), por defecto hoy")
+    args = ap.parse_args()
+    t0 = datetime.now()
+    log = lambda d, total, n: print(f"\r{d}/{total} días, {n:,} líneas, {n / max((datetime.now() - t0).total_seconds(), 1e-9):,.0f} líneas/s", end="", flush=True)
+    n, days = generate(args.db, args.skus, args.stores, args.years, args.tickets, args.seed, args.end, log)
+    print(f"\n{args.db}: {args.skus} SKUs, {args.stores} local(es), {days} días, {n:,} líneas en {(datetime.now() - t0).total_seconds():.0f} s")
 
 if __name__ == "__main__":
     main()
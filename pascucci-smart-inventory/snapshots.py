@@ -0,0 +1,74 @@
+import json, threading
+from datetime import datetime
+
+
+import db
+from analytics import sqlite_loader, replenishment, liquidation, REPO_COLS, LIQ_COLS
+import forecast
+
+# Fotos de reposiciones (ROP) y liquidaciones con los parámetros por defecto de settings.
+# Las refresca un job del scheduler de la app (y `python snapshots.py`); el Dashboard las lee
+# sin recalcular y sólo calcula en vivo si el usuario cambia los parámetros.
+
+DEFAULTS = {"repo_lead_days": 3, "repo_cover_days": 7, "repo_service_z": 1.28}
+MAX_AGE_MIN = 60          # días restantes y ventana de 28 días se mueven con el reloj
+_DEPENDS = ("products", "lots", "daily_product_sales", "settings")
+
+_lock = threading.Lock()
+_last = {}                # path -> sello db.versions() de la última foto
+
+def default_params(db_loader):
+    """(lead, cover, z) desde settings."""
+    s = db_loader("SELECT key, value FROM settings WHERE key IN ('repo_lead_days','repo_cover_days','repo_service_z')")
+    vals = dict(DEFAULTS)
+    for k, v in zip(s['key'], s['value']):
+        try: vals[k] = float(v)
+        except (TypeError, ValueError): pass
+    return int(vals["repo_lead_days"]), int(vals["repo_cover_days"]), float(vals["repo_service_z"])
+
+def refresh(path=None, now=None):
+    """Recalcula ambas fotos (fuera de la transacción) y las reemplaza en una sola transacción."""
+    with _lock:
+        stamp = db.versions(_DEPENDS, path)
+        load = sqlite_loader(path)
+        now = now or datetime.now().replace(second=0, microsecond=0)
+        lead, cover, z = default_params(load)
+        stats = forecast.demand_stats(path, now.date())
+        repo, liq = replenishment(load, stats, lead, cover, z), liquidation(load, stats, now)
+        params = json.dumps({"lead": lead, "cover": cover, "z": z})
+        with db.transaction(path) as c:
+            c.execute("DELETE FROM replenishment_snapshot"); c.execute("DELETE FROM liquidation_snapshot")
+            c.executemany(f"INSERT INTO replenishment_snapshot({','.join(REPO_COLS)}) VALUES({','.join('?'*len(REPO_COLS))})",
+                          repo.astype(object).where(repo.notna(), None).itertuples(index=False, name=None))
+            c.executemany(f"INSERT INTO liquidation_snapshot({','.join(LIQ_COLS)}) VALUES({','.join('?'*len(LIQ_COLS))})",
+                          liq.astype(object).where(liq.notna(), None).itertuples(index=False, name=None))
+            c.executemany("INSERT OR REPLACE INTO snapshot_meta(name, computed_at, params) VALUES(?,?,?)",
+                          [(n, now.isoformat(), params) for n in ("replenishment", "liquidation")])
+        _last[db.resolve(path)] = (stamp, now)
+        return now
+
+def refresh_if_stale(path=None, max_age_min=MAX_AGE_MIN):
+    """Para el job periódico: sólo recalcula si cambiaron los datos de los que depende o la foto es vieja."""
+    last = _last.get(db.resolve(path))
+    if last and last[0] == db.versions(_DEPENDS, path) and (datetime.now() - last[1]).total_seconds() < max_age_min * 60:
+        return None
+    return refresh(path)
+
+def load(db_loader):
+    """(reposiciones, liquidaciones, computed_at, params) o None si aún no hay foto."""
+    meta = db_loader("SELECT computed_at, params FROM snapshot_meta WHERE name='replenishment'")
+    if meta.empty: return None
+    repo = db_loader(f"SELECT {','.join(REPO_COLS)} FROM replenishment_snapshot ORDER BY sug_repo DESC")
+    repo['necesita_repo'] = repo['necesita_repo'].astype(bool)
+    liq = db_loader(f"SELECT {','.join(LIQ_COLS)} FROM liquidation_snapshot ORDER BY exceso DESC")
+    return repo, liq, datetime.fromisoformat(meta['computed_at'].iloc[0]), json.loads(meta['params'].iloc[0])
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Recalcula las fotos de reposiciones y liquidaciones")
+    ap.add_argument("--db", default=db.DB)
+    args = ap.parse_args()
+    at = refresh(args.db)
+    r = db.reader(args.db)
+    print(f"{at:%Y-%m-%d %H:%M}: {r.execute('SELECT COUNT(*) FROM replenishment_snapshot').fetchone()[0]} reposiciones, "
+          f"{r.execute('SELECT COUNT(*) FROM liquidation_snapshot').fetchone()[0]} lotes a liquidar")
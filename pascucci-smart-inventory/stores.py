@@ -0,0 +1,143 @@
+import json, multiprocessing as mp, os, threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pandas as pd
+
+import archive
+import db
+import snapshots
+from analytics import sqlite_loader, kpis, daily_sales, weekly_monthly_from, REPO_COLS
+from backups import BACKUP_DIR
+
+# Varios locales: cada uno con su propia base SQLite (stores.json: {"nombre": "ruta.db"}; sin el
+# archivo, un solo local con db.DB). La vista de cadena (Chain) corre cada consulta en todos los
+# locales a la vez en un pool de procesos y suma los agregados parciales (ventas, costo y merma
+# se suman; ventas diarias por día; reposiciones por SKU). No se usa ATTACH: SQLite admite 10
+# bases adjuntas por conexión y una consulta adjunta corre en un solo núcleo.
+
+STORES_FILE = Path("stores.json")
+ALL = "Todas"
+MAIN = "Principal"
+WORKERS = os.cpu_count() or 1
+_KPI_TABLES = ("sales", "sale_items", "products", "waste")
+_REPO_TABLES = ("replenishment_snapshot", "snapshot_meta")
+
+def load(file=STORES_FILE):
+    """{nombre: ruta de la base} en el orden del archivo."""
+    file = Path(file)
+    if not file.exists(): return {MAIN: db.DB}
+    return dict(json.loads(file.read_text(encoding="utf-8")))
+
+def backup_dir(path):
+    # Cada local respalda en su subcarpeta (la retención va por carpeta); la base principal, en backups/
+    return BACKUP_DIR if path == db.DB else BACKUP_DIR / Path(path).stem
+
+# Parciales por local (funciones de módulo: se envían a los procesos del pool)
+
+def _kpis(path, start, end):
+    return kpis(sqlite_loader(path), start, end, archive.active(path))
+
+def _daily(path):
+    return daily_sales(sqlite_loader(path), archive=archive.active(path))
+
+def _repo(path):
+    # La foto del local (la refresca el scheduler); si aún no existe se calcula ahí mismo
+    load = sqlite_loader(path)
+    snap = snapshots.load(load)
+    if snap is None:
+        snapshots.refresh(path); snap = snapshots.load(load)
+    return snap[0], snap[2]
+
+class Chain:
+    def __init__(self, stores=None, workers=WORKERS, processes=True):
+        self.stores = dict(stores or load())
+        self.workers, self.processes = min(workers, len(self.stores)), processes
+        self._pool = None
+        self._cache = {}   # clave -> (sellos de los locales, parciales)
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # spawn, como los gráficos de reports.py: la app tiene hilos
+        if self._pool is None and self.workers > 1:
+            try:
+                self._pool = (ProcessPoolExecutor(self.workers, mp_context=mp.get_context("spawn")) if self.processes
+                              else ThreadPoolExecutor(self.workers, thread_name_prefix="stores"))
+            except (OSError, NotImplementedError):
+                self.workers = 1
+        return self._pool
+
+    def map(self, fn, *args):
+        """fn(ruta, *args) en cada local, en paralelo; resultados en el orden de los locales."""
+        paths = list(self.stores.values())
+        pool = self._executor()
+        if pool is not None:
+            try:
+                return list(pool.map(fn, paths, *([a] * len(paths) for a in args)))
+            except BrokenProcessPool:
+                self._pool = None; self.workers = 1   # un worker murió: se sigue en este hilo
+        return [fn(p, *args) for p in paths]
+
+    def _parts(self, key, tables, fn, *args):
+        # Parciales cacheados hasta que cambie alguna tabla de algún local (db.versions)
+        stamp = tuple(db.versions(tables, p) for p in self.stores.values())
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit and hit[0] == stamp: return hit[1]
+        parts = self.map(fn, *args)
+        with self._lock:
+            if len(self._cache) > 64: self._cache.clear()
+            self._cache[key] = (stamp, parts)
+        return parts
+
+    def kpis(self, start=None, end=None):
+        """(totales de la cadena, DataFrame con una fila por local)."""
+        by_store = pd.DataFrame(self._parts(("kpis", start, end), _KPI_TABLES, _kpis, start, end))
+        by_store.insert(0, "local", list(self.stores))
+        return {k: float(by_store[k].sum()) for k in ("sales", "cogs", "margin", "waste")}, by_store
+
+    def daily_sales(self):
+        parts = [d for d in self._parts(("daily",), ("daily_totals", "daily_product_sales"), _daily) if len(d)]
+        if not parts: return pd.DataFrame(columns=["day", "total", "cost"])
+        return pd.concat(parts, ignore_index=True).groupby("day", as_index=False)[["total", "cost"]].sum()
+
+    def weekly_monthly(self):
+        return weekly_monthly_from(self.daily_sales())
+
+    def replenishment(self):
+        """(reposiciones por local con columna 'local', total por SKU en la cadena, foto más antigua)."""
+        parts = self._parts(("repo",), _REPO_TABLES, _repo)
+        frames = [r.assign(local=name) for name, (r, _) in zip(self.stores, parts) if len(r)]
+        if not frames:
+            by_store = pd.DataFrame(columns=["local"] + REPO_COLS)
+        else:
+            by_store = pd.concat(frames, ignore_index=True)[["local"] + REPO_COLS]
+        by_sku = (by_store.groupby(["sku", "name", "category"], as_index=False)
+                  .agg(stock=("stock", "sum"), sug_repo=("sug_repo", "sum"), locales=("local", "nunique"))
+                  .sort_values("sug_repo", ascending=False))
+        return by_store, by_sku, min((at for _, at in parts), default=None)
+
+    def shutdown(self):
+        if self._pool: self._pool.shutdown()
+        self._pool = None
+
+if __name__ == "__main__":
+    import argparse, time
+    from analytics import PERIODS, period_range
+    ap = argparse.ArgumentParser(description="KPIs, ventas y reposiciones consolidadas de todos los locales")
+    ap.add_argument("--stores", default=str(STORES_FILE), help="JSON {nombre: ruta.db}")
+    ap.add_argument("--period", choices=PERIODS[:4], default="Todo"); ap.add_argument("--workers", type=int, default=WORKERS)
+    args = ap.parse_args()
+    chain = Chain(load(args.stores), args.workers)
+    try:
+        t = time.perf_counter()
+        total, by_store = chain.kpis(*period_range(args.period))
+        _, monthly = chain.weekly_monthly()
+        repo, by_sku, _ = chain.replenishment()
+        print(by_store.to_string(index=False))
+        print(f"\nCadena ({len(chain.stores)} locales): ventas {total['sales']:,.0f}, margen {total['margin']:,.0f}, merma {total['waste']:,.0f}")
+        print(f"{len(monthly)} meses con ventas; {len(repo)} reposiciones en {by_sku['sku'].nunique() if len(by_sku) else 0} SKUs; "
+              f"{time.perf_counter() - t:.2f}s")
+    finally:
+        chain.shutdown()